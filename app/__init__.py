@@ -1,22 +1,25 @@
 from flask import Flask, request, current_app
-from flask_session import Session
+import click
 from config import Config
 from flask_login import LoginManager
 from flask_cors import CORS  
+from app import uploads
 from app.models import User, UserGroup, UserNotifications, Recipe, RecipeIngredient, RecipeCuisine, RecipeStep, Ingredient, ShoppingList, ShoppingListItem, Cuisine, db
-import string, random
 from datetime import datetime
-import requests
+import threading
 import os
 
 login_manager = LoginManager()
 
 def create_app(config=Config):
     app = Flask(__name__)
+    # file uploads are streamed to disk, hashed and type-checked as they arrive
+    uploads.init_app(app)
     app.config.from_object(config)
-    app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static', 'uploads')
+    if not app.config.get('UPLOAD_FOLDER'):
+        app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static', 'uploads')
     #max file size for uploads
-    app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024  # 2 MB limit
+    app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024  # per request; single files are capped by UPLOAD_MAX_FILE_SIZE
     # Allow requests only from React frontend
     CORS(app, origins="http://localhost:5173", supports_credentials=True) 
     login_manager.init_app(app)
@@ -25,6 +28,63 @@ def create_app(config=Config):
 
 
     db.init_app(app)
+    if app.config.get('INSTRUMENTATION'):
+        from app.instrumentation import metrics
+        metrics.init_app(app)
+    from app.static_assets import assets
+    assets.init_app(app)
+    from app.image_mirror import mirror
+    mirror.init_app(app)
+    # tables added since the database was last populated (existing tables are left alone)
+    # are created by `flask create-tables`, or before the first request, so starting
+    # a worker never waits on the database
+    @app.cli.command('create-tables')
+    def create_tables_command():
+        """Create tables added since the database was last populated"""
+        db.create_all()
+
+    @app.cli.command('populate-database')
+    def populate_database_command():
+        """Drop every table and reseed the recipe catalogue"""
+        populate_database()
+
+    @app.cli.command('sync-catalogue')
+    @click.option('--restart', is_flag=True, help="Start over instead of resuming an interrupted sync")
+    def sync_catalogue_command(restart):
+        """Apply upstream recipe catalogue changes without touching user data"""
+        from app.catalogue import source_from_config
+        from app.catalogue_sync import sync_catalogue
+        counts = sync_catalogue(source_from_config(app.config), app.config['CATALOGUE_WORKERS'], app.config['CATALOGUE_SYNC_BATCH_SIZE'], restart)
+        print(f"Catalogue synced: {counts}")
+
+    @app.cli.command('backfill-images')
+    @click.option('--originals', is_flag=True, help="Also strip metadata from and downscale the stored originals")
+    def backfill_images_command(originals):
+        """Write thumbnail and medium variants for uploads that don't have them"""
+        from app.images import backfill
+        print(f"Images backfilled: {backfill(originals)}")
+
+    @app.cli.command('gc-uploads')
+    @click.option('--min-age', default=3600, help="Seconds an unreferenced upload is kept, so in-flight uploads survive")
+    @click.option('--legacy', is_flag=True, help="Also remove unreferenced files from before the blob store")
+    @click.option('--recount', is_flag=True, help="First recount references from the image columns (run while no uploads are in flight)")
+    def gc_uploads_command(min_age, legacy, recount):
+        """Remove uploaded files and blobs that nothing refers to"""
+        from app.blobstore import collect_garbage
+        print(f"Uploads collected: {collect_garbage(min_age, legacy, recount)}")
+
+    @app.cli.command('mirror-recipe-images')
+    @click.option('--workers', default=8, help="Remote images fetched at once")
+    def mirror_recipe_images_command(workers):
+        """Fetch recipe images from TheMealDB into the local image cache"""
+        from app.image_mirror import mirror_recipe_images
+        print(f"Recipe images mirrored: {mirror_recipe_images(workers)}")
+
+    from app.migrations import migrations_command
+    app.cli.add_command(migrations_command)
+
+    if app.config.get('CREATE_TABLES_ON_FIRST_REQUEST'):
+        create_tables_before_first_request(app)
     with app.app_context():
         # UNCOMMENT (and get rid of pass) TO REPOPULATE DATABASE
         # populate_database()
@@ -60,11 +120,26 @@ def create_app(config=Config):
     
     return app
 
+def create_tables_before_first_request(app):
+    lock = threading.Lock()
+    created = False
+
+    @app.before_request
+    def create_tables():
+        nonlocal created
+        if created:
+            return
+        with lock:
+            if not created:
+                db.create_all()
+                created = True
+
 @login_manager.user_loader
 def load_user(uid: int) -> User | None:
     return User.query.get(int(uid))
 
 def populate_database():
+    from app.catalogue import import_catalogue, source_from_config
     db.drop_all()
     db.create_all()
 
@@ -73,93 +148,15 @@ def populate_database():
     username = "ADMIN", profile_picture = "", xp_points = 0, user_level = 1, # type: ignore
     is_admin = True, num_recipes_completed = 0, colonial_floor = 'ADMIN', # type: ignore
     colonial_side = 'ADMIN', date_created = datetime.utcnow(), last_logged_in = datetime.utcnow(), # type: ignore
-    num_reports = 0, password = "password") # type: ignore
+    num_reports = 0, is_super_admin = True, is_banned = False, hasLeveled = False, # type: ignore
+    password = "password") # type: ignore
     db.session.add(admin)
-
-    for char in string.ascii_lowercase:
-        url = f"https://www.themealdb.com/api/json/v1/1/search.php?f={char}"
-        recipes = fetch_recipes(url)
-        save_recipes_to_db(recipes)
-
-def fetch_recipes(api_url):
-    response = requests.get(api_url)
-    if response.status_code == 200:
-        return response.json().get("meals", [])
-    else:
-        raise Exception(f"Failed to fetch data: {response.status_code}")
-
-def save_recipes_to_db(recipes):
-    if not recipes:
-        return
-    for recipe_data in recipes:
-        # Recipe
-        difficulty = random.randint(1, 5)
-        recipe = Recipe(
-            recipe_name=recipe_data["strMeal"],  # type: ignore
-            difficulty=str(difficulty),  # type: ignore
-            xp_amount=100*difficulty,  # type: ignore
-            rating=0,  # type: ignore
-            image=recipe_data["strMealThumb"],  # type: ignore
-            category=recipe_data["strCategory"], # type: ignore
-            youtube_url=recipe_data["strYoutube"] # type: ignore
-        )
-        db.session.add(recipe)
-        db.session.flush()
-
-        # RecipeSteps
-        steps = recipe_data["strInstructions"].split('. ')
-        for i, step in enumerate(steps, start=1):
-            if step.strip():
-                recipe_step = RecipeStep(
-                    recipe_id=recipe.id,  # type: ignore
-                    step_number=i,  # type: ignore
-                    step_description=step.strip()  # type: ignore
-                )
-                db.session.add(recipe_step)
-
-        # Ingredients
-        for i in range(1, 21):
-            ingredient_name = recipe_data.get(f"strIngredient{i}")
-            # End early if ingredient is empty
-            if not ingredient_name or ingredient_name == "":
-                break
-            measure = recipe_data.get(f"strMeasure{i}")
-            if ingredient_name and ingredient_name.strip():
-                # Ensure Ingredient exists
-                ingredient = Ingredient.query.filter_by(ingredient_name=ingredient_name.strip()).first()
-                if not ingredient:
-                    ingredient = Ingredient(ingredient_name=ingredient_name.strip()) # type: ignore
-                    db.session.add(ingredient)
-                    db.session.flush()
-
-                # RecipeIngredients
-                recipe_ingredient = RecipeIngredient(
-                    recipe_id=recipe.id,  # type: ignore
-                    ingredient_id=ingredient.id, # type: ignore
-                    ingredient_name=ingredient_name.strip(), # type: ignore
-                    measure=measure  # type: ignore
-                )
-                db.session.merge(recipe_ingredient)
-
-        # Cuisines
-        cuisine_name = recipe_data.get("strArea")
-        if cuisine_name:
-            # Ensure Cuisine exists
-            cuisine = Cuisine.query.filter_by(name=cuisine_name.strip()).first()
-            if not cuisine:
-                cuisine = Cuisine(name=cuisine_name.strip()) # type: ignore
-                db.session.add(cuisine)
-                db.session.flush()
-
-            # RecipeCuisines
-            recipe_cuisine = RecipeCuisine(
-                recipe_id=recipe.id,  # type: ignore
-                cuisine_id=cuisine.id # type: ignore
-            )
-            db.session.add(recipe_cuisine)
-
     db.session.commit()
 
+    # TheMealDB (or CATALOGUE_SOURCE), fetched concurrently and bulk inserted, see app/catalogue.py;
+    # `flask sync-catalogue` refreshes it later without dropping anything
+    import_catalogue(source_from_config(current_app.config), current_app.config.get('CATALOGUE_WORKERS', 8))
+
 
 def create_dummy_invite():
     # Create a new UserNotifications object
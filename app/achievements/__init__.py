@@ -8,4 +8,4 @@ templates_dir: str = os.path.join(bp_dir, 'templates')
 bp = Blueprint('achievements', __name__, 
                template_folder=templates_dir)
 
-from app.achievements import routes
\ No newline at end of file
+from app.achievements import routes, handlers
\ No newline at end of file
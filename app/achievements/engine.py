@@ -0,0 +1,147 @@
+from __future__ import annotations
+from typing import Callable, NamedTuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.models import Achievement, User, UserAchievement, UserNotifications, db
+import math
+import threading
+
+# Achievement engine: routes report what happened (an event plus its context)
+# and every rule triggered by it is evaluated and awarded in the caller's
+# transaction. Nothing here commits.
+
+# XP granted with every achievement
+ACHIEVEMENT_XP = 100
+
+# events routes report
+RECIPE_COMPLETED = 'recipe_completed'
+CUISINE_COMPLETED = 'cuisine_completed'
+REVIEW_POSTED = 'review_posted'
+FRIEND_ADDED = 'friend_added'
+PROFILE_PICTURE_CHANGED = 'profile_picture_changed'
+RECIPES_SEARCHED = 'recipes_searched'
+
+# key used to collect awards on a session until it commits
+AWARDED_KEY = 'achievements_awarded'
+
+# recipe id of the recipe with its own achievement
+SPECIAL_RECIPE_ID = 229
+
+class Rule(NamedTuple):
+    achievement_id: int
+    event: str
+    applies: Callable[[dict], bool]
+
+RULES = [
+    Rule(1, RECIPE_COMPLETED, lambda context: context['num_recipes_completed'] >= 1),
+    Rule(6, RECIPE_COMPLETED, lambda context: context['num_recipes_completed'] >= 10),
+    Rule(7, RECIPE_COMPLETED, lambda context: context['num_recipes_completed'] >= 50),
+    Rule(5, RECIPE_COMPLETED, lambda context: context['recipe_id'] == SPECIAL_RECIPE_ID),
+    Rule(12, RECIPE_COMPLETED, lambda context: str(context['difficulty']) == "5"),
+    Rule(2, CUISINE_COMPLETED, lambda context: context['cuisines_completed'] >= 3),
+    Rule(10, CUISINE_COMPLETED, lambda context: context['cuisines_completed'] >= 29),
+    Rule(9, REVIEW_POSTED, lambda context: str(context['rating']) == "0.5"),
+    Rule(8, REVIEW_POSTED, lambda context: str(context['rating']) == "5"),
+    Rule(4, FRIEND_ADDED, lambda context: True),
+    Rule(11, PROFILE_PICTURE_CHANGED, lambda context: True),
+    Rule(13, RECIPES_SEARCHED, lambda context: context['query'] == "easter egg"),
+]
+
+RULES_BY_EVENT: dict[str, list[Rule]] = {}
+for rule in RULES:
+    RULES_BY_EVENT.setdefault(rule.event, []).append(rule)
+
+
+def level_for_xp(xp_points: int) -> int:
+    return math.floor(.1 * math.sqrt(.1 * xp_points)) + 1
+
+def apply_level(user: User) -> None:
+    """Recompute a user's level from their XP and flag a level up"""
+    level = level_for_xp(user.xp_points)
+    if level != user.user_level:
+        user.user_level = level
+        user.hasLeveled = 1
+
+
+class AwardedIndex:
+    """Achievements known to be awarded, per user.
+
+    Awards are never taken back, so a hit saves the existence query; a miss
+    always falls through to the database.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.awarded: dict[int, set[int]] = {}
+
+    def unknown(self, user_id: int, achievement_ids: list[int]) -> list[int]:
+        with self.lock:
+            known = self.awarded.get(user_id, set())
+            return [achievement_id for achievement_id in achievement_ids if achievement_id not in known]
+
+    def add(self, user_id: int, achievement_ids) -> None:
+        with self.lock:
+            self.awarded.setdefault(user_id, set()).update(achievement_ids)
+
+
+awarded_index = AwardedIndex()
+
+
+def evaluate(user_id: int, event_name: str, **context) -> list[int]:
+    """Award every achievement `event_name` triggers for a user; returns the newly awarded ids"""
+    triggered = [rule.achievement_id for rule in RULES_BY_EVENT.get(event_name, []) if rule.applies(context)]
+    return grant(user_id, triggered)
+
+def grant(user_id: int, achievement_ids: list[int]) -> list[int]:
+    """Award the achievements a user doesn't have yet, with their notifications, XP and level"""
+    candidates = awarded_index.unknown(user_id, list(dict.fromkeys(achievement_ids)))
+    if not candidates:
+        return []
+
+    # one lookup on the (achievement_id, user_id) primary key for all of them
+    owned = {achievement_id for (achievement_id,) in db.session.query(UserAchievement.achievement_id).filter(
+        UserAchievement.user_id == user_id,
+        UserAchievement.achievement_id.in_(candidates)
+    )}
+    # rows this transaction added itself are only remembered once it commits
+    pending = {achievement_id for pending_user_id, ids in db.session.info.get(AWARDED_KEY, []) if pending_user_id == user_id for achievement_id in ids}
+    awarded_index.add(user_id, owned - pending)
+    missing = [achievement_id for achievement_id in candidates if achievement_id not in owned]
+    if not missing:
+        return []
+
+    titles = dict(db.session.query(Achievement.id, Achievement.title).filter(Achievement.id.in_(missing)).all())
+    new = [achievement_id for achievement_id in missing if achievement_id in titles]
+    if not new:
+        return []
+
+    user = db.session.get(User, user_id)
+    if user is None:
+        return []
+    db.session.add_all([UserAchievement(achievement_id=achievement_id, user_id=user_id) for achievement_id in new])  # type: ignore
+    db.session.add_all([
+        UserNotifications(
+            user_id=user_id,  # type: ignore
+            notification_text=f"You have earned a new achievement: {titles[achievement_id]}.",  # type: ignore
+            notification_type='achievement',  # type: ignore
+            achievement_id=achievement_id  # type: ignore
+        )
+        for achievement_id in new
+    ])
+    # incremented in SQL: awards may be granted by a background handler while the user keeps earning XP
+    user.xp_points = User.xp_points + ACHIEVEMENT_XP * len(new)
+    db.session.flush()
+    apply_level(user)
+
+    db.session.info.setdefault(AWARDED_KEY, []).append((user_id, new))
+    return new
+
+
+# Only remember awards once they are committed
+@event.listens_for(Session, 'after_commit')
+def _index_awarded(session):
+    for user_id, achievement_ids in session.info.pop(AWARDED_KEY, []):
+        awarded_index.add(user_id, achievement_ids)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_awarded(session):
+    session.info.pop(AWARDED_KEY, None)
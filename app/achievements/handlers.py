@@ -0,0 +1,25 @@
+from __future__ import annotations
+from app.achievements.engine import CUISINE_COMPLETED, FRIEND_ADDED, RECIPE_COMPLETED, REVIEW_POSTED, evaluate
+from app.events import FriendAccepted, RecipeCompleted, ReviewPosted, subscribe
+from app.models import UserCuisinePreference
+
+# Achievement checks run off the request path, after the action that triggers them committed
+
+@subscribe(RecipeCompleted)
+def recipe_completed(event: RecipeCompleted):
+    evaluate(event.user_id, RECIPE_COMPLETED, recipe_id=event.recipe_id, difficulty=event.difficulty, num_recipes_completed=event.num_recipes_completed)
+    if event.cuisine_ids:
+        cuisines_completed = UserCuisinePreference.query.filter(
+            UserCuisinePreference.user_id == event.user_id,
+            UserCuisinePreference.numComplete > 0
+        ).count()
+        evaluate(event.user_id, CUISINE_COMPLETED, cuisines_completed=cuisines_completed)
+
+@subscribe(ReviewPosted)
+def review_posted(event: ReviewPosted):
+    evaluate(event.user_id, REVIEW_POSTED, rating=event.rating)
+
+@subscribe(FriendAccepted)
+def friend_accepted(event: FriendAccepted):
+    evaluate(event.requested_by, FRIEND_ADDED)
+    evaluate(event.accepted_by, FRIEND_ADDED)
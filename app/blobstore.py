@@ -0,0 +1,203 @@
+from __future__ import annotations
+from collections import Counter
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import delete, event, insert, inspect, select, update
+from sqlalchemy.orm import Session, object_session
+from app.images import UPLOADS_PREFIX, delete_image, is_variant, save_image
+from app.models import Challenge, Recipe, RecipeList, Review, UploadBlob, User, UserGroup, db
+from app.uploads import upload_digest
+import os
+import re
+import time
+
+# Uploaded images are stored once per distinct content, named by the SHA-256
+# of the uploaded bytes (static/uploads/<digest>.<ext>). An upload whose digest
+# is already stored reuses that file without decoding it again.
+#
+# UploadBlob.refcount counts the rows whose image column points at the blob.
+# Mapper events below keep it in step, in the same transaction as the insert,
+# update or delete that adds or drops a reference; rows the database deletes
+# by ON DELETE CASCADE are released when their parent is deleted. Once a
+# transaction that dropped the last reference commits, the blob's row, file
+# and variants are removed. `flask gc-uploads` sweeps blob files nothing
+# refers to (uploads of a request that failed after saving its image), with
+# --recount it first recounts every blob from the reference columns, and with
+# --legacy it also removes the pre-blob files migration 0002 left behind.
+
+# (model, column) holding paths of uploaded images
+REFERENCES = (
+    (User, 'profile_picture'),
+    (UserGroup, 'image'),
+    (Review, 'image'),
+    (Challenge, 'image'),
+    (RecipeList, 'image'),
+)
+# (parent, model in REFERENCES, foreign key) where deleting the parent deletes the
+# referring rows through ON DELETE CASCADE, without mapper events for them
+DATABASE_CASCADES = (
+    (Recipe, Review, 'recipe_id'),
+)
+# digests of blobs released by a session, checked for garbage once it commits
+RELEASED_KEY = 'upload_blobs_released'
+BLOB_NAME = re.compile(r'^([0-9a-f]{64})\.[a-z]+$')
+# files that aren't uploads: the default for rows without an image, and artwork the frontend links to directly
+SHARED_FILES = {'default_image.jpg', '2cc38bfefa3a4e26b89ac081ff6cf7df_cook.jpg'}
+
+
+def blob_digest(path: str | None) -> str | None:
+    """The digest of a content-addressed upload path, None for anything else"""
+    if not path or not path.startswith(UPLOADS_PREFIX):
+        return None
+    match = BLOB_NAME.match(os.path.basename(path))
+    return match.group(1) if match else None
+
+def store_image(file) -> str:
+    """Store an uploaded image unless identical content already is; returns its path as saved on the models"""
+    digest = upload_digest(file)
+    # locked until this request commits, so the blob can't be collected before our reference is counted
+    blob = db.session.query(UploadBlob).filter_by(digest=digest).with_for_update().first()
+    if blob is not None and os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], blob.filename)):
+        return os.path.join(UPLOADS_PREFIX, blob.filename)
+    return save_image(file, digest)
+
+
+def acquire(connection, path: str | None) -> None:
+    digest = blob_digest(path)
+    if digest is None:
+        return
+    counted = connection.execute(update(UploadBlob).where(UploadBlob.digest == digest).values(refcount=UploadBlob.refcount + 1))
+    if counted.rowcount == 0:
+        filename = os.path.basename(path)  # type: ignore
+        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+        size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        connection.execute(insert(UploadBlob).values(digest=digest, filename=filename, size=size, refcount=1, created_at=datetime.now()))
+
+def release(connection, session: Session | None, path: str | None) -> None:
+    digest = blob_digest(path)
+    if digest is None:
+        return
+    connection.execute(update(UploadBlob).where(UploadBlob.digest == digest).values(refcount=UploadBlob.refcount - 1))
+    if session is not None:
+        session.info.setdefault(RELEASED_KEY, set()).add(digest)
+
+def collect(digests) -> int:
+    """Remove the blobs among `digests` that nothing refers to any more; returns how many were removed"""
+    removed = 0
+    for digest in digests:
+        with db.engine.begin() as connection:
+            filename = connection.execute(select(UploadBlob.filename).where(UploadBlob.digest == digest)).scalar()
+            deleted = connection.execute(delete(UploadBlob).where(UploadBlob.digest == digest, UploadBlob.refcount <= 0))
+            if filename is not None and deleted.rowcount:
+                # while the row is still locked, so an upload of the same content waits and then writes it again
+                delete_image(os.path.join(UPLOADS_PREFIX, filename))
+                removed += 1
+    return removed
+
+
+def _register(model, column: str) -> None:
+    attribute = getattr(model, column)
+
+    # load the old value when the column is assigned, so the update below knows which blob it released
+    @event.listens_for(attribute, 'set', active_history=True)
+    def _load_old_value(target, value, oldvalue, initiator):
+        pass
+
+    @event.listens_for(model, 'after_insert')
+    def _inserted(mapper, connection, target):
+        acquire(connection, getattr(target, column))
+
+    @event.listens_for(model, 'after_update')
+    def _updated(mapper, connection, target):
+        history = inspect(target).attrs[column].history
+        if not history.has_changes():
+            return
+        for path in history.deleted:
+            release(connection, object_session(target), path)
+        for path in history.added:
+            acquire(connection, path)
+
+    @event.listens_for(model, 'before_delete')
+    def _deleted(mapper, connection, target):
+        path = inspect(target).dict.get(column)
+        if path is None:
+            path = connection.execute(select(attribute).where(mapper.primary_key[0] == target.id)).scalar()
+        release(connection, object_session(target), path)
+
+def _register_cascade(parent, model, foreign_key: str) -> None:
+    attribute = getattr(model, dict(REFERENCES)[model])
+
+    @event.listens_for(parent, 'before_delete')
+    def _parent_deleted(mapper, connection, target):
+        session = object_session(target)
+        for (path,) in connection.execute(select(attribute).where(getattr(model, foreign_key) == target.id, attribute.is_not(None))):
+            release(connection, session, path)
+
+for model, column in REFERENCES:
+    _register(model, column)
+for parent, model, foreign_key in DATABASE_CASCADES:
+    _register_cascade(parent, model, foreign_key)
+
+@event.listens_for(Session, 'after_commit')
+def _collect_released(session):
+    digests = session.info.pop(RELEASED_KEY, None)
+    if digests:
+        collect(digests)
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_released(session):
+    session.info.pop(RELEASED_KEY, None)
+
+
+def referenced_paths() -> set[str]:
+    paths = set()
+    for model, column in REFERENCES:
+        attribute = getattr(model, column)
+        paths.update(path for (path,) in db.session.query(attribute).filter(attribute.like(f"{UPLOADS_PREFIX}%")))
+    return paths
+
+def recount(connection) -> int:
+    """Set every blob's refcount from the reference columns, adding rows for referenced files
+    without one; returns the number of blobs referenced"""
+    refcounts: Counter[str] = Counter()
+    for model, column in REFERENCES:
+        attribute = getattr(model, column)
+        paths = connection.execute(select(attribute).where(attribute.like(f"{UPLOADS_PREFIX}%"))).scalars()
+        refcounts.update(os.path.basename(path) for path in paths if blob_digest(path) is not None)
+    existing = {digest for (digest,) in connection.execute(select(UploadBlob.digest))}
+    folder = current_app.config['UPLOAD_FOLDER']
+    connection.execute(update(UploadBlob).values(refcount=0))
+    for filename, refcount in refcounts.items():
+        digest = blob_digest(os.path.join(UPLOADS_PREFIX, filename))
+        if digest in existing:
+            connection.execute(update(UploadBlob).where(UploadBlob.digest == digest).values(refcount=refcount))
+            continue
+        path = os.path.join(folder, filename)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        connection.execute(insert(UploadBlob).values(digest=digest, filename=filename, size=size, refcount=refcount, created_at=datetime.now()))
+    return len(refcounts)
+
+def collect_garbage(min_age: float = 3600, legacy: bool = False, recount_first: bool = False) -> dict:
+    """Remove unreferenced blobs and blob files older than `min_age` seconds that nothing refers to,
+    and with `legacy` other unreferenced files in the uploads folder too"""
+    if recount_first:
+        # counts of references dropped behind the mapper events' back; a reference added meanwhile could be missed,
+        # so this is meant for a quiet moment
+        with db.engine.begin() as connection:
+            recount(connection)
+    counts = {"blobs": collect([digest for (digest,) in db.session.query(UploadBlob.digest).filter(UploadBlob.refcount <= 0)]), "files": 0}
+    db.session.commit()
+    folder = current_app.config['UPLOAD_FOLDER']
+    keep = {os.path.basename(path) for path in referenced_paths()} | SHARED_FILES
+    keep.update(filename for (filename,) in db.session.query(UploadBlob.filename))
+    cutoff = time.time() - min_age
+    for filename in sorted(os.listdir(folder)):
+        path = os.path.join(folder, filename)
+        if is_variant(filename) or filename in keep or not os.path.isfile(path) or os.path.getmtime(path) > cutoff:
+            continue
+        if not legacy and blob_digest(os.path.join(UPLOADS_PREFIX, filename)) is None and not filename.endswith('.part'):
+            continue
+        # in-flight uploads are younger than the cutoff; anything older was left by a failed request
+        delete_image(os.path.join(UPLOADS_PREFIX, filename))
+        counts["files"] += 1
+    return counts
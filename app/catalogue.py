@@ -0,0 +1,216 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+from sqlalchemy import func, insert
+from app.models import Cuisine, Ingredient, Recipe, RecipeCuisine, RecipeIngredient, RecipeSource, RecipeStep, db
+from app.recommendations import refresh_recipe_scores
+import hashlib
+import json
+import os
+import random
+import string
+import sys
+import threading
+
+# Recipe catalogue import. Pages of meals are fetched concurrently from a
+# source and written in the source's page order, so recipe and cuisine ids come
+# out the same on every run (login's cuisine mapping and the achievement
+# engine's SPECIAL_RECIPE_ID rely on them): one transaction per page, one multi-row
+# INSERT per table. Ingredient and cuisine names are resolved through
+# in-memory name -> id dictionaries and new rows get their ids assigned here,
+# so nothing has to be queried or flushed per row. Every recipe gets a
+# RecipeSource row (upstream id and content hash) for app/catalogue_sync.py.
+#
+# Sources only need pages() and fetch(page):
+#   MealDBSource(url)        TheMealDB search API, or a local server speaking the same JSON
+#   FixtureSource(directory) <page>.json files, e.g. a saved copy of the API for offline seeding
+
+MEALDB_URL = "https://www.themealdb.com/api/json/v1/1"
+FETCH_TIMEOUT = 10
+DEFAULT_WORKERS = 8
+# TheMealDB lists at most 20 ingredients per meal
+MAX_INGREDIENTS = 20
+
+class CatalogueSource:
+    def pages(self) -> list[str]:
+        raise NotImplementedError
+
+    def fetch(self, page: str) -> list[dict]:
+        raise NotImplementedError
+
+class MealDBSource(CatalogueSource):
+    """Meals by first letter from TheMealDB (or anything serving its search.php)"""
+    def __init__(self, base_url: str = MEALDB_URL):
+        self.base_url = base_url.rstrip('/')
+        self.local = threading.local()
+
+    def pages(self) -> list[str]:
+        return list(string.ascii_lowercase)
+
+    def fetch(self, page: str) -> list[dict]:
+        import requests
+        # one keep-alive session per fetching thread
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        response = session.get(f"{self.base_url}/search.php", params={"f": page}, timeout=FETCH_TIMEOUT)
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch data: {response.status_code}")
+        return response.json().get("meals") or []
+
+class FixtureSource(CatalogueSource):
+    """Pages saved as <page>.json in the TheMealDB response format"""
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def pages(self) -> list[str]:
+        return sorted(name[:-len('.json')] for name in os.listdir(self.directory) if name.endswith('.json'))
+
+    def fetch(self, page: str) -> list[dict]:
+        with open(os.path.join(self.directory, f"{page}.json")) as fin:
+            return json.load(fin).get("meals") or []
+
+def source_from_config(config) -> CatalogueSource:
+    location = config.get('CATALOGUE_SOURCE') or MEALDB_URL
+    if os.path.isdir(location):
+        return FixtureSource(location)
+    return MealDBSource(location)
+
+
+def fetch_pages(source: CatalogueSource, workers: int = DEFAULT_WORKERS, pages: list[str] | None = None) -> Iterator[tuple[str, list[dict]]]:
+    """(page, meals) for every page of the source (or just `pages`), in page order; later pages download meanwhile"""
+    pages = source.pages() if pages is None else pages
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='catalogue') as executor:
+        yield from zip(pages, executor.map(source.fetch, pages))
+
+
+def normalize_meal(meal: dict) -> dict:
+    """What the catalogue keeps of an upstream meal, in a stable shape that can be hashed"""
+    # numbered as in the instructions, so a blank sentence leaves a gap
+    steps = [[i, step.strip()] for i, step in enumerate((meal.get("strInstructions") or '').split('. '), start=1) if step.strip()]
+
+    ingredients = {}
+    for i in range(1, MAX_INGREDIENTS + 1):
+        ingredient_name = (meal.get(f"strIngredient{i}") or '').strip()
+        # End early if ingredient is empty
+        if not ingredient_name:
+            break
+        measure = meal.get(f"strMeasure{i}") or ''
+        # the same ingredient and measure twice in a meal is one row
+        ingredients.setdefault((ingredient_name.lower(), measure), [ingredient_name, measure])
+
+    return {
+        "recipe_name": meal["strMeal"],
+        "image": meal["strMealThumb"],
+        "category": meal["strCategory"],
+        "youtube_url": meal["strYoutube"],
+        "steps": steps,
+        "ingredients": list(ingredients.values()),
+        "cuisine": (meal.get("strArea") or '').strip() or None,
+    }
+
+def content_hash(recipe: dict) -> str:
+    return hashlib.sha256(json.dumps(recipe, sort_keys=True).encode()).hexdigest()
+
+def recipe_columns(recipe: dict) -> dict:
+    """The Recipe columns taken from upstream; difficulty, xp and rating are ours"""
+    return {key: recipe[key] for key in ("recipe_name", "image", "category", "youtube_url")}
+
+
+class CatalogueImporter:
+    def __init__(self):
+        self.load()
+        self.recipes_imported = 0
+
+    def load(self) -> None:
+        """Read the name -> id dictionaries and the next free ids from the database"""
+        # keyed case-insensitively, like the database's own name comparisons
+        self.ingredient_ids = {name.lower(): id for id, name in db.session.query(Ingredient.id, Ingredient.ingredient_name)}
+        self.cuisine_ids = {name.lower(): id for id, name in db.session.query(Cuisine.id, Cuisine.name)}
+        self.reserve_ids()
+
+    def reserve_ids(self) -> None:
+        self.next_recipe_id = (db.session.query(func.max(Recipe.id)).scalar() or 0) + 1
+        self.next_ingredient_id = (db.session.query(func.max(Ingredient.id)).scalar() or 0) + 1
+        self.next_cuisine_id = (db.session.query(func.max(Cuisine.id)).scalar() or 0) + 1
+
+    def ingredient_id(self, name: str, new_rows: list[dict]) -> int:
+        id = self.ingredient_ids.get(name.lower())
+        if id is None:
+            id = self.ingredient_ids[name.lower()] = self.next_ingredient_id
+            self.next_ingredient_id += 1
+            new_rows.append({"id": id, "ingredient_name": name})
+        return id
+
+    def cuisine_id(self, name: str, new_rows: list[dict]) -> int:
+        id = self.cuisine_ids.get(name.lower())
+        if id is None:
+            id = self.cuisine_ids[name.lower()] = self.next_cuisine_id
+            self.next_cuisine_id += 1
+            new_rows.append({"id": id, "name": name})
+        return id
+
+    @staticmethod
+    def new_tables() -> dict:
+        # parents before the rows referring to them
+        return {Cuisine: [], Ingredient: [], Recipe: [], RecipeStep: [], RecipeIngredient: [], RecipeCuisine: [], RecipeSource: []}
+
+    def add_recipe(self, tables: dict, recipe: dict, source_key: str, page: str) -> int:
+        recipe_id = self.next_recipe_id
+        self.next_recipe_id += 1
+        difficulty = random.randint(1, 5)
+        tables[Recipe].append({"id": recipe_id, "difficulty": str(difficulty), "xp_amount": 100 * difficulty, "rating": 0, **recipe_columns(recipe)})
+        self.add_contents(tables, recipe_id, recipe)
+        tables[RecipeSource].append({"recipe_id": recipe_id, "source_key": source_key, "page": page, "content_hash": content_hash(recipe)})
+        return recipe_id
+
+    def add_contents(self, tables: dict, recipe_id: int, recipe: dict) -> None:
+        """Rows for the steps, ingredients and cuisine of a recipe"""
+        for step_number, step_description in recipe["steps"]:
+            tables[RecipeStep].append({"recipe_id": recipe_id, "step_number": step_number, "step_description": step_description})
+        for ingredient_name, measure in recipe["ingredients"]:
+            tables[RecipeIngredient].append({
+                "recipe_id": recipe_id,
+                "ingredient_id": self.ingredient_id(ingredient_name, tables[Ingredient]),
+                "ingredient_name": ingredient_name,
+                "measure": measure,
+            })
+        if recipe["cuisine"]:
+            tables[RecipeCuisine].append({"recipe_id": recipe_id, "cuisine_id": self.cuisine_id(recipe["cuisine"], tables[Cuisine])})
+
+    @staticmethod
+    def write(tables: dict) -> None:
+        for model, rows in tables.items():
+            if rows:
+                db.session.execute(insert(model).values(rows))
+
+    def save(self, page: str, meals: list[dict]) -> None:
+        """Insert one page of meals in a single transaction"""
+        tables = self.new_tables()
+        recipe_ids = [self.add_recipe(tables, normalize_meal(meal), str(meal["idMeal"]), page) for meal in meals]
+        self.write(tables)
+        # featured recipe scores of users already materialized
+        refresh_recipe_scores(recipe_ids)
+        db.session.commit()
+        self.recipes_imported += len(meals)
+
+
+def import_catalogue(source: CatalogueSource, workers: int = DEFAULT_WORKERS) -> int:
+    """Import every page of `source` and return the number of recipes added"""
+    importer = CatalogueImporter()
+    try:
+        for page, meals in fetch_pages(source, workers):
+            importer.save(page, meals)
+            print(f"Imported {len(meals)} recipes from page {page}")
+    finally:
+        catalogue_changed()
+    return importer.recipes_imported
+
+def catalogue_changed() -> None:
+    """Drop in-memory views of the catalogue; bulk inserts bypass the ORM events that usually do this"""
+    from app.search import recipe_index
+    recipe_index.invalidate()
+    # only loaded when the numpy recommender is in use
+    vector_scoring = sys.modules.get('app.vector_scoring')
+    if vector_scoring is not None:
+        vector_scoring.vector_scorer.invalidate()
@@ -0,0 +1,197 @@
+from __future__ import annotations
+from datetime import datetime
+from sqlalchemy import delete, false, or_, update
+from app.catalogue import CatalogueImporter, CatalogueSource, catalogue_changed, content_hash, fetch_pages, normalize_meal, recipe_columns, DEFAULT_WORKERS
+from app.models import (CatalogueSyncPage, CatalogueSyncRun, CookedRecipe, Recipe, RecipeCuisine, RecipeDietaryRestriction,
+                        RecipeIngredient, RecipeRecipeList, RecipeSource, RecipeStep, RecommendedChallengeRecipe, Review,
+                        UserRecipeScore, db)
+from app.recommendations import refresh_recipe_scores
+
+# Incremental catalogue refresh (`flask sync-catalogue`). Each upstream page is
+# diffed against the RecipeSource rows of the recipes it produced earlier:
+#
+#   meal not seen before       inserted
+#   content hash changed       Recipe columns updated, steps, ingredients and cuisine rewritten
+#   meal gone from the page    recipe deleted, or just detached when users cooked, reviewed or listed it
+#
+# Users, reviews and lists are never touched. Changes are applied in batches of
+# at most batch_size recipes, one transaction each, which also rewrites the
+# featured recipe scores of the inserted and updated recipes for materialized
+# users. A CatalogueSyncPage row is written once a page is done. A run that is
+# stopped resumes from its remaining pages; re-applying a half-finished page is
+# harmless because batches already applied now match their hashes.
+#
+# Recipes from before RecipeSource existed are matched to upstream meals by name.
+
+DEFAULT_BATCH_SIZE = 100
+
+# recipe rows owned by the catalogue, removed along with the recipe
+CATALOGUE_TABLES = (RecipeStep, RecipeIngredient, RecipeCuisine, RecipeDietaryRestriction, UserRecipeScore)
+# rows users created about a recipe; a recipe they refer to is kept
+USER_TABLES = (CookedRecipe, Review, RecipeRecipeList, RecommendedChallengeRecipe)
+
+
+def batched(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def current_run(restart: bool = False) -> CatalogueSyncRun:
+    """The unfinished run to resume, or a new one"""
+    run = CatalogueSyncRun.query.filter(CatalogueSyncRun.finished_at.is_(None)).order_by(CatalogueSyncRun.id.desc()).first()
+    if run is not None and restart:
+        run.finished_at = datetime.now()
+        run = None
+    if run is None:
+        run = CatalogueSyncRun(started_at=datetime.now())  # type: ignore
+        db.session.add(run)
+    db.session.commit()
+    return run
+
+
+class PageDiff:
+    def __init__(self, page: str, meals: list[dict]):
+        self.page = page
+        # upstream key -> normalized recipe
+        self.upstream = {str(meal["idMeal"]): normalize_meal(meal) for meal in meals}
+        self.inserts: list[str] = []
+        # (upstream key, recipe id, has a RecipeSource row)
+        self.updates: list[tuple[str, int, bool]] = []
+        self.deletes: list[int] = []
+
+        known = {
+            source.source_key: source
+            for source in RecipeSource.query.filter(or_(
+                RecipeSource.source_key.in_(self.upstream.keys()) if self.upstream else false(),
+                RecipeSource.page == page
+            ))
+        }
+        adopted = self.adopt([key for key in self.upstream if key not in known])
+
+        for key, recipe in self.upstream.items():
+            source = known.get(key)
+            if source is not None:
+                if source.content_hash != content_hash(recipe) or source.page != page:
+                    self.updates.append((key, source.recipe_id, True))
+            elif key in adopted:
+                self.updates.append((key, adopted[key], False))
+            else:
+                self.inserts.append(key)
+        self.deletes = [source.recipe_id for key, source in known.items() if key not in self.upstream and source.page == page]
+
+    def adopt(self, keys: list[str]) -> dict[str, int]:
+        """Recipes imported before syncing existed, matched to upstream meals by name"""
+        names = {self.upstream[key]["recipe_name"]: key for key in keys}
+        if not names:
+            return {}
+        rows = (
+            db.session.query(Recipe.id, Recipe.recipe_name)
+            .filter(Recipe.recipe_name.in_(names.keys()), ~Recipe.id.in_(db.session.query(RecipeSource.recipe_id)))
+            .order_by(Recipe.id.asc())
+        )
+        adopted: dict[str, int] = {}
+        for recipe_id, recipe_name in rows:
+            adopted.setdefault(names[recipe_name], recipe_id)
+        return adopted
+
+    def __bool__(self) -> bool:
+        return bool(self.inserts or self.updates or self.deletes)
+
+
+class CatalogueSync:
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.batch_size = max(1, batch_size)
+        self.importer = CatalogueImporter()
+        self.counts = {"inserted": 0, "updated": 0, "deleted": 0, "detached": 0, "pages": 0}
+
+    def apply(self, diff: PageDiff) -> None:
+        for recipe_ids in batched(diff.deletes, self.batch_size):
+            self.in_transaction(self.delete_recipes, recipe_ids)
+        for updates in batched(diff.updates, self.batch_size):
+            self.in_transaction(self.update_recipes, diff, updates)
+        for keys in batched(diff.inserts, self.batch_size):
+            self.in_transaction(self.insert_recipes, diff, keys)
+
+    def in_transaction(self, apply, *args) -> None:
+        try:
+            apply(*args)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # names and ids handed out in the failed batch don't exist
+            self.importer.load()
+            raise
+
+    def insert_recipes(self, diff: PageDiff, keys: list[str]) -> None:
+        self.importer.reserve_ids()
+        tables = self.importer.new_tables()
+        recipe_ids = [self.importer.add_recipe(tables, diff.upstream[key], key, diff.page) for key in keys]
+        self.importer.write(tables)
+        refresh_recipe_scores(recipe_ids)
+        self.counts["inserted"] += len(keys)
+
+    def update_recipes(self, diff: PageDiff, updates: list[tuple[str, int, bool]]) -> None:
+        recipe_ids = [recipe_id for _, recipe_id, _ in updates]
+        db.session.execute(update(Recipe), [{"id": recipe_id, **recipe_columns(diff.upstream[key])} for key, recipe_id, _ in updates])
+        for model in (RecipeStep, RecipeIngredient, RecipeCuisine):
+            db.session.execute(delete(model).where(model.recipe_id.in_(recipe_ids)))
+
+        tables = self.importer.new_tables()
+        for key, recipe_id, _ in updates:
+            self.importer.add_contents(tables, recipe_id, diff.upstream[key])
+        sources = [
+            {"recipe_id": recipe_id, "source_key": key, "page": diff.page, "content_hash": content_hash(diff.upstream[key])}
+            for key, recipe_id, _ in updates
+        ]
+        tables[RecipeSource] = [source for source, (_, _, known) in zip(sources, updates) if not known]
+        self.importer.write(tables)
+        known_sources = [source for source, (_, _, known) in zip(sources, updates) if known]
+        if known_sources:
+            db.session.execute(update(RecipeSource), known_sources)
+        # cuisines may have changed
+        refresh_recipe_scores(recipe_ids)
+        self.counts["updated"] += len(updates)
+
+    def delete_recipes(self, recipe_ids: list[int]) -> None:
+        in_use = set()
+        for model in USER_TABLES:
+            in_use.update(recipe_id for (recipe_id,) in db.session.query(model.recipe_id).filter(model.recipe_id.in_(recipe_ids)).distinct())
+        unused = [recipe_id for recipe_id in recipe_ids if recipe_id not in in_use]
+
+        # recipes users refer to stay, but are no longer kept in sync
+        db.session.execute(delete(RecipeSource).where(RecipeSource.recipe_id.in_(recipe_ids)))
+        if unused:
+            for model in CATALOGUE_TABLES:
+                db.session.execute(delete(model).where(model.recipe_id.in_(unused)))
+            db.session.execute(delete(Recipe).where(Recipe.id.in_(unused)))
+        self.counts["deleted"] += len(unused)
+        self.counts["detached"] += len(in_use)
+
+    def checkpoint(self, run: CatalogueSyncRun, page: str) -> None:
+        db.session.add(CatalogueSyncPage(run_id=run.id, page=page, synced_at=datetime.now()))  # type: ignore
+        db.session.commit()
+        self.counts["pages"] += 1
+
+
+def sync_catalogue(source: CatalogueSource, workers: int = DEFAULT_WORKERS, batch_size: int = DEFAULT_BATCH_SIZE,
+                   restart: bool = False) -> dict:
+    """Bring the catalogue in line with `source`, resuming an interrupted run unless `restart`"""
+    run = current_run(restart)
+    done = {page for (page,) in db.session.query(CatalogueSyncPage.page).filter(CatalogueSyncPage.run_id == run.id)}
+    pages = [page for page in source.pages() if page not in done]
+    if done:
+        print(f"Resuming sync run {run.id}: {len(done)} pages already done, {len(pages)} to go")
+
+    sync = CatalogueSync(batch_size)
+    try:
+        for page, meals in fetch_pages(source, workers, pages):
+            diff = PageDiff(page, meals)
+            if diff:
+                sync.apply(diff)
+            sync.checkpoint(run, page)
+            print(f"Synced page {page}: {len(diff.inserts)} new, {len(diff.updates)} changed, {len(diff.deletes)} removed")
+    finally:
+        catalogue_changed()
+
+    run.finished_at = datetime.now()
+    db.session.commit()
+    return sync.counts
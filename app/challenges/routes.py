@@ -3,17 +3,20 @@ from __future__ import annotations
 from flask_login import login_required, current_user
 from app.challenges import bp
 from app.models import User, Challenge, ChallengeParticipant, ChallengeVote, UserNotifications, ChallengeReport, db, UserBlock
+from app.pagination import InvalidCursor, keyset_page, wants_cursor, wants_total
+from app.hydration import load_user_summaries, load_users
+from app.achievements.engine import apply_level
+from app.notifications import notifications_query
+from app.blobstore import store_image
+from app.images import InvalidImage
 from flask import request, jsonify, abort, current_app
 from datetime import datetime, timedelta, UTC
-from werkzeug.utils import secure_filename
-import os
 import pytz
-import uuid
 from math import ceil
 
 
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -29,10 +32,22 @@ from flask import jsonify, request
 from math import ceil
 from app.models import Challenge, ChallengeParticipant, ChallengeReport, UserNotifications, UserBlock, User
 
-# Helper function to filter expired challenges
-def filter_expired_challenges(challenges):
-    now = datetime.now()
-    return [challenge for challenge in challenges if challenge.end_time > now]
+# Helper function to keep only the challenges a user should see listed: not expired,
+# matching the search, and (for non-admins) not reported by them or created by someone they blocked
+def filter_visible_challenges(query, user, search_query):
+    query = query.filter(Challenge.end_time > datetime.now())
+
+    if search_query:
+        query = query.filter(Challenge.name.ilike(f"%{search_query}%"))
+
+    if not user.is_admin:
+        reported_challenges = db.session.query(ChallengeReport.challenge_id).filter(ChallengeReport.user_id == user.id)
+        blocked_user_ids = db.session.query(UserBlock.blocked_user).filter(UserBlock.blocked_by == user.id)
+        query = query.filter(
+            Challenge.id.notin_(reported_challenges),
+            Challenge.creator.notin_(blocked_user_ids)
+        )
+    return query
 
 @bp.route('/', methods=['GET', 'POST'])
 def challenges():
@@ -41,77 +56,61 @@ def challenges():
     # Get search query
     search_query = request.args.get('search', "").lower()
 
-    # Base query for challenges
-    challenges_query = Challenge.query
-
-    # Apply search filtering if a search query exists (for all challenges)
-    if search_query:
-        challenges_query = challenges_query.filter(Challenge.name.ilike(f"%{search_query}%"))
-
-    # Fetch all challenges (no pagination for this one)
-    all_challenges = challenges_query.all()
-
-    # Filter out expired challenges
-    all_challenges = filter_expired_challenges(all_challenges)
+    # All challenges, with every filter applied in the database
+    all_challenges_query = filter_visible_challenges(Challenge.query, user, search_query)
 
     # Fetch Joined Challenges (Challenges the user is a participant in)
-    joined_challenges_query = Challenge.query.join(ChallengeParticipant, ChallengeParticipant.challenge_id == Challenge.id) \
-        .filter(ChallengeParticipant.user_id == user.id)
-
-    # Apply search filtering for joined challenges if search query exists
-    if search_query:
-        joined_challenges_query = joined_challenges_query.filter(Challenge.name.ilike(f"%{search_query}%"))
+    joined_challenges_query = filter_visible_challenges(
+        Challenge.query.join(ChallengeParticipant, ChallengeParticipant.challenge_id == Challenge.id)
+        .filter(ChallengeParticipant.user_id == user.id),
+        user, search_query
+    )
 
     # Fetch Invited Challenges from Notifications (no pagination for this one)
-    invited_challenges_query = Challenge.query.filter(Challenge.id.in_(
-        db.session.query(UserNotifications.challenge_id)
-        .filter(UserNotifications.user_id == user.id)
-        .filter(UserNotifications.notification_type == 'challenge_reminder')
-    ))
-
-    # Apply search filtering for invited challenges if search query exists
-    if search_query:
-        invited_challenges_query = invited_challenges_query.filter(Challenge.name.ilike(f"%{search_query}%"))
-
-    # Apply the additional filters for non-admin users (reported challenges, blocked users, etc.)
-    if not user.is_admin:
-        reports = ChallengeReport.query.filter_by(user_id=user.id).all()
-        reported_challenges = [report.challenge_id for report in reports]
-        all_challenges = [challenge for challenge in all_challenges if challenge.id not in reported_challenges]
-        joined_challenges_query = joined_challenges_query.filter(Challenge.id.notin_(reported_challenges))
-        invited_challenges_query = invited_challenges_query.filter(Challenge.id.notin_(reported_challenges))
-
-        blocked_users = UserBlock.query.filter_by(blocked_by=user.id).all()
-        blocked_user_ids = [blocked_user.blocked_user for blocked_user in blocked_users]
-        all_challenges = [challenge for challenge in all_challenges if challenge.creator not in blocked_user_ids]
-        joined_challenges_query = joined_challenges_query.filter(Challenge.creator.notin_(blocked_user_ids))
-        invited_challenges_query = invited_challenges_query.filter(Challenge.creator.notin_(blocked_user_ids))
-
-    # Filter out expired challenges from the joined and invited challenges as well
-    joined_challenges_query = filter_expired_challenges(joined_challenges_query.all())
-    invited_challenges_query = filter_expired_challenges(invited_challenges_query.all())
+    invited_challenges_query = filter_visible_challenges(
+        Challenge.query.filter(Challenge.id.in_(
+            db.session.query(UserNotifications.challenge_id)
+            .filter(UserNotifications.user_id == user.id)
+            .filter(UserNotifications.notification_type == 'challenge_reminder')
+        )),
+        user, search_query
+    )
 
     # Paginate the results for All Challenges only
     page = max(1, int(request.args.get('page', 1)))  
     per_page = int(request.args.get('per_page', 20))
 
-    all_challenges_paginated = Challenge.query.filter(Challenge.id.in_([challenge.id for challenge in all_challenges])) \
-        .paginate(page=page, per_page=per_page, error_out=False)
+    # Cursor mode seeks by id instead of using OFFSET; the total is only counted on request
+    next_cursor = None
+    if wants_cursor(request.args):
+        try:
+            all_challenges_page, next_cursor = keyset_page(
+                all_challenges_query, [(Challenge.id, False)], request.args.get('cursor', ''), per_page,
+                lambda challenge: [challenge.id]
+            )
+        except InvalidCursor:
+            return jsonify({"message": "Invalid cursor"}), 400
+        total_pages_all = ceil(all_challenges_query.count() / per_page) if wants_total(request.args) else None
+    else:
+        all_challenges_paginated = all_challenges_query.order_by(Challenge.id.asc()) \
+            .paginate(page=page, per_page=per_page, error_out=False)
+        all_challenges_page = all_challenges_paginated.items
 
-    total_pages_all = ceil(all_challenges_paginated.total / per_page)  # type: ignore # Correct calculation of total pages
+        total_pages_all = ceil(all_challenges_paginated.total / per_page)  # type: ignore # Correct calculation of total pages
 
     # Get the challenges for Joined and Invited categories (no pagination here)
-    joined_challenges = [challenge.to_json() for challenge in joined_challenges_query]
-    invited_challenges = [challenge.to_json() for challenge in invited_challenges_query]
+    joined_challenges = [challenge.to_json() for challenge in joined_challenges_query.order_by(Challenge.id.asc())]
+    invited_challenges = [challenge.to_json() for challenge in invited_challenges_query.order_by(Challenge.id.asc())]
 
     # Convert challenges to JSON format
-    all_challenges_json = [challenge.to_json() for challenge in all_challenges_paginated.items]
+    all_challenges_json = [challenge.to_json() for challenge in all_challenges_page]
 
     return jsonify({
         'all_challenges': {
             'challenges': all_challenges_json,
             'total_pages': total_pages_all,
-            'current_page': page
+            'current_page': page,
+            'next_cursor': next_cursor
         },
         'joined_challenges': {
             'challenges': joined_challenges,
@@ -196,15 +195,9 @@ def create_challenge():
     # Handle image upload
     if image and allowed_file(image.filename):
         try:
-            upload_folder = current_app.config['UPLOAD_FOLDER']
-            os.makedirs(upload_folder, exist_ok=True)
-            insecureFilename = image.filename
-            if not insecureFilename:
-                return jsonify({"message": "Invalid file name"}), 400
-            filename = f"{uuid.uuid4().hex}_{secure_filename(insecureFilename)}"
-            file_path = os.path.join(upload_folder, filename)
-            image.save(file_path)
-            challenge.image = os.path.join('static', 'uploads', filename)
+            challenge.image = store_image(image)
+        except InvalidImage as e:
+            return jsonify({"message": str(e)}), 400
         except Exception as e:
             return jsonify({"message": f"File upload failed: {str(e)}"}), 500
     else:
@@ -258,9 +251,10 @@ def leave_challenge(challenge_id):
 @login_required
 def get_participants(challenge_id):
     participants = ChallengeParticipant.query.filter_by(challenge_id=challenge_id).all()
+    users = load_user_summaries(participant.user_id for participant in participants)
     participant_data = []
     for participant in participants:
-        user = User.query.get(participant.user_id)
+        user = users.get(participant.user_id)
         if not user:
             return jsonify({"message": "User not found"}), 404
         participant_data.append({"user_id": user.id, "username": user.username})
@@ -362,9 +356,10 @@ def get_vote_results(challenge_id):
         if vote.third_choice:
             participants[vote.third_choice] = participants.get(vote.third_choice, 0) + 1
 
+    users = load_user_summaries(participants)
     results = []
     for user_id, points in participants.items():
-        user = User.query.get(user_id)
+        user = users.get(user_id)
         if not user:
             return jsonify({"message": "User not found"}), 404
         results.append({
@@ -377,9 +372,10 @@ def get_vote_results(challenge_id):
     
     #add xp to users
     if not challenge.xp_awarded:
+        winners = load_users(result["user_id"] for result in results)
         for i, result in enumerate(results):
             uid = result["user_id"]
-            theUser = User.query.get(uid)
+            theUser = winners[uid]
             if i == 0:
                 theUser.xp_points = theUser.xp_points + 400 # type: ignore
             elif i == 1:
@@ -388,10 +384,10 @@ def get_vote_results(challenge_id):
                 theUser.xp_points = theUser.xp_points + 100 # type: ignore
             else:
                 theUser.xp_points = theUser.xp_points + 50 # type: ignore
+            apply_level(theUser)
             challenge.xp_awarded = True # type: ignore
             db.session.add(theUser)
-            db.session.flush()
-            db.session.commit()
+        db.session.commit()
 
 
     return jsonify(results), 200
@@ -504,17 +500,6 @@ def kick_user_from_challenge(challenge_id, user_id_to_kick):
 
     return jsonify({"message": "User kicked successfully!"}), 200
 
-def checkLevel():
-    startingLevel = current_user.user_level
-    current_user.user_level = math.floor(.1 * math.sqrt(.1 * current_user.xp_points)) + 1 # type: ignore
-    db.session.add(current_user)
-    db.session.commit()
-    if(startingLevel != current_user.user_level):
-        current_user.hasLeveled = 1
-        db.session.add(current_user)
-        db.session.commit()
-
-
 @bp.route('/<int:challenge_id>/unviewed_invites/', methods=['GET'])
 @login_required
 def get_unviewed_invites(challenge_id):
@@ -561,10 +546,7 @@ def get_invite_status(challenge_id):
 @bp.route('/notifications/', methods=['GET'])
 @login_required
 def get_notifications():
-    notifications = UserNotifications.query.filter_by(
-            user_id=current_user.id,  # type: ignore
-            notification_type='challenge_reminder'
-        )
+    notifications = notifications_query(current_user.id, request.args.get('since_id', type=int), 'challenge_reminder')  # type: ignore
     return jsonify({
         "notifications": [notification.to_json() for notification in notifications]
     }), 200
@@ -0,0 +1,124 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, NamedTuple
+from flask import Flask, current_app
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.models import ProcessedEvent, db
+import threading
+import time
+import uuid
+
+# Post-commit domain events. Request handlers only do their core write and
+# emit() an event; once that transaction commits, every subscribed handler runs
+# on a worker thread in its own app context and transaction. Handlers are
+# retried on failure, and a ProcessedEvent row written in the handler's
+# transaction makes redelivery of the same event a no-op.
+
+# events emitted by a session, held until it commits
+PENDING_KEY = 'domain_events_pending'
+# seconds before the first retry, doubled for every following one
+RETRY_DELAY = 0.5
+
+class RecipeCompleted(NamedTuple):
+    user_id: int
+    recipe_id: int
+    difficulty: str
+    num_recipes_completed: int
+    cuisine_ids: list[int]
+
+class FriendAccepted(NamedTuple):
+    requested_by: int
+    accepted_by: int
+
+class ReviewPosted(NamedTuple):
+    user_id: int
+    recipe_id: int
+    review_id: int
+    rating: str | None
+
+class Envelope(NamedTuple):
+    event_id: str
+    event: NamedTuple
+
+
+class EventBus:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handlers: dict[type, list[Callable]] = {}
+        self.executor: ThreadPoolExecutor | None = None
+
+    def subscribe(self, event_type: type):
+        """Decorator registering a handler for one event type"""
+        def register(handler: Callable) -> Callable:
+            self.handlers.setdefault(event_type, []).append(handler)
+            return handler
+        return register
+
+    def _get_executor(self, workers: int) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='events')
+            return self.executor
+
+    def dispatch(self, app: Flask, envelope: Envelope) -> None:
+        workers = app.config.get('EVENT_WORKERS', 0)
+        for handler in self.handlers.get(type(envelope.event), []):
+            if workers > 0:
+                self._get_executor(workers).submit(self.run, app, envelope, handler)
+            else:
+                self.run(app, envelope, handler)
+
+    def run(self, app: Flask, envelope: Envelope, handler: Callable) -> None:
+        attempts = max(1, app.config.get('EVENT_MAX_ATTEMPTS', 3))
+        name = f"{handler.__module__}.{handler.__name__}"[-100:]
+        for attempt in range(attempts):
+            # a fresh app context gets its own database session
+            with app.app_context():
+                try:
+                    if db.session.get(ProcessedEvent, (envelope.event_id, name)) is None:
+                        handler(envelope.event)
+                        # the handler's own writes fail here, and are retried like any other error
+                        db.session.flush()
+                        if not self.mark_processed(envelope.event_id, name):
+                            return
+                        db.session.commit()
+                    return
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.warning(f"Event handler {name} failed on attempt {attempt + 1} for {envelope.event}: {e}")
+            if attempt + 1 < attempts:
+                time.sleep(RETRY_DELAY * 2 ** attempt)
+        app.logger.error(f"Giving up on event handler {name} for {envelope.event}")
+
+    @staticmethod
+    def mark_processed(event_id: str, name: str) -> bool:
+        """Record the handler's run of an event; False if another delivery got there first"""
+        try:
+            db.session.add(ProcessedEvent(event_id=event_id, handler=name, processed_at=datetime.now()))  # type: ignore
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return False
+        return True
+
+
+bus = EventBus()
+subscribe = bus.subscribe
+
+
+def emit(domain_event: NamedTuple) -> None:
+    """Queue an event on the current session, dispatched once it commits"""
+    envelope = Envelope(uuid.uuid4().hex, domain_event)
+    db.session.info.setdefault(PENDING_KEY, []).append((current_app._get_current_object(), envelope))  # type: ignore
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_pending(session):
+    for app, envelope in session.info.pop(PENDING_KEY, []):
+        bus.dispatch(app, envelope)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(PENDING_KEY, None)
@@ -7,7 +7,8 @@ from app.models import *
 from flask_login import current_user, login_required
 import random
 from enum import Enum
-from app.recipes.routes import completionAchievements
+from app.events import FriendAccepted, emit, subscribe
+from app.images import image_urls
 
 class notificationType(Enum):
     send_request = 1
@@ -35,7 +36,8 @@ def get_friends():
                 "id": user_id,
                 "username": username,
                 "email_address": email_address,
-                "profile_picture": profile_picture
+                "profile_picture": profile_picture,
+                "profile_picture_variants": image_urls(profile_picture)
             })
 
     return jsonify({
@@ -87,7 +89,8 @@ def get_suggested_friends():
             "id": user_id,
             "username": username,
             "email_address": email_address,
-            "profile_picture": profile_picture
+            "profile_picture": profile_picture,
+            "profile_picture_variants": image_urls(profile_picture)
         }
         for user_id, username, email_address, profile_picture in suggested_friends
     ]
@@ -123,7 +126,8 @@ def search_for_friends():
             "username": user.username,
             "fname": user.fname,
             "lname": user.lname,
-            "profile_picture": user.profile_picture
+            "profile_picture": user.profile_picture,
+            "profile_picture_variants": image_urls(user.profile_picture)
         }
         for user in users if user.id != current_user.id
     ]
@@ -149,7 +153,8 @@ def get_requests_to():
             'requestTo': fr.requestTo,
             'id': user_id,
             'username': username,
-            'profile_picture': profile_picture
+            'profile_picture': profile_picture,
+            'profile_picture_variants': image_urls(profile_picture)
         }
         for fr, user_id, username, profile_picture in friend_requests_to
     ]
@@ -174,20 +179,21 @@ def get_requests_from():
             'requestTo': fr.requestTo,
             'id': user_id,
             'username': username,
-            'profile_picture': profile_picture
+            'profile_picture': profile_picture,
+            'profile_picture_variants': image_urls(profile_picture)
         }
         for fr, user_id, username, profile_picture in friend_requests_from
     ]
     return jsonify({"friend_requests_from": users_list}), 200
 
-def request_notification(requestFrom, requestTo, requestType):
+def build_request_notification(requestFrom, requestTo, requestType):
     notification_message = "if you see this, something has gone drastically wrong"
 
     userFrom = User.query.filter_by(id=requestFrom).first()
     userTo = User.query.filter_by(id=requestTo).first()
 
     if not userFrom or not userTo:
-        return jsonify({"error": "Invalid user IDs"}), 400
+        return None
 
     match requestType: 
         case notificationType.send_request:
@@ -207,7 +213,12 @@ def request_notification(requestFrom, requestTo, requestType):
     else:
         notification_user_id = requestFrom
 
-    friend_notification = UserNotifications(user_id = notification_user_id, notification_text = notification_message, isRead = False, notification_type = 'friend_request') #type: ignore
+    return UserNotifications(user_id = notification_user_id, notification_text = notification_message, isRead = False, notification_type = 'friend_request') #type: ignore
+
+def request_notification(requestFrom, requestTo, requestType):
+    friend_notification = build_request_notification(requestFrom, requestTo, requestType)
+    if friend_notification is None:
+        return jsonify({"error": "Invalid user IDs"}), 400
     db.session.add(friend_notification)
     print(friend_notification)
     try:
@@ -216,7 +227,7 @@ def request_notification(requestFrom, requestTo, requestType):
     except IntegrityError as e:
         db.session.rollback()
         return jsonify({"error": "sending notification"}), 500
-        print(f"Error sending notification to  {notification_user_id}: {e}")
+        print(f"Error sending notification to  {friend_notification.user_id}: {e}")
         return jsonify({"error": "sending notification"}), 500
 
 def delete_notification(requestFrom, requestTo):
@@ -270,21 +281,26 @@ def accept_request(id):
         new_friendship = Friendship(user1 = request.requestFrom, user2 = request.requestTo) #type: ignore
         db.session.query(FriendRequest).filter(and_(FriendRequest.requestFrom==id, FriendRequest.requestTo==current_user.id)).delete()
         db.session.add(new_friendship)
-        completionAchievements(request.requestFrom, 4)
-        completionAchievements(request.requestTo, 4)
+        # the notification and achievements are handled after the commit, see friend_accepted below
+        emit(FriendAccepted(requested_by=request.requestFrom, accepted_by=request.requestTo))
 
     else:
         print("No request, heathen!")
     
     try:
         db.session.commit()
-        request_notification(id, current_user.id, notificationType.accept_request)
     except IntegrityError as e:
         db.session.rollback()
         print(f"Error accepting friend request from {id}: {e}")
         return jsonify({"error": "Error accepting friend request"}), 500
     return {"message": "friend request accepted successfully"}, 200
 
+@subscribe(FriendAccepted)
+def friend_accepted(event: FriendAccepted):
+    friend_notification = build_request_notification(event.requested_by, event.accepted_by, notificationType.accept_request)
+    if friend_notification is not None:
+        db.session.add(friend_notification)
+
 @bp.route('/revoke_request/<int:id>', methods=['POST'])
 def revoke_request(id): 
     request = db.session.query(FriendRequest).filter(and_(FriendRequest.requestFrom==current_user.id, FriendRequest.requestTo==id)).first()
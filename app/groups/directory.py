@@ -0,0 +1,84 @@
+from __future__ import annotations
+from sqlalchemy import exists, or_
+from app.models import GroupMember, UserGroup, UserNotifications, db
+import threading
+import time
+
+# The groups directory has three sections, each read by its own query:
+#
+#   my groups        from the user's GroupMember rows
+#   invited groups   from the user's group invitations, limited to groups they can see
+#   all groups       one page of the groups the user can see, public first; in cursor
+#                    mode a seek past the last row sent (app/pagination.py), so a page
+#                    never reads the rows before it
+#
+# The number of visible groups is a separate COUNT, run only when a total is asked for.
+
+# (column, descending) sort key of the all_groups section: public groups first
+DIRECTORY_KEYS = [(UserGroup.is_public, True), (UserGroup.id, False)]
+DIRECTORY_ORDER = [column.desc() if descending else column.asc() for column, descending in DIRECTORY_KEYS]
+
+def directory_key(group: UserGroup) -> list:
+    return [int(group.is_public), group.id]
+
+def matching(query, search_query: str):
+    if search_query:
+        query = query.filter(UserGroup.name.ilike(f"%{search_query}%"))
+    return query
+
+def visible_groups(user_id: int, search_query: str = ''):
+    """Public groups and the groups `user_id` is a member of, unordered"""
+    is_member = exists().where(GroupMember.group_id == UserGroup.id, GroupMember.member_id == user_id)
+    return matching(UserGroup.query.filter(or_(UserGroup.is_public == True, is_member)), search_query)
+
+def my_groups(user_id: int, search_query: str = '') -> list[UserGroup]:
+    query = UserGroup.query.join(GroupMember, GroupMember.group_id == UserGroup.id).filter(GroupMember.member_id == user_id)
+    return matching(query, search_query).order_by(*DIRECTORY_ORDER).all()
+
+def invited_groups(user_id: int, search_query: str = '') -> list[UserGroup]:
+    invitations = db.session.query(UserNotifications.group_id).filter(
+        UserNotifications.user_id == user_id,
+        UserNotifications.notification_type == 'group_message'
+    )
+    return visible_groups(user_id, search_query).filter(UserGroup.id.in_(invitations)).order_by(*DIRECTORY_ORDER).all()
+
+def count_visible_groups(user_id: int, search_query: str = '') -> int:
+    return visible_groups(user_id, search_query).count()
+
+
+class DirectoryCache:
+    """Short-lived per-user cache of directory responses, disabled when the TTL is 0"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: dict[int, dict] = {}
+
+    def get(self, user_id: int, key, ttl: float):
+        if ttl <= 0:
+            return None
+        with self.lock:
+            entry = self.entries.get(user_id, {}).get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[user_id][key]
+                return None
+            return value
+
+    def put(self, user_id: int, key, value, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries.setdefault(user_id, {})[key] = (time.monotonic() + ttl, value)
+
+    def invalidate(self, *user_ids: int) -> None:
+        with self.lock:
+            for user_id in user_ids:
+                self.entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+directory_cache = DirectoryCache()
@@ -0,0 +1,17 @@
+from __future__ import annotations
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from app.models import Message
+from app.pubsub import publish_after_commit
+
+# Announce every committed group message (chat messages as well as the
+# join/leave notices) to the long-poll requests waiting on that group
+
+def message_channel(group_id: int) -> str:
+    return f'group:{group_id}:messages'
+
+@event.listens_for(Message, 'after_insert')
+def _message_sent(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        publish_after_commit(session, message_channel(target.group_id), target.id)
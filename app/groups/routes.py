@@ -1,13 +1,18 @@
 from __future__ import annotations
 from app.groups import bp
 from app.models import User, UserGroup, GroupMember, GroupBannedMember, Message, GroupReport, UserNotifications, MessageReport, UserBlock, db
+from app.hydration import load_user_summaries
+from app.groups.live import message_channel
+from app.notifications import notifications_query
+from app.pubsub import broker
+from app.groups.directory import DIRECTORY_KEYS, DIRECTORY_ORDER, count_visible_groups, directory_cache, directory_key, invited_groups, my_groups, visible_groups
+from app.pagination import InvalidCursor, keyset_page, wants_cursor, wants_total
+from app.blobstore import store_image
+from app.images import InvalidImage
 from flask import jsonify, request, current_app
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
-import os
-import uuid
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS    
@@ -46,6 +51,7 @@ def get_all_groups():
         "all_groups": [],
         "total_pages": 1,
         "current_page": 1,
+        "next_cursor": None,
     }
 
     # Get the page, per_page, and search query parameters from the request (default to page 1, per_page 10, and empty search)
@@ -53,67 +59,35 @@ def get_all_groups():
     per_page = int(request.args.get('per_page', 10))  # Default to 10 groups per page
     search_query = request.args.get('search', "").strip().lower()  # Get the search query (empty string if not provided)
 
-    # 1. Fetch all public groups (with pagination and search filter if query is present)
-    public_groups_query = UserGroup.query.filter_by(is_public=True)
-
-    # If there is a search query, filter public groups by name (case insensitive)
-    if search_query:
-        public_groups_query = public_groups_query.filter(UserGroup.name.ilike(f"%{search_query}%"))
-
-    # Fetch the filtered public groups (no pagination yet)
-    public_groups_filtered = public_groups_query.all()
-
-    # 2. Fetch the private groups the user is part of (with pagination and search filter if query is present)
-    my_group_ids = {membership.group_id for membership in GroupMember.query.filter_by(member_id=user.id).all()}
-    private_groups_query = UserGroup.query.filter(
-        UserGroup.id.in_(my_group_ids),
-        UserGroup.is_public == False
-    )
-
-    # If there is a search query, filter private groups by name (case insensitive)
-    if search_query:
-        private_groups_query = private_groups_query.filter(UserGroup.name.ilike(f"%{search_query}%"))
-
-    # Fetch the filtered private groups (no pagination yet)
-    private_groups_filtered = private_groups_query.all()
-
-    # Combine public and private groups
-    all_groups_filtered = public_groups_filtered + private_groups_filtered
-
-    # Get the total number of pages based on the filtered result
-    total_groups_count = len(all_groups_filtered)
-    total_pages_all = (total_groups_count // per_page) + (1 if total_groups_count % per_page else 0)
-
-    # For My Groups (the groups the user is a member of), apply search query if present
-    if search_query:
-        my_groups_query = UserGroup.query.filter(
-            UserGroup.id.in_(my_group_ids),
-            UserGroup.name.ilike(f"%{search_query}%")
-        )
+    # Serve a recent copy of this exact listing if the directory cache is enabled
+    cache_ttl = current_app.config.get('GROUPS_CACHE_TTL', 0)
+    cursor_mode = wants_cursor(request.args)
+    cache_key = (search_query, page, per_page, request.args.get('cursor') if cursor_mode else None, wants_total(request.args))
+    cached = directory_cache.get(user.id, cache_key, cache_ttl)
+    if cached is not None:
+        return jsonify(cached), 200
+
+    groups = visible_groups(user.id, search_query)
+    if cursor_mode:
+        try:
+            paginated_groups, response_data['next_cursor'] = keyset_page(groups, DIRECTORY_KEYS, request.args.get('cursor'), per_page, directory_key)
+        except InvalidCursor:
+            return jsonify({"message": "Invalid cursor"}), 400
     else:
-        my_groups_query = UserGroup.query.filter(UserGroup.id.in_(my_group_ids))
-
-    my_groups = my_groups_query.all()
-    response_data['my_groups'] = [group.to_json() for group in my_groups]
-
-    # 3. Get invited groups (groups the user has been invited to)
-    notifications = UserNotifications.query.filter_by(user_id=user.id, notification_type='group_message').all()
-    invited_group_ids = {notification.group_id for notification in notifications}
-    response_data['invited_groups'] = [
-        group.to_json() for group in all_groups_filtered if group.id in invited_group_ids
-    ]
-
-    # 4. Paginate the combined filtered groups for the "all_groups" section
-    start_idx = (page - 1) * per_page
-    end_idx = start_idx + per_page
-    paginated_groups = all_groups_filtered[start_idx:end_idx]
-
+        paginated_groups = groups.order_by(*DIRECTORY_ORDER).offset((page - 1) * per_page).limit(per_page).all()
     response_data['all_groups'] = [group.to_json() for group in paginated_groups]
+    response_data['my_groups'] = [group.to_json() for group in my_groups(user.id, search_query)]
+    response_data['invited_groups'] = [group.to_json() for group in invited_groups(user.id, search_query)]
 
-    # Pagination data
-    response_data['total_pages'] = total_pages_all
+    # Pagination data; counting every visible group is skipped unless a cursor client asks for it
+    if cursor_mode and not wants_total(request.args):
+        response_data['total_pages'] = None
+    else:
+        total_groups_count = count_visible_groups(user.id, search_query)
+        response_data['total_pages'] = (total_groups_count // per_page) + (1 if total_groups_count % per_page else 0)
     response_data['current_page'] = page
 
+    directory_cache.put(user.id, cache_key, response_data, cache_ttl)
     return jsonify(response_data), 200
 
 
@@ -128,19 +102,20 @@ def get_my_groups():
 @bp.route('/notifications/', methods=['GET'])
 @login_required
 def get_notifications():
-    notifications = UserNotifications.query.filter_by(
-            user_id=current_user.id,  # type: ignore
-            notification_type='group_message'
-        )
-    
+    notifications = notifications_query(current_user.id, request.args.get('since_id', type=int), 'group_message')  # type: ignore
+
     invited_groups = []
+    last_notification_id = None
     for notification in notifications:
+        last_notification_id = notification.id
         group = UserGroup.query.get(notification.group_id)
         if group:
             invited_groups.append(group.to_json())
 
     return jsonify({
-        "invited_groups": invited_groups
+        "invited_groups": invited_groups,
+        # pass back as since_id to only get newer invitations
+        "last_notification_id": last_notification_id
     }), 200
 
 @bp.route('/reported/', methods=["GET"])
@@ -154,9 +129,10 @@ def get_reported_groups():
 def get_reported_messages():
     reportedMessages = Message.query.filter(Message.num_reports > 0).all()
 
+    users = load_user_summaries(message.user_id for message in reportedMessages)
     message_data = []
     for message in reportedMessages:
-        user = User.query.get(message.user_id)
+        user = users.get(message.user_id)
         if(not user):
             continue
         message_data.append({
@@ -194,6 +170,7 @@ def join_group(group_id):
     member = GroupMember(group_id=group_id, member_id=current_user.id, is_trusted=False) #type: ignore
     db.session.add(member)
     db.session.commit()
+    directory_cache.invalidate(current_user.id)
 
     # Create a message indicating the user has joined the group
     message = Message(
@@ -218,6 +195,7 @@ def leave_group(group_id):
     if member:
         db.session.delete(member)
         db.session.commit()
+        directory_cache.invalidate(current_user.id)
 
         # Create a message indicating the user has left the group
         message = Message(
@@ -241,16 +219,16 @@ def is_member(group_id):
 @login_required
 def get_members(group_id):
     members = GroupMember.query.filter_by(group_id=group_id).all()
+    users = load_user_summaries(member.member_id for member in members)
     member_data = []
     for member in members:
-        user = User.query.get(member.member_id)
+        user = users.get(member.member_id)
         if(not user):
             continue
-        profile_picture_url = f'/static/uploads/{user.profile_picture}' if user.profile_picture else None
         member_data.append({
             "user_id": user.id,
             "username": user.username,
-            "profile_picture": profile_picture_url,
+            "profile_picture": user.profile_picture_url,
             "is_trusted": member.is_trusted
         })
     return jsonify(member_data), 200
@@ -276,15 +254,10 @@ def create_group():
     )
 
     if image and allowed_file(image.filename):
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        os.makedirs(upload_folder, exist_ok=True)
-        insecureFilename = image.filename
-        if not insecureFilename:
-            return jsonify({"message": "Invalid file name"}), 400
-        filename = f"{uuid.uuid4().hex}_{secure_filename(insecureFilename)}"
-        file_path = os.path.join(upload_folder, filename)
-        image.save(file_path)
-        group.image = os.path.join('static', 'uploads', filename)
+        try:
+            group.image = store_image(image)
+        except InvalidImage as e:
+            return jsonify({"message": str(e)}), 400
     else:
         group.image = "static/uploads/default_image.jpg"
 
@@ -295,32 +268,94 @@ def create_group():
     db.session.add(member)
     db.session.commit()
 
+    # a new public group shows up in everyone's directory, a private one only in the creator's
+    if is_public:
+        directory_cache.clear()
+    else:
+        directory_cache.invalidate(current_user.id)
+
     return jsonify({"message": "Group created successfully!", "group_id": group.id}), 200
 
-@bp.route('/<int:group_id>/messages/', methods=['GET'])
-@login_required
-def get_messages(group_id):
-    user: User = current_user._get_current_object() # type: ignore
-    messages: list[Message] = Message.query.filter_by(group_id=group_id).order_by(Message.id.asc()).all()
+# Page size bounds for the incremental message modes
+DEFAULT_MESSAGE_LIMIT = 50
+MAX_MESSAGE_LIMIT = 200
+# Longest a long-poll request is held open, in seconds
+MAX_POLL_TIMEOUT = 30
 
+def visible_messages_query(group_id: int, user: User):
+    query = Message.query.filter(Message.group_id == group_id)
     if not user.is_admin:
-        reports: list[MessageReport] = MessageReport.query.filter(MessageReport.user_id == user.id).all()
-        reportedMessages: list[int] = [report.message_id for report in reports]
-        messages = [message for message in messages if not message.id in reportedMessages]
- 
+        # hide the messages this user reported
+        reported_messages = db.session.query(MessageReport.message_id).filter(MessageReport.user_id == user.id)
+        query = query.filter(Message.id.notin_(reported_messages))
+    return query
+
+def messages_to_json(messages: list[Message]) -> list[dict]:
+    users = load_user_summaries(message.user_id for message in messages)
     message_data = []
     for message in messages:
-        user = User.query.get(message.user_id) # type: ignore
-        if(not user):
+        sender = users.get(message.user_id)
+        if(not sender):
             continue
         message_data.append({
             "id": message.id,
             "user_id": message.user_id,
-            "username": user.username,
+            "username": sender.username,
             "text": message.text,
             "num_reports": message.num_reports
         })
-    return jsonify(message_data), 200
+    return message_data
+
+def message_limit(args) -> int:
+    # a limit that isn't a number falls back to the default instead of failing the request
+    return max(1, min(args.get('limit', DEFAULT_MESSAGE_LIMIT, type=int), MAX_MESSAGE_LIMIT))
+
+@bp.route('/<int:group_id>/messages/', methods=['GET'])
+@login_required
+def get_messages(group_id):
+    user: User = current_user._get_current_object() # type: ignore
+    query = visible_messages_query(group_id, user)
+
+    after_id = request.args.get('after_id', type=int)
+    before_id = request.args.get('before_id', type=int)
+    if after_id is None and before_id is None and 'limit' not in request.args:
+        # no window requested: the whole history, as before
+        return jsonify(messages_to_json(query.order_by(Message.id.asc()).all())), 200
+
+    # Incremental mode: at most `limit` messages, oldest first
+    limit = message_limit(request.args)
+    if after_id is not None:
+        query = query.filter(Message.id > after_id)
+    if before_id is not None:
+        query = query.filter(Message.id < before_id)
+
+    if after_id is not None:
+        # newer messages: the ones right after after_id
+        messages = query.order_by(Message.id.asc()).limit(limit).all()
+    else:
+        # the latest messages, or the ones right before before_id when scrolling back
+        messages = query.order_by(Message.id.desc()).limit(limit).all()
+        messages.reverse()
+    return jsonify(messages_to_json(messages)), 200
+
+@bp.route('/<int:group_id>/messages/poll/', methods=['GET'])
+@login_required
+def poll_messages(group_id):
+    """Long-poll for messages after `after_id`: answers as soon as there are some, or with [] after `timeout` seconds"""
+    user: User = current_user._get_current_object() # type: ignore
+    after_id = request.args.get('after_id', 0, type=int)
+    timeout = max(0.0, min(request.args.get('timeout', 25, type=float), MAX_POLL_TIMEOUT))
+    limit = message_limit(request.args)
+    query = visible_messages_query(group_id, user).filter(Message.id > after_id).order_by(Message.id.asc()).limit(limit)
+
+    messages = query.all()
+    if not messages and timeout > 0:
+        # end the transaction so no connection is held while waiting and the re-query sees new rows
+        db.session.rollback()
+        # the broker is per process: after a timeout look again anyway, a message may have been sent through another worker
+        broker.wait(message_channel(group_id), after_id, timeout)
+        messages = query.all()
+    return jsonify(messages_to_json(messages)), 200
 
 @bp.route('/<int:group_id>/messages/', methods=['POST'])
 @login_required
@@ -535,6 +570,7 @@ def delete_group(group_id):
     UserNotifications.query.filter_by(group_id=group_id).delete()
     db.session.delete(group)
     db.session.commit()
+    directory_cache.clear()
 
     return jsonify({"message": "Group deleted successfully!"}), 200
 
@@ -562,6 +598,7 @@ def invite_friends(group_id):
         )
         db.session.add(notification)
     db.session.commit()
+    directory_cache.invalidate(*[int(friend_id) for friend_id in friend_ids])
 
     return jsonify({"message": "Invitations sent successfully!"}), 200
 
@@ -578,6 +615,7 @@ def invite_response(group_id):
         notification_type='group_message'
     ).delete()
     db.session.commit()
+    directory_cache.invalidate(current_user.id)
 
     json = request.json
     if not json:
@@ -587,6 +625,7 @@ def invite_response(group_id):
         member = GroupMember(group_id=group_id, member_id=current_user.id, is_trusted=False) #type: ignore
         db.session.add(member)
         db.session.commit()
+        directory_cache.invalidate(current_user.id)
         return jsonify({"message": "You have joined the group!"}), 200
     elif response == 'deny':
         return jsonify({"message": "You have denied the invitation."}), 200
@@ -613,6 +652,7 @@ def kick_user_from_group(group_id):
 
     db.session.delete(participant)
     db.session.commit()
+    directory_cache.invalidate(participant.member_id)
 
     return jsonify({"message": "User kicked successfully!"}), 200
 
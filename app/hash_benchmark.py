@@ -0,0 +1,55 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from app.hashing_examples import argon2_hash, DEFAULT_TIME_COST, DEFAULT_MEMORY_COST, DEFAULT_PARALLELISM
+import multiprocessing
+import os
+import sys
+import time
+
+# Password hashing throughput with the configured Argon2 cost:
+#
+#   python -m app.hash_benchmark [--seconds N] [--workers N]
+#
+# prints hashes per second on one core, then with a process pool (one worker
+# per core by default) and what that comes to per core. Use it to pick
+# ARGON2_* so a login stays affordable, and PASSWORD_HASH_WORKERS.
+
+def settings_from_env() -> dict:
+    return {
+        "rounds": int(os.environ.get('ARGON2_TIME_COST', DEFAULT_TIME_COST)),
+        "memory_cost": int(os.environ.get('ARGON2_MEMORY_COST', DEFAULT_MEMORY_COST)),
+        "parallelism": int(os.environ.get('ARGON2_PARALLELISM', DEFAULT_PARALLELISM)),
+    }
+
+def single_core(settings: dict, seconds: float) -> float:
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        argon2_hash('benchmark-password', settings)
+        count += 1
+    return count / (time.perf_counter() - started)
+
+def pooled(settings: dict, seconds: float, workers: int) -> float:
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        # warm up, so process start-up isn't counted
+        list(executor.map(argon2_hash, ['warm-up'] * workers, [settings] * workers))
+        count = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            list(executor.map(argon2_hash, ['benchmark-password'] * workers, [settings] * workers))
+            count += workers
+        return count / (time.perf_counter() - started)
+
+def report(seconds: float, workers: int) -> None:
+    settings = settings_from_env()
+    print(f"argon2id t={settings['rounds']} m={settings['memory_cost']} KiB p={settings['parallelism']}")
+    rate = single_core(settings, seconds)
+    print(f"1 core            {rate:7.2f} hashes/s  ({1000 / rate:.0f} ms per hash)")
+    rate = pooled(settings, seconds, workers)
+    print(f"{workers} worker processes {rate:7.2f} hashes/s  ({rate / workers:.2f} per core)")
+
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[sys.argv.index('--seconds') + 1]) if '--seconds' in sys.argv else 5
+    workers = int(sys.argv[sys.argv.index('--workers') + 1]) if '--workers' in sys.argv else (os.cpu_count() or 1)
+    report(seconds, workers)
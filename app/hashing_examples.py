@@ -1,14 +1,54 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
 from cryptography.fernet import Fernet
 from passlib.hash import argon2
+import multiprocessing
+import threading
+
+# Argon2 cost parameters: time cost (passlib calls it rounds), memory in KiB, lanes
+DEFAULT_TIME_COST = 10
+DEFAULT_MEMORY_COST = 65536
+DEFAULT_PARALLELISM = 4
+# jobs allowed in flight per worker process before callers wait for a slot
+QUEUE_PER_WORKER = 2
+
+# run inside the worker processes, so module level and picklable
+def argon2_hash(pwd: str, settings: dict) -> str:
+    return argon2.using(**settings).hash(pwd)
+
+def argon2_verify(pwd: str, hash: str) -> bool:
+    return argon2.verify(pwd, hash)
+
 
 class UpdatedHasher:
     """Upgrades the Dropbox for modern systems using Argon2"""
-    def __init__(self, pepper_key: bytes):
+    def __init__(self, pepper_key: bytes, time_cost: int = DEFAULT_TIME_COST, memory_cost: int = DEFAULT_MEMORY_COST,
+                 parallelism: int = DEFAULT_PARALLELISM, workers: int = 0):
         self.pepper = Fernet(pepper_key)
+        self.settings = {"rounds": time_cost, "memory_cost": memory_cost, "parallelism": parallelism}
+        self.argon2 = argon2.using(**self.settings)
+        # with workers, Argon2 runs in a process pool instead of the calling request thread
+        self.workers = workers
+        self.executor: ProcessPoolExecutor | None = None
+        self.slots = threading.BoundedSemaphore(max(1, workers) * QUEUE_PER_WORKER)
+        self.lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                # spawned rather than forked: the web process has threads and open connections
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self.executor
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        with self.slots:
+            return self._get_executor().submit(fn, *args).result()
 
     def hash(self, pwd: str) -> bytes:
         # hash with argon2
-        hash: str = argon2.using(rounds=10).hash(pwd)
+        hash: str = self._run(argon2_hash, pwd, self.settings)
         # convert this unicode hash string into bytes before encryption
         hashb: bytes = hash.encode('utf-8')
         # encrypt this hash using the global pepper
@@ -16,13 +56,19 @@ class UpdatedHasher:
         return pep_hash
 
     def check(self, pwd: str, pep_hash: bytes) -> bool:
+        # check if the given password matches this hash
+        return self._run(argon2_verify, pwd, self._unpepper(pep_hash))
+
+    def needs_update(self, pep_hash: bytes) -> bool:
+        """True if the hash was made with other cost parameters than the current ones"""
+        return self.argon2.needs_update(self._unpepper(pep_hash))
+
+    def _unpepper(self, pep_hash: bytes) -> str:
         # decrypt the hash using the global pepper
         hashb: bytes = self.pepper.decrypt(pep_hash)
         # convert this hash back into a unicode string
-        hash: str = hashb.decode('utf-8')
-        # check if the given password matches this hash
-        return argon2.verify(pwd, hash)
+        return hashb.decode('utf-8')
 
     @staticmethod
     def random_pepper() -> bytes:
-        return Fernet.generate_key()
\ No newline at end of file
+        return Fernet.generate_key()
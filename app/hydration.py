@@ -0,0 +1,52 @@
+from __future__ import annotations
+from typing import Iterable, NamedTuple
+from sqlalchemy import inspect
+from sqlalchemy.orm.util import identity_key
+from app.models import User, db
+
+# Endpoints that list rows written by users (participants, members, messages, ...)
+# hydrate the user details for all of those rows at once instead of calling
+# User.query.get() per row.
+
+class UserSummary(NamedTuple):
+    id: int
+    username: str
+    profile_picture: str | None
+
+    @property
+    def profile_picture_url(self) -> str | None:
+        return f'/static/uploads/{self.profile_picture}' if self.profile_picture else None
+
+
+def _unique_ids(ids: Iterable[int | None]) -> list[int]:
+    return list(dict.fromkeys(user_id for user_id in ids if user_id is not None))
+
+def _from_identity_map(user_ids: list[int]) -> tuple[dict[int, User], list[int]]:
+    # users already loaded in this session cost no query at all, unless a commit expired them
+    found: dict[int, User] = {}
+    missing: list[int] = []
+    for user_id in user_ids:
+        user = db.session.identity_map.get(identity_key(User, user_id))
+        if user is not None and not inspect(user).expired:
+            found[user_id] = user
+        else:
+            missing.append(user_id)
+    return found, missing
+
+def load_users(ids: Iterable[int | None]) -> dict[int, User]:
+    """Full User objects by id, for callers that modify them; unknown ids are left out"""
+    users, missing = _from_identity_map(_unique_ids(ids))
+    if missing:
+        for user in User.query.filter(User.id.in_(missing)):
+            users[user.id] = user
+    return users
+
+def load_user_summaries(ids: Iterable[int | None]) -> dict[int, UserSummary]:
+    """Id, username and profile picture by id in at most one query; unknown ids are left out"""
+    users, missing = _from_identity_map(_unique_ids(ids))
+    summaries = {user_id: UserSummary(user.id, user.username, user.profile_picture) for user_id, user in users.items()}
+    if missing:
+        rows = db.session.query(User.id, User.username, User.profile_picture).filter(User.id.in_(missing))
+        for user_id, username, profile_picture in rows:
+            summaries[user_id] = UserSummary(user_id, username, profile_picture)
+    return summaries
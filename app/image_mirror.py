@@ -0,0 +1,245 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, current_app, redirect, url_for
+import hashlib
+import io
+import os
+import threading
+import time
+
+# Local copies of the remote recipe images (TheMealDB's strMealThumb URLs).
+# Recipe.to_json hands out
+#
+#   recipe-images/<recipe id>/<key>/<thumb|medium>.<webp|jpg>
+#
+# where key is a hash of the recipe's current remote URL. The first request
+# for a key fetches the remote image once (concurrent requests for it wait
+# for that fetch), writes the thumbnail and medium variants into
+# IMAGE_MIRROR_FOLDER and serves them like the other long-cached assets. A
+# changed remote URL changes the key, and an outdated key redirects to the
+# current one. When the remote image can't be fetched the request is
+# redirected to it instead, without trying again for RETRY_AFTER seconds.
+#
+# The folder is an LRU cache capped at IMAGE_MIRROR_MAX_BYTES: serving a file
+# marks it used, and writing past the cap evicts the least recently used
+# files. `flask mirror-recipe-images` fills it ahead of time. With
+# STATIC_DELIVERY=x-accel the folder has to stay inside app/static.
+
+MAX_REMOTE_BYTES = 10 * 1024 * 1024
+# a served file's mtime is bumped at most this often, to mark it recently used
+TOUCH_INTERVAL = 3600
+# eviction frees space down to this share of the cap
+EVICT_TO = 0.9
+# seconds a failed fetch is remembered, meanwhile requests go straight to the remote image
+RETRY_AFTER = 300
+
+
+class MirrorError(Exception):
+    pass
+
+
+def is_remote(image: str | None) -> bool:
+    return bool(image) and image.startswith(('http://', 'https://'))  # type: ignore
+
+def url_key(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()[:16]
+
+def variant_extension() -> str:
+    from app.images import FORMATS, ImageSettings
+    return FORMATS[ImageSettings.from_config(current_app.config).variant_format][1]
+
+def recipe_image_urls(recipe_id: int, image: str | None) -> dict | None:
+    """Local thumbnail and medium URLs for a recipe's remote image, None if it isn't mirrored"""
+    if not current_app.config.get('IMAGE_MIRROR') or not is_remote(image):
+        return None
+    from app.images import VARIANTS
+    key = url_key(image)  # type: ignore
+    extension = variant_extension()
+    return {name: f"recipe-images/{recipe_id}/{key}/{name}.{extension}" for name in VARIANTS}
+
+
+class ImageMirror:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key -> lock held while that key is fetched
+        self.fetching: dict[str, threading.Lock] = {}
+        # key -> when fetching it last failed
+        self.failed: dict[str, float] = {}
+        # bytes in the cache folder as last counted plus what was written since; None until counted
+        self.total_bytes: int | None = None
+        # files evicted since startup
+        self.evicted = 0
+
+    def init_app(self, app: Flask) -> None:
+        if not app.config.get('IMAGE_MIRROR_FOLDER'):
+            app.config['IMAGE_MIRROR_FOLDER'] = os.path.join(app.root_path, 'static', 'mirror')
+        app.add_url_rule('/recipe-images/<int:recipe_id>/<key>/<filename>', 'recipe_image', self.serve)
+
+    def filename(self, key: str, name: str, extension: str) -> str:
+        return f"{key}.{name}.{extension}"
+
+    def serve(self, recipe_id: int, key: str, filename: str):
+        from app.images import VARIANTS
+        from app.models import Recipe, db
+        from app.static_assets import assets
+        image = db.session.query(Recipe.image).filter(Recipe.id == recipe_id).scalar()
+        name, _, extension = filename.partition('.')
+        if not is_remote(image) or name not in VARIANTS or extension != variant_extension():
+            return {"message": "Not found"}, 404
+        current = url_key(image)
+        if key != current:
+            response = redirect(url_for('recipe_image', recipe_id=recipe_id, key=current, filename=filename))
+            response.cache_control.no_cache = True
+            return response
+
+        config = current_app.config
+        cached = self.filename(current, name, extension)
+        path = os.path.join(config['IMAGE_MIRROR_FOLDER'], cached)
+        if not os.path.exists(path):
+            try:
+                self.fetch(image, config)
+            except MirrorError as e:
+                print(f"Serving recipe {recipe_id}'s image from {image}: {e}")
+        if not self.touch(path):
+            response = redirect(image)
+            response.cache_control.no_cache = True
+            return response
+        return assets.deliver(path, os.path.basename(config['IMAGE_MIRROR_FOLDER']), cached, f"{current}-{name}")
+
+    def fetch(self, url: str, config) -> None:
+        """Download `url` once and write its variants, unless another thread just did"""
+        key = url_key(url)
+        with self.lock:
+            if time.time() - self.failed.get(key, 0) < RETRY_AFTER:
+                raise MirrorError(f"Fetching {url} failed recently")
+            key_lock = self.fetching.setdefault(key, threading.Lock())
+        from app.images import ImageSettings, FORMATS, VARIANTS
+        settings = ImageSettings.from_config(config)
+        extension = FORMATS[settings.variant_format][1]
+        paths = {name: os.path.join(config['IMAGE_MIRROR_FOLDER'], self.filename(key, name, extension)) for name in VARIANTS}
+        with key_lock:
+            try:
+                if all(os.path.exists(path) for path in paths.values()):
+                    return
+                self.write_variants(self.download(url, config), settings, paths)
+            except MirrorError:
+                with self.lock:
+                    self.failed[key] = time.time()
+                raise
+            finally:
+                with self.lock:
+                    self.fetching.pop(key, None)
+        # what was just written is about to be served
+        self.evict(config, keep=set(paths.values()))
+
+    def download(self, url: str, config) -> bytes:
+        import requests
+        try:
+            with requests.get(url, timeout=config.get('IMAGE_MIRROR_TIMEOUT', 10), stream=True) as response:
+                response.raise_for_status()
+                data = bytearray()
+                for chunk in response.iter_content(64 * 1024):
+                    data += chunk
+                    if len(data) > MAX_REMOTE_BYTES:
+                        raise MirrorError(f"{url} is larger than {MAX_REMOTE_BYTES} bytes")
+                return bytes(data)
+        except requests.RequestException as e:
+            raise MirrorError(f"Fetching {url} failed: {e}") from e
+
+    def write_variants(self, data: bytes, settings, paths: dict[str, str]) -> None:
+        from app.images import InvalidImage, SNIFF_BYTES, clean, open_image, sniff, variant_images, write
+        kind = sniff(data[:SNIFF_BYTES])
+        if kind is None:
+            raise MirrorError("Remote file isn't a JPEG, PNG or WebP image")
+        os.makedirs(os.path.dirname(next(iter(paths.values()))), exist_ok=True)
+        try:
+            with open_image(io.BytesIO(data), kind) as image:
+                variants = variant_images(clean(image, settings), settings)
+        except InvalidImage as e:
+            raise MirrorError(str(e)) from e
+        written = 0
+        for name, path in paths.items():
+            write(variants[name], settings.variant_format, path)
+            written += os.path.getsize(path)
+        with self.lock:
+            if self.total_bytes is not None:
+                self.total_bytes += written
+
+    def touch(self, path: str) -> bool:
+        """Mark a cached file as recently used; False if it isn't cached"""
+        try:
+            if time.time() - os.path.getmtime(path) > TOUCH_INTERVAL:
+                os.utime(path)
+        except OSError:
+            return False
+        return True
+
+    def cached_files(self, folder: str) -> list[tuple[float, int, str]]:
+        """(mtime, size, path) of every cached file"""
+        if not os.path.isdir(folder):
+            return []
+        files = []
+        for entry in os.scandir(folder):
+            if entry.is_file() and not entry.name.endswith('.part'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def evict(self, config, keep: set[str] = set()) -> int:
+        """Remove least recently used files, other than `keep`, while the cache is over its cap; returns how many were removed"""
+        max_bytes = config.get('IMAGE_MIRROR_MAX_BYTES', 0)
+        with self.lock:
+            if not max_bytes or (self.total_bytes is not None and self.total_bytes <= max_bytes):
+                return 0
+            files = self.cached_files(config['IMAGE_MIRROR_FOLDER'])
+            total = sum(size for _, size, _ in files)
+            removed = 0
+            if total > max_bytes:
+                for _, size, path in sorted(files):
+                    if total <= max_bytes * EVICT_TO:
+                        break
+                    if path in keep:
+                        continue
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+                    removed += 1
+            self.total_bytes = total
+            self.evicted += removed
+            return removed
+
+
+mirror = ImageMirror()
+
+
+def mirror_recipe_images(workers: int = 8) -> dict:
+    """Fetch the remote images of every recipe not mirrored yet, stopping once the cache starts evicting"""
+    from app.images import VARIANTS
+    from app.models import Recipe, db
+    config = current_app.config
+    folder = config['IMAGE_MIRROR_FOLDER']
+    extension = variant_extension()
+    urls = {image for (image,) in db.session.query(Recipe.image).distinct() if is_remote(image)}
+    missing = sorted(url for url in urls if not all(
+        os.path.exists(os.path.join(folder, mirror.filename(url_key(url), name, extension))) for name in VARIANTS))
+    counts = {"recipes": len(urls), "fetched": 0, "failed": 0, "skipped": len(urls) - len(missing)}
+    evicted = mirror.evicted
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='mirror') as executor:
+        futures = {executor.submit(mirror.fetch, url, config): url for url in missing}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                counts["fetched"] += 1
+            except MirrorError as e:
+                print(e)
+                counts["failed"] += 1
+            if mirror.evicted > evicted:
+                # going on would only evict what was just fetched
+                print("Image cache is full; the remaining images are fetched when first requested")
+                for pending in futures:
+                    pending.cancel()
+                break
+    return counts
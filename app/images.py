@@ -0,0 +1,261 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import IO, NamedTuple
+from flask import current_app
+import os
+import threading
+import uuid
+
+# Uploaded images are re-encoded before they are stored. The type comes from
+# the file's first bytes, not its name. EXIF (GPS position, camera serial) is
+# dropped once its rotation has been applied, and the stored original is
+# downscaled to IMAGE_MAX_DIMENSION. Fixed-size variants for list views are
+# written next to it:
+#
+#   static/uploads/<name>.jpg           the original
+#   static/uploads/<name>.thumb.webp    IMAGE_THUMB_SIZE square, cropped to fill
+#   static/uploads/<name>.medium.webp   fits in IMAGE_MEDIUM_SIZE
+#
+# Decoding and encoding run on a small thread pool (Pillow releases the GIL
+# while it works), which also bounds how many uploads are held decoded at
+# once. The request waits for the original; variants are written in the
+# background and image_urls() falls back to the original until they exist.
+
+# Pillow format and file extension for each type we accept
+FORMATS = {'jpeg': ('JPEG', 'jpg'), 'png': ('PNG', 'png'), 'webp': ('WEBP', 'webp')}
+VARIANTS = ('thumb', 'medium')
+# leading bytes sniff() needs
+SNIFF_BYTES = 12
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+UPLOADS_PREFIX = os.path.join('static', 'uploads')
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+@lru_cache(maxsize=None)
+def webp_supported() -> bool:
+    from PIL import features
+    return bool(features.check('webp'))
+
+
+class ImageSettings(NamedTuple):
+    max_dimension: int
+    max_pixels: int
+    thumb_size: int
+    medium_size: int
+    variant_format: str
+
+    @classmethod
+    def from_config(cls, config) -> ImageSettings:
+        variant_format = config.get('IMAGE_VARIANT_FORMAT', 'webp')
+        if variant_format == 'webp' and not webp_supported():
+            variant_format = 'jpeg'
+        return cls(
+            config.get('IMAGE_MAX_DIMENSION', 2048),
+            config.get('IMAGE_MAX_PIXELS', 40_000_000),
+            config.get('IMAGE_THUMB_SIZE', 200),
+            config.get('IMAGE_MEDIUM_SIZE', 800),
+            variant_format,
+        )
+
+
+def sniff(head: bytes) -> str | None:
+    """The image type from the first SNIFF_BYTES of a file, or None if it isn't one we accept"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+def variant_path(path: str, name: str, variant_format: str) -> str:
+    return f"{os.path.splitext(path)[0]}.{name}.{FORMATS[variant_format][1]}"
+
+def is_variant(filename: str) -> bool:
+    return any(f".{name}." in filename for name in VARIANTS)
+
+
+def open_image(source: str | IO[bytes], kind: str):
+    from PIL import Image, UnidentifiedImageError
+    try:
+        return Image.open(source, formats=[FORMATS[kind][0]])
+    except Image.DecompressionBombError as e:
+        raise InvalidImage("Image is too large") from e
+    except (UnidentifiedImageError, OSError) as e:
+        raise InvalidImage(f"Not a valid {kind} image") from e
+
+def clean(image, settings: ImageSettings):
+    """The image upright, without metadata and no larger than max_dimension"""
+    from PIL import ImageOps
+    if image.width * image.height > settings.max_pixels:
+        raise InvalidImage(f"Image is too large ({image.width}x{image.height})")
+    try:
+        image.draft('RGB', (settings.max_dimension, settings.max_dimension))
+        upright = ImageOps.exif_transpose(image)
+        upright.load()
+    except OSError as e:
+        raise InvalidImage("Image data is truncated or corrupt") from e
+    icc_profile = upright.info.get('icc_profile')
+    upright.info = {'icc_profile': icc_profile} if icc_profile else {}
+    upright.thumbnail((settings.max_dimension, settings.max_dimension))
+    return upright
+
+def flatten(image):
+    """RGB for formats without transparency, over a white background"""
+    from PIL import Image
+    if image.mode in ('RGB', 'L'):
+        return image
+    rgba = image.convert('RGBA')
+    background = Image.new('RGB', rgba.size, (255, 255, 255))
+    background.paste(rgba, mask=rgba.getchannel('A'))
+    return background
+
+def write(image, kind: str, path: str) -> None:
+    """Encode to a temporary file and rename, so a half-written image is never served"""
+    options = {'icc_profile': image.info['icc_profile']} if 'icc_profile' in image.info else {}
+    if kind == 'jpeg':
+        image = flatten(image)
+        options.update(quality=JPEG_QUALITY, optimize=True, progressive=True)
+    elif kind == 'webp':
+        options.update(quality=WEBP_QUALITY, method=4)
+    else:
+        options.update(optimize=True)
+    temporary = f"{path}.{uuid.uuid4().hex}.part"
+    try:
+        image.save(temporary, FORMATS[kind][0], **options)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+def store_original(source: str | IO[bytes], kind: str, path: str, settings: ImageSettings) -> None:
+    with open_image(source, kind) as image:
+        write(clean(image, settings), kind, path)
+
+def variant_images(image, settings: ImageSettings) -> dict:
+    """The thumbnail and medium renditions of a loaded image"""
+    from PIL import ImageOps
+    thumb = ImageOps.fit(image, (settings.thumb_size, settings.thumb_size))
+    medium = image.copy()
+    medium.thumbnail((settings.medium_size, settings.medium_size))
+    return {'thumb': thumb, 'medium': medium}
+
+def write_variants(path: str, kind: str, settings: ImageSettings) -> None:
+    with open_image(path, kind) as image:
+        image.load()
+        for name, variant in variant_images(image, settings).items():
+            write(variant, settings.variant_format, variant_path(path, name, settings.variant_format))
+
+
+class ImagePipeline:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor: ThreadPoolExecutor | None = None
+
+    def _get_executor(self, workers: int) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='images')
+            return self.executor
+
+    def run(self, workers: int, job, *args):
+        """Run `job` on the pool and wait for it"""
+        if workers <= 0:
+            return job(*args)
+        return self._get_executor(workers).submit(job, *args).result()
+
+    def submit(self, workers: int, job, *args) -> None:
+        """Run `job` on the pool without waiting; failures are logged"""
+        logger = current_app.logger
+        def logged():
+            try:
+                job(*args)
+            except Exception as e:
+                logger.error(f"Image job {job.__name__}{args[:1]} failed: {e}")
+        if workers <= 0:
+            logged()
+        else:
+            self._get_executor(workers).submit(logged)
+
+
+pipeline = ImagePipeline()
+
+
+def save_image(file, name: str | None = None) -> str:
+    """Validate, clean and store an uploaded image as `name` (random by default) plus its extension;
+    returns its path as saved on the models ('static/uploads/...')"""
+    config = current_app.config
+    head = file.stream.read(SNIFF_BYTES)
+    file.stream.seek(0)
+    kind = sniff(head)
+    if kind is None:
+        raise InvalidImage("Upload a JPEG, PNG or WebP image")
+
+    upload_folder = config['UPLOAD_FOLDER']
+    os.makedirs(upload_folder, exist_ok=True)
+    filename = f"{name or uuid.uuid4().hex}.{FORMATS[kind][1]}"
+    path = os.path.join(upload_folder, filename)
+    settings = ImageSettings.from_config(config)
+    workers = config.get('IMAGE_WORKERS', 0)
+    pipeline.run(workers, store_original, file.stream, kind, path, settings)
+    pipeline.submit(workers, write_variants, path, kind, settings)
+    return os.path.join(UPLOADS_PREFIX, filename)
+
+def image_urls(image: str | None) -> dict | None:
+    """Long-cached URLs of an uploaded image and its thumbnail and medium variants,
+    the original standing in for a variant that isn't written yet"""
+    if not image or not image.startswith(UPLOADS_PREFIX):
+        return None
+    from app.static_assets import asset_url
+    original = asset_url(image) or image
+    variant_format = ImageSettings.from_config(current_app.config).variant_format
+    urls = {name: asset_url(variant_path(image, name, variant_format)) or original for name in VARIANTS}
+    urls['original'] = original
+    return urls
+
+def delete_image(image: str | None) -> None:
+    """Remove an uploaded image and its variants"""
+    if not image or not image.startswith(UPLOADS_PREFIX) or os.path.basename(image) == 'default_image.jpg':
+        return
+    folder = current_app.config['UPLOAD_FOLDER']
+    paths = [image] + [variant_path(image, name, kind) for name in VARIANTS for kind in ('webp', 'jpeg')]
+    for path in paths:
+        try:
+            os.remove(os.path.join(folder, os.path.basename(path)))
+        except FileNotFoundError:
+            pass
+
+
+def backfill(originals: bool = False) -> dict:
+    """Write missing variants for images uploaded before the pipeline, and with `originals` clean those too"""
+    config = current_app.config
+    settings = ImageSettings.from_config(config)
+    folder = config['UPLOAD_FOLDER']
+    counts = {"variants": 0, "cleaned": 0, "skipped": 0}
+    for filename in sorted(os.listdir(folder)):
+        path = os.path.join(folder, filename)
+        if is_variant(filename) or filename.endswith('.part') or not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as fin:
+            kind = sniff(fin.read(SNIFF_BYTES))
+        if kind is None:
+            counts["skipped"] += 1
+            continue
+        try:
+            if originals:
+                before = os.path.getsize(path)
+                store_original(path, kind, path, settings)
+                counts["cleaned"] += 1
+                print(f"{filename}: {before // 1024} KB -> {os.path.getsize(path) // 1024} KB")
+            if not all(os.path.exists(variant_path(path, name, settings.variant_format)) for name in VARIANTS):
+                write_variants(path, kind, settings)
+                counts["variants"] += 1
+        except InvalidImage as e:
+            print(f"Skipping {filename}: {e}")
+            counts["skipped"] += 1
+    return counts
@@ -0,0 +1,194 @@
+from __future__ import annotations
+from collections import Counter, deque
+from datetime import datetime
+from typing import Callable
+from flask import Flask, current_app, g, has_request_context, jsonify, request
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import atexit
+import hmac
+import json
+import threading
+import time
+
+# Per-endpoint request metrics: query count, SQL time, commits and latency
+# percentiles, gathered from SQLAlchemy cursor events and Flask request hooks.
+#
+#   GET /metrics/         JSON snapshot, for METRICS_TOKEN as a bearer token or a logged-in admin
+#   METRICS_DUMP_PATH     snapshot also written there when the process exits
+#   QUERY_REPEAT_THRESHOLD  log requests that run one statement this many times (N+1); 0 disables
+#
+# The snapshot also carries the hit and miss counts of the in-memory caches
+# registered with watch_cache().
+#
+# Statements outside a request (event handlers, CLI commands) aren't counted.
+# Requests are recorded on teardown, so one that raises is counted too, as an
+# error along with those answered with a 5xx.
+
+# latencies kept per endpoint for the percentiles
+SAMPLE_SIZE = 1000
+# histogram bucket upper bounds in ms
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.sql_seconds = 0.0
+        self.commits = 0
+        self.errors = 0
+        self.latencies: deque[float] = deque(maxlen=SAMPLE_SIZE)
+        self.histogram = [0] * (len(BUCKETS_MS) + 1)
+        self.repeated_statements = 0
+        self.last_repeated: tuple[int, str] | None = None
+
+    def record(self, seconds: float, queries: int, sql_seconds: float, commits: int, repeated: tuple[int, str] | None,
+               failed: bool = False) -> None:
+        self.requests += 1
+        self.errors += failed
+        self.queries += queries
+        self.max_queries = max(self.max_queries, queries)
+        self.sql_seconds += sql_seconds
+        self.commits += commits
+        self.latencies.append(seconds)
+        ms = seconds * 1000
+        self.histogram[next((i for i, bound in enumerate(BUCKETS_MS) if ms <= bound), len(BUCKETS_MS))] += 1
+        if repeated is not None:
+            self.repeated_statements += 1
+            self.last_repeated = repeated
+
+    def to_json(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "requests": self.requests,
+            "queries": {"total": self.queries, "mean": round(self.queries / self.requests, 2), "max": self.max_queries},
+            "sql_ms": {"total": round(self.sql_seconds * 1000, 2), "mean": round(self.sql_seconds * 1000 / self.requests, 2)},
+            "commits": self.commits,
+            "errors": self.errors,
+            "latency_ms": {name: round(percentile(latencies, fraction) * 1000, 2) for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+            # requests per bucket, up to and including "le" ms (null: slower than the last bound)
+            "latency_histogram_ms": [{"le": bound, "count": count} for bound, count in zip((*BUCKETS_MS, None), self.histogram)],
+            "repeated_statements": {
+                "requests": self.repeated_statements,
+                "last": None if self.last_repeated is None else {"times": self.last_repeated[0], "statement": self.last_repeated[1]},
+            },
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints: dict[str, EndpointStats] = {}
+        self.started_at = datetime.now()
+        self.repeat_threshold = 0
+        # cache name -> its stats()
+        self.caches: dict[str, Callable[[], dict]] = {}
+
+    def init_app(self, app: Flask) -> None:
+        self.repeat_threshold = app.config.get('QUERY_REPEAT_THRESHOLD', 0)
+        app.before_request(self.start_request)
+        app.after_request(self.note_status)
+        app.teardown_request(self.finish_request)
+        app.add_url_rule('/metrics/', 'metrics', self.metrics_view)
+        from app.login.routes import verified_tokens
+        self.watch_cache('verified_tokens', verified_tokens.stats)
+        dump_path = app.config.get('METRICS_DUMP_PATH')
+        if dump_path:
+            atexit.register(self.dump, dump_path)
+
+    def watch_cache(self, name: str, stats: Callable[[], dict]) -> None:
+        self.caches[name] = stats
+
+    def start_request(self) -> None:
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_sql_seconds = 0.0
+        g.metrics_commits = 0
+        g.metrics_statements = Counter() if self.repeat_threshold > 0 else None
+
+    def note_status(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def finish_request(self, exc: BaseException | None) -> None:
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        failed = exc is not None or g.get('metrics_status', 500) >= 500
+        endpoint = request.endpoint or 'unmatched'
+        repeated = None
+        statements = g.get('metrics_statements')
+        if statements:
+            statement, times = statements.most_common(1)[0]
+            if times >= self.repeat_threshold:
+                repeated = (times, statement)
+                print(f"Possible N+1 in {endpoint}: {times} x {statement[:200]}")
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.record(time.perf_counter() - started, g.metrics_queries, g.metrics_sql_seconds, g.metrics_commits, repeated, failed)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            endpoints = {name: stats.to_json() for name, stats in sorted(self.endpoints.items())}
+        caches = {name: stats() for name, stats in sorted(self.caches.items())}
+        return {"since": self.started_at.isoformat(), "endpoints": endpoints, "caches": caches}
+
+    def dump(self, path: str) -> None:
+        with open(path, 'w') as fout:
+            json.dump(self.snapshot(), fout, indent=2)
+
+    @staticmethod
+    def may_read() -> bool:
+        # the peer address proves nothing behind a reverse proxy, so the caller has to
+        token = current_app.config.get('METRICS_TOKEN')
+        if token:
+            supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+            if hmac.compare_digest(supplied.encode(), token.encode()):
+                return True
+        return current_user.is_authenticated and bool(current_user.is_admin)
+
+    def metrics_view(self):
+        if not self.may_read():
+            return jsonify({"message": "Not found"}), 404
+        return jsonify(self.snapshot()), 200
+
+
+metrics = Metrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'metrics_started' in g:
+        conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_query_started')
+    if not started or not has_request_context() or 'metrics_started' not in g:
+        return
+    g.metrics_sql_seconds += time.perf_counter() - started.pop()
+    g.metrics_queries += 1
+    if g.metrics_statements is not None:
+        g.metrics_statements[statement] += 1
+
+@event.listens_for(Engine, 'commit')
+def _commit(conn):
+    if has_request_context() and 'metrics_started' in g:
+        g.metrics_commits += 1
+
+@event.listens_for(Engine, 'handle_error')
+def _query_failed(context):
+    # after_cursor_execute doesn't run for a failed statement
+    started = context.connection.info.get('metrics_query_started') if context.connection is not None else None
+    if started:
+        started.pop()
@@ -0,0 +1,104 @@
+from __future__ import annotations
+from typing import Callable
+import threading
+import time
+
+# Signing keys of the SSO provider, fetched from its JWKS endpoint and cached.
+#
+#   younger than ttl                  served from memory
+#   older than ttl, within stale_ttl  served from memory while one background thread refreshes
+#   older than ttl + stale_ttl        refreshed before answering
+#   unknown kid                       refreshed before answering
+#
+# Blocking refreshes happen at most once per min_refresh_interval, so a provider
+# outage or a stream of made-up kids can't turn every login into a fetch.
+#
+# Nothing is fetched, or even imported, until the first token has to be checked.
+
+DEFAULT_TTL = 3600
+DEFAULT_STALE_TTL = 24 * 3600
+DEFAULT_MIN_REFRESH_INTERVAL = 60
+FETCH_TIMEOUT = 5
+
+def fetch_jwks(url: str) -> dict:
+    import requests
+    response = requests.get(url, timeout=FETCH_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+def parse_jwks(jwks: dict) -> dict:
+    from jwt.algorithms import RSAAlgorithm
+    keys = {}
+    for jwk in jwks.get('keys', []):
+        if jwk.get('kty') == 'RSA' and 'kid' in jwk:
+            keys[jwk['kid']] = RSAAlgorithm.from_jwk(jwk)
+    return keys
+
+
+class JWKSKeyStore:
+    def __init__(self, url: str, ttl: float = DEFAULT_TTL, stale_ttl: float = DEFAULT_STALE_TTL,
+                 min_refresh_interval: float = DEFAULT_MIN_REFRESH_INTERVAL, fetch: Callable[[str], dict] = fetch_jwks):
+        self.url = url
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.min_refresh_interval = min_refresh_interval
+        # swap in a local JWKS stand-in here, e.g. lambda url: {"keys": [...]}
+        self.fetch = fetch
+        self.lock = threading.Lock()
+        self.keys: dict = {}
+        self.fetched_at: float | None = None
+        self.last_attempt: float | None = None
+        self.refreshing = False
+
+    def get_key(self, kid: str | None):
+        """The public key for `kid`, or None if the provider doesn't (or no longer) publish it"""
+        now = time.monotonic()
+        age = None if self.fetched_at is None else now - self.fetched_at
+
+        # blocking refreshes decide under the lock, so callers arriving during a fetch wait for its keys
+        if age is None or age > self.ttl + self.stale_ttl:
+            self.refresh(unless=self._fresh_enough)
+        elif age > self.ttl:
+            self.refresh_in_background()
+
+        key = self.keys.get(kid)
+        if key is None and kid is not None:
+            # keys rotate: an unknown kid may have been published since the last fetch
+            self.refresh(unless=lambda: kid in self.keys)
+            key = self.keys.get(kid)
+        return key
+
+    def _fresh_enough(self) -> bool:
+        return self.fetched_at is not None and time.monotonic() - self.fetched_at <= self.ttl + self.stale_ttl
+
+    def _may_refresh(self, now: float) -> bool:
+        return self.last_attempt is None or now - self.last_attempt >= self.min_refresh_interval
+
+    def refresh(self, unless: Callable[[], bool] | None = None) -> bool:
+        """Fetch the keys now; with `unless`, skip the fetch if that holds once the lock is taken"""
+        with self.lock:
+            # threads queued behind a refresh find it done (or just attempted) and don't fetch again
+            if unless is not None and (unless() or not self._may_refresh(time.monotonic())):
+                return False
+            self.last_attempt = time.monotonic()
+            try:
+                keys = parse_jwks(self.fetch(self.url))
+            except Exception as e:
+                print(f"Error fetching signing keys: {e}")
+                return False
+            self.keys = keys
+            self.fetched_at = time.monotonic()
+            return True
+
+    def refresh_in_background(self) -> None:
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self.refreshing = False
+        threading.Thread(target=run, daemon=True, name='jwks-refresh').start()
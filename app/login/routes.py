@@ -5,45 +5,41 @@ from app.models import *
 from better_profanity import profanity
 from datetime import datetime, UTC
 import html
-from flask import request, jsonify, render_template, redirect, url_for, flash, current_app
+from flask import request, jsonify, render_template, redirect, url_for, flash, current_app, session
 from flask_login import login_required
 from flask_login import current_user, login_user, logout_user
-from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity, get_jwt
 import os
-from werkzeug.utils import secure_filename
-import uuid
-import jwt
-import requests
-from jwt.algorithms import RSAAlgorithm
-import redis
+from app.login.jwks import JWKSKeyStore
+from app.login.token_cache import VerifiedTokenCache
+from app.blobstore import store_image
+from app.images import InvalidImage, image_urls
 import time
 
 TENANT_ID = os.getenv("TENANT_ID")
 CLIENT_ID = os.getenv("CLIENT_ID")
 JWKS_URL = f"https://login.microsoftonline.com/{TENANT_ID}/discovery/v2.0/keys"
 
-profanity.load_censor_words()
-
-def get_signing_keys():
-    response = requests.get(JWKS_URL)
-    keys = response.json()['keys']
-    return {key['kid']: RSAAlgorithm.from_jwk(key) for key in keys}
-
-SIGNING_KEYS = get_signing_keys()
+# fetched lazily on the first SSO token and cached, see app/login/jwks.py
+signing_keys = JWKSKeyStore(JWKS_URL)
+# claims of tokens already verified, until they expire, see app/login/token_cache.py
+verified_tokens = VerifiedTokenCache()
 
 def validate_jwt(token):
-    global SIGNING_KEYS
+    decoded_token = verified_tokens.get(token)
+    if decoded_token is not None:
+        return decoded_token
+
+    # PyJWT (and cryptography behind it) is only loaded once a token shows up
+    import jwt
     try:
-        SIGNING_KEYS = get_signing_keys()  # Refresh keys
         headers = jwt.get_unverified_header(token)
         kid = headers.get('kid')
         print(f"JWT Kid: {kid}")
 
-        if kid not in SIGNING_KEYS:
-            print("KID not found in signing keys. Refreshing keys...")
-            SIGNING_KEYS = get_signing_keys()
-
-        key = SIGNING_KEYS.get(kid, None)
+        key = signing_keys.get_key(kid)
+        if key is None:
+            print("KID not found in signing keys")
+            return None
 
         decoded_token = jwt.decode(
             token,
@@ -52,6 +48,10 @@ def validate_jwt(token):
             audience=CLIENT_ID,
             issuer=f"https://login.microsoftonline.com/{TENANT_ID}/v2.0"
         )
+        if verified_tokens.is_revoked(token, decoded_token):
+            print("JWT was revoked by a logout")
+            return None
+        verified_tokens.put(token, decoded_token)
         return decoded_token
     except jwt.ExpiredSignatureError:
         print("JWT expired")
@@ -61,6 +61,7 @@ def validate_jwt(token):
         return None
 
 def decode_jwt_header(token):
+    import jwt
     try:
         # Get the unverified header to check which key was used to sign the JWT
         header = jwt.get_unverified_header(token)
@@ -71,7 +72,7 @@ def decode_jwt_header(token):
         return None
 
 #File storage:
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -161,16 +162,10 @@ def api_register():
     db.session.commit()  # Commit so `new_user.id` is generated
 
     if profile_picture and allowed_file(profile_picture.filename):
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        os.makedirs(upload_folder, exist_ok=True)
-        filename = profile_picture.filename
-        if not filename:
-            return jsonify({"message": "No file part"}), 400
-        filename = f"{uuid.uuid4().hex}_{secure_filename(filename)}"
-        file_path = os.path.join(upload_folder, filename)
-        profile_picture.save(file_path)
-
-        relative_path = os.path.join('static', 'uploads', filename)
+        try:
+            relative_path = store_image(profile_picture)
+        except InvalidImage as e:
+            return jsonify({"message": str(e)}), 400
         new_user.profile_picture = relative_path
         profile_picture_url = relative_path
         db.session.commit()
@@ -207,7 +202,8 @@ def api_register():
         login_user(user, remember=True)
         return jsonify({
         "message": "Registration successful",
-        "profile_picture_url": profile_picture_url
+        "profile_picture_url": profile_picture_url,
+        "profile_picture_variants": image_urls(profile_picture_url)
     }), 200
     else:
         print("User not registered")
@@ -241,6 +237,7 @@ def validate_user():
         print("invalid 2")
         return jsonify({"valid": False, "message": "Email already in use"}), 400
 
+    # the censor word list is loaded by the first check rather than at import
     if username and profanity.contains_profanity(username):
         print("invalid 3")
         return jsonify({"valid": False, "message": "Username cannot contain inappropriate language"}), 400
@@ -266,12 +263,6 @@ def sso_login():
         return jsonify({"message": "Invalid request. No data"}), 400
     token = data.get("token")
 
-    decoded = jwt.decode(token, options={"verify_signature": False})
-    print("DECODED TOKEN: ", decoded)
-    exp = decoded.get("exp", 0)
-    print(f"Token expires at: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(exp))}")
-
-
     if not token:
         print("invalid request no token")
         return jsonify({"message": "No token provided"}), 400
@@ -280,6 +271,7 @@ def sso_login():
     if not decoded_token:
         print("invalid token")
         return jsonify({"message": "Invalid token"}), 401
+    print(f"Token expires at: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(decoded_token.get('exp', 0)))}")
 
     email = decoded_token.get("preferred_username")  #email
     name = decoded_token.get("name")
@@ -345,49 +337,33 @@ def get_initial_data():
 
 @bp.route('/logout', methods=['POST'])
 def logout():
+    # The session always ends, even when the token is stale or can't be verified
+    logout_user()
+    session.clear()
+
     # Get the token from the Authorization header
     token = request.headers.get('Authorization')
-    
-    # Ensure the token is present in the request
     if not token:
-        return jsonify({"message": "Token is missing from request"}), 400
+        return jsonify({"message": "Successfully logged out"}), 200
 
     # Remove "Bearer " prefix if it exists
     token = token.replace("Bearer ", "")
 
-    # Decode the JWT to check its contents without verifying signature for debugging
-    try:
-        decoded = jwt.decode(token, options={"verify_signature": False})
-        print("Decoded token: ", decoded)
-        exp = decoded.get("exp", 0)
-        print(f"Token expires at: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(exp))}")
-    except jwt.DecodeError as e:
-        print(f"Error decoding JWT: {e}")
-        return jsonify({"message": "Invalid token"}), 401
+    # Now check if the token is an access token or an ID token; only a verified token is revoked
+    decoded_token = validate_jwt(token)
+    if not decoded_token:
+        return jsonify({"message": "Successfully logged out; the token could not be verified, so it was not revoked"}), 200
+    # refused from now on, whether its claims are cached or verified again
+    verified_tokens.revoke(token, decoded_token)
+    print(f"Token expires at: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(decoded_token.get('exp', 0)))}")
 
-    # Now check if the token is an access token or an ID token
-    if 'id_token' in decoded:
-        # If it's an ID token, you need to handle it differently (probably store it in session or invalidate it based on its session)
+    if 'id_token' in decoded_token:
         print("ID Token detected - Handle logout with ID token")
-        # If you're using the ID token for login, you need to invalidate the session based on that
-        # Here you would typically invalidate the user session
-        logout_user()
         return jsonify({"message": "Successfully logged out with ID token"}), 200
-    
-    # Otherwise, it's an access token and you can proceed with the revocation
-    decoded_token = validate_jwt(token)
-    if not decoded_token:
-        return jsonify({"message": "Invalid access token"}), 401
 
-    # Extract the JWT ID (jti) to keep track of the token and revoke it
     jti = decoded_token.get("jti")
     if jti:
-        # Store the JWT ID in Redis with a 24-hour expiration time to mark it as revoked
-        revoked_tokens.set(jti, "revoked", ex=3600 * 24)  
         print(f"Access token {jti} marked as revoked.")
-
-    # Log out the current user (invalidate the session)
-    logout_user()
     return jsonify({"message": "Successfully logged out"}), 200
 
 @bp.route('/current_user/', methods=['GET'])
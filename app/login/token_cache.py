@@ -0,0 +1,94 @@
+from __future__ import annotations
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+# Claims of SSO tokens whose signature has already been checked. A login
+# submits the same ID token several times (sso, get_initial_data, logout), so
+# only the first submission pays for the RS256 verification and key lookup.
+#
+# Entries are keyed by a SHA-256 of the token, so raw tokens aren't kept in
+# memory, and expire at the token's own `exp`. Tokens without one aren't cached.
+#
+# Logging out revokes the token: its `jti` (or, without one, its hash) is
+# refused until the token would have expired anyway, whether the claims come
+# from here or from a fresh verification. Revocations live in this process only.
+
+DEFAULT_MAX_SIZE = 1024
+# how long a token without an `exp` stays revoked
+REVOKED_TTL = 24 * 3600
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def revocation_key(token: str, claims: dict) -> str:
+    jti = claims.get('jti')
+    return f"jti:{jti}" if jti else token_key(token)
+
+
+class VerifiedTokenCache:
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # token hash -> (exp, claims), least recently used first
+        self.entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        # revocation key -> when the revocation can be forgotten
+        self.revoked: dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> dict | None:
+        """The verified claims of `token`, or None if it has to be verified"""
+        key = token_key(token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (entry[0] <= time.time() or self._is_revoked(token, entry[1])):
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, token: str, claims: dict) -> None:
+        exp = claims.get('exp')
+        if not isinstance(exp, (int, float)) or exp <= time.time():
+            return
+        key = token_key(token)
+        with self.lock:
+            # a verification that raced a logout
+            if self._is_revoked(token, claims):
+                return
+            self.entries[key] = (exp, dict(claims))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def discard(self, token: str) -> None:
+        with self.lock:
+            self.entries.pop(token_key(token), None)
+
+    def revoke(self, token: str, claims: dict) -> None:
+        """Refuse `token` (and any token sharing its jti) until it expires"""
+        now = time.time()
+        exp = claims.get('exp')
+        until = exp if isinstance(exp, (int, float)) else now + REVOKED_TTL
+        with self.lock:
+            self.entries.pop(token_key(token), None)
+            self.revoked = {key: expires for key, expires in self.revoked.items() if expires > now}
+            if until > now:
+                self.revoked[revocation_key(token, claims)] = until
+
+    def is_revoked(self, token: str, claims: dict) -> bool:
+        with self.lock:
+            return self._is_revoked(token, claims)
+
+    def _is_revoked(self, token: str, claims: dict) -> bool:
+        return self.revoked.get(revocation_key(token, claims), 0) > time.time()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "max_size": self.max_size, "revoked": len(self.revoked)}
@@ -0,0 +1,96 @@
+from __future__ import annotations
+from datetime import datetime
+from types import ModuleType
+from sqlalchemy import delete, insert
+from app.models import SchemaMigration, db
+import click
+import importlib
+import pkgutil
+
+# Versioned schema migrations. Each module named v<version>_<name>.py defines
+#
+#   VERSION       '0001', ordering the migrations
+#   DESCRIPTION   one line for `flask migrations status`
+#   upgrade(connection) / downgrade(connection)
+#
+# and SchemaMigration records which ones a database has. Migrations should be
+# idempotent (checkfirst=True and the like): MySQL commits DDL as it goes, so a
+# migration that fails halfway is simply run again once the cause is fixed.
+#
+# Fresh databases get the current schema from create_all; upgrading them
+# afterwards only records the versions.
+
+def all_migrations() -> list[ModuleType]:
+    modules = [importlib.import_module(f"{__name__}.{info.name}") for info in pkgutil.iter_modules(__path__) if info.name.startswith('v')]
+    return sorted(modules, key=lambda module: module.VERSION)
+
+def applied_versions() -> set[str]:
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)  # type: ignore
+    return {version for (version,) in db.session.query(SchemaMigration.version)}
+
+def upgrade(target: str | None = None) -> list[str]:
+    """Apply every pending migration up to `target` (default: all) and return their versions"""
+    applied = applied_versions()
+    db.session.commit()
+    done = []
+    for migration in all_migrations():
+        if target is not None and migration.VERSION > target:
+            break
+        if migration.VERSION in applied:
+            continue
+        with db.engine.begin() as connection:
+            migration.upgrade(connection)
+            connection.execute(insert(SchemaMigration).values(version=migration.VERSION, description=migration.DESCRIPTION, applied_at=datetime.now()))
+        done.append(migration.VERSION)
+    return done
+
+def downgrade(target: str) -> list[str]:
+    """Revert applied migrations newer than `target`, newest first"""
+    applied = applied_versions()
+    db.session.commit()
+    done = []
+    for migration in reversed(all_migrations()):
+        if migration.VERSION <= target or migration.VERSION not in applied:
+            continue
+        with db.engine.begin() as connection:
+            migration.downgrade(connection)
+            connection.execute(delete(SchemaMigration).where(SchemaMigration.version == migration.VERSION))
+        done.append(migration.VERSION)
+    return done
+
+
+@click.group('migrations')
+def migrations_command():
+    """Versioned schema migrations"""
+
+@migrations_command.command('status')
+def status_command():
+    """List migrations and whether they are applied"""
+    applied = applied_versions()
+    for migration in all_migrations():
+        print(f"{'applied' if migration.VERSION in applied else 'pending':8} {migration.VERSION}  {migration.DESCRIPTION}")
+
+@migrations_command.command('upgrade')
+@click.argument('target', required=False)
+def upgrade_command(target):
+    """Apply pending migrations, up to TARGET if given"""
+    done = upgrade(target)
+    print(f"Applied {', '.join(done)}" if done else "Nothing to apply")
+
+@migrations_command.command('downgrade')
+@click.argument('target')
+def downgrade_command(target):
+    """Revert migrations newer than TARGET (0000 reverts all)"""
+    done = downgrade(target)
+    print(f"Reverted {', '.join(done)}" if done else "Nothing to revert")
+
+@migrations_command.command('plans')
+def plans_command():
+    """EXPLAIN the hot queries and report any that don't use an index"""
+    from app.migrations.plans import check_plans
+    missing = 0
+    for name, uses_index, plan in check_plans():
+        missing += not uses_index
+        print(f"{'index' if uses_index else 'SCAN ':6} {name}: {plan}")
+    if missing:
+        raise SystemExit(f"{missing} hot queries don't use an index")
@@ -0,0 +1,57 @@
+from __future__ import annotations
+from datetime import datetime
+from sqlalchemy import select
+from app.models import (Challenge, ChallengeParticipant, GroupMember, Ingredient, Message, RecipeRecipeList, Review,
+                        ShoppingListItem, User, UserNotifications, db)
+
+# The lookups behind the hot endpoints, checked with EXPLAIN by
+# `flask migrations plans`. A planner may still prefer a scan on a nearly
+# empty table, so run it against a database with realistic data.
+
+def hot_queries() -> dict:
+    return {
+        "notifications by user, type and read state": select(UserNotifications.id).where(
+            UserNotifications.user_id == 1, UserNotifications.notification_type == 'friend_request', UserNotifications.isRead == 0),
+        "group messages after an id": select(Message.id).where(Message.group_id == 1, Message.id > 0).order_by(Message.id),
+        "groups of a member": select(GroupMember.group_id).where(GroupMember.member_id == 1),
+        "challenges of a participant": select(ChallengeParticipant.challenge_id).where(ChallengeParticipant.user_id == 1),
+        "reviews of a recipe": select(Review.id).where(Review.recipe_id == 1),
+        "shopping list item by ingredient": select(ShoppingListItem.id).where(
+            ShoppingListItem.shopping_list_id == 1, ShoppingListItem.ingredient_id == 1),
+        "recipes in a list": select(RecipeRecipeList.recipe_id).where(RecipeRecipeList.recipe_list_id == 1),
+        "user by username": select(User.id).where(User.username == 'ADMIN'),
+        "user by email": select(User.id).where(User.email_address == 'admin@gmail.com'),
+        "ingredient by name": select(Ingredient.id).where(Ingredient.ingredient_name == 'Salt'),
+        "challenges still running": select(Challenge.id).where(Challenge.end_time > datetime.now()),
+    }
+
+def explain(connection, query) -> list[str]:
+    compiled = query.compile(dialect=connection.dialect)
+    if connection.dialect.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    name = connection.dialect.name
+    if name == 'sqlite':
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)
+        return [row[-1] for row in rows]
+    if name in ('mysql', 'mariadb'):
+        rows = connection.exec_driver_sql(f"EXPLAIN {compiled}", params).mappings()
+        return [f"{row['table']}: type={row['type']} key={row['key']}" for row in rows]
+    return [row[0] for row in connection.exec_driver_sql(f"EXPLAIN {compiled}", params)]
+
+def uses_index(plan: list[str]) -> bool:
+    for line in plan:
+        # full table or index scans: sqlite "SCAN <table>", mysql type ALL/index, postgres "Seq Scan"
+        if line.startswith('SCAN ') or 'type=ALL' in line or 'type=index ' in line or 'Seq Scan' in line:
+            return False
+    return True
+
+def check_plans() -> list[tuple[str, bool, str]]:
+    """(query, uses an index, plan) for each hot query"""
+    results = []
+    with db.engine.connect() as connection:
+        for name, query in hot_queries().items():
+            plan = explain(connection, query)
+            results.append((name, uses_index(plan), '; '.join(plan)))
+    return results
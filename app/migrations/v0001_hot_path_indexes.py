@@ -0,0 +1,43 @@
+from __future__ import annotations
+from sqlalchemy import Index, func, select
+from app.models import (Challenge, ChallengeParticipant, GroupMember, Ingredient, Message, RecipeRecipeList, Review,
+                        ShoppingListItem, User, UserNotifications)
+
+VERSION = '0001'
+DESCRIPTION = 'Indexes and unique constraints for the hot filters'
+
+# (model, index name) as declared in the models' __table_args__
+INDEXES = [
+    (UserNotifications, 'ix_UserNotifications_user_type_read'),
+    (Message, 'ix_Message_group_id_id'),
+    (GroupMember, 'ix_GroupMember_member_id'),
+    (ChallengeParticipant, 'ix_ChallengeParticipant_user_id'),
+    (Review, 'ix_Review_recipe_id'),
+    (ShoppingListItem, 'ix_ShoppingListItem_list_ingredient'),
+    (RecipeRecipeList, 'ix_RecipeRecipeList_recipe_list_id'),
+    (Challenge, 'ix_Challenge_end_time'),
+    (User, 'uq_User_username'),
+    (User, 'uq_User_email_address'),
+    (Ingredient, 'uq_Ingredient_ingredient_name'),
+]
+
+def index(model, name: str) -> Index:
+    return next(index for index in model.__table__.indexes if index.name == name)
+
+def duplicates(connection, column) -> list:
+    """Values of `column` held by more than one row, which would make a unique index fail"""
+    query = select(column).group_by(column).having(func.count() > 1).limit(10)
+    return [value for (value,) in connection.execute(query)]
+
+def upgrade(connection) -> None:
+    for model, name in INDEXES:
+        ix = index(model, name)
+        if ix.unique:
+            found = duplicates(connection, *ix.columns)
+            if found:
+                raise RuntimeError(f"Can't create {name}: duplicate values {found}; merge or rename these rows and run the migration again")
+        ix.create(connection, checkfirst=True)
+
+def downgrade(connection) -> None:
+    for model, name in reversed(INDEXES):
+        index(model, name).drop(connection, checkfirst=True)
@@ -0,0 +1,70 @@
+from __future__ import annotations
+from flask import current_app
+from sqlalchemy import select, update
+from app.blobstore import REFERENCES, SHARED_FILES, blob_digest, recount
+from app.images import FORMATS, UPLOADS_PREFIX, VARIANTS, sniff, variant_path
+from app.models import UploadBlob
+import hashlib
+import os
+import shutil
+
+VERSION = '0002'
+DESCRIPTION = 'Content-addressed uploads: UploadBlob table, existing uploads renamed to their SHA-256'
+
+# Uploads from before the blob store (uuid_name.jpg, or a bare file name for
+# recipe lists) are copied to <digest>.<ext> and their rows repointed, so
+# duplicate copies collapse into one blob. The old files are left in place for
+# `flask gc-uploads --legacy` to remove once nothing refers to them; a
+# migration that fails halfway loses nothing and can simply run again.
+# Downgrading only drops the table: the rows keep pointing at the renamed
+# files, which stay valid.
+
+def blob_filename(folder: str, filename: str) -> str | None:
+    """The content-addressed name of a legacy upload, copied there with its variants; None if it can't be read"""
+    path = os.path.join(folder, filename)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as fin:
+        kind = sniff(fin.read(12))
+        fin.seek(0)
+        digest = hashlib.file_digest(fin, 'sha256').hexdigest()
+    if kind is None:
+        return None
+    blob = f"{digest}.{FORMATS[kind][1]}"
+    copies = [(path, os.path.join(folder, blob))]
+    for name in VARIANTS:
+        for variant_format in ('webp', 'jpeg'):
+            copies.append((variant_path(path, name, variant_format), variant_path(copies[0][1], name, variant_format)))
+    for source, target in copies:
+        if os.path.exists(source) and not os.path.exists(target):
+            shutil.copyfile(source, f"{target}.part")
+            os.replace(f"{target}.part", target)
+    return blob
+
+def image_paths(connection, model, column: str):
+    attribute = getattr(model, column)
+    return connection.execute(select(model.id, attribute).where(attribute.like(f"{UPLOADS_PREFIX}%"))).all()
+
+def upgrade(connection) -> None:
+    UploadBlob.__table__.create(connection, checkfirst=True)  # type: ignore
+    folder = current_app.config['UPLOAD_FOLDER']
+
+    # legacy file name -> blob file name, each file hashed once however many rows share it
+    adopted: dict[str, str | None] = {}
+    for model, column in REFERENCES:
+        for row_id, path in image_paths(connection, model, column):
+            filename = os.path.basename(path)
+            if blob_digest(path) is not None or filename in SHARED_FILES:
+                continue
+            if filename not in adopted:
+                adopted[filename] = blob_filename(folder, filename)
+            if adopted[filename] is not None:
+                connection.execute(update(model).where(model.id == row_id).values({column: os.path.join(UPLOADS_PREFIX, adopted[filename])}))
+
+    # reference counts from scratch, which also makes running this again harmless;
+    # blobs no row refers to any more are left for `flask gc-uploads`
+    blobs = recount(connection)
+    print(f"Adopted {sum(blob is not None for blob in adopted.values())} of {len(adopted)} legacy uploads into {blobs} blobs")
+
+def downgrade(connection) -> None:
+    UploadBlob.__table__.drop(connection, checkfirst=True)  # type: ignore
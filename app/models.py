@@ -1,21 +1,38 @@
+from flask import current_app, has_app_context
 from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import relationship
-from .hashing_examples import UpdatedHasher
+from functools import lru_cache
+from app.images import image_urls
+from app.static_assets import asset_url
+from app.image_mirror import recipe_image_urls
 import os
 
 db = SQLAlchemy()
 
-# open and read the contents of the pepper file into your pepper key
 scriptdir = os.path.abspath(os.path.dirname(__file__))
 pepfile = os.path.join(scriptdir, "pepper.bin")
-with open(pepfile, 'rb') as fin:
-    pepper_key = fin.read()
-    # create a new instance of UpdatedHasher using that pepper key
-    pwd_hasher = UpdatedHasher(pepper_key)
+
+@lru_cache(maxsize=None)
+def get_pwd_hasher():
+    """The password hasher, built from the pepper file the first time a password is hashed or checked"""
+    from .hashing_examples import UpdatedHasher, DEFAULT_TIME_COST, DEFAULT_MEMORY_COST, DEFAULT_PARALLELISM
+    config = current_app.config if has_app_context() else {}
+    with open(pepfile, 'rb') as fin:
+        return UpdatedHasher(
+            fin.read(),
+            time_cost=config.get('ARGON2_TIME_COST', DEFAULT_TIME_COST),
+            memory_cost=config.get('ARGON2_MEMORY_COST', DEFAULT_MEMORY_COST),
+            parallelism=config.get('ARGON2_PARALLELISM', DEFAULT_PARALLELISM),
+            workers=config.get('PASSWORD_HASH_WORKERS', 0)
+        )
 
 class User(UserMixin, db.Model):
     __tablename__ = 'User'
+    __table_args__ = (
+        db.Index('uq_User_username', 'username', unique=True),
+        db.Index('uq_User_email_address', 'email_address', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     fname = db.Column(db.String(50))
     lname = db.Column(db.String(50))
@@ -82,10 +99,17 @@ class User(UserMixin, db.Model):
         raise AttributeError("password is a write-only attribute")
     @password.setter
     def password(self, pwd: str) -> None:
-        self.password_hash = pwd_hasher.hash(pwd)
+        self.password_hash = get_pwd_hasher().hash(pwd)
     # add a verify_password convenience method
+    # (nothing calls it yet: login is Microsoft SSO only, so the rehash below only runs once a password login exists)
     def verify_password(self, pwd: str) -> bool:
-        return pwd_hasher.check(pwd, self.password_hash)
+        hasher = get_pwd_hasher()
+        if not hasher.check(pwd, self.password_hash):
+            return False
+        # rehash with the current cost parameters while the password is at hand (saved by the caller's commit)
+        if hasher.needs_update(self.password_hash):
+            self.password_hash = hasher.hash(pwd)
+        return True
     def to_json(self):
         return {
             "id": self.id,
@@ -94,6 +118,7 @@ class User(UserMixin, db.Model):
             "email_address": self.email_address,
             "username": self.username,
             "profile_picture": self.profile_picture,
+            "profile_picture_variants": image_urls(self.profile_picture),
             "xp_points": self.xp_points,
             "user_level": self.user_level,
             "is_admin": self.is_admin,
@@ -214,6 +239,7 @@ class UserGroup(db.Model):
             "name": self.name,
             "creator": self.creator,
             "image": self.image,
+            "image_variants": image_urls(self.image),
             "description": self.description,
             "is_public": self.is_public,
             "num_reports": self.num_reports,
@@ -237,6 +263,7 @@ class GroupReport(db.Model):
 
 class GroupMember(db.Model):
     __tablename__ = 'GroupMember'
+    __table_args__ = (db.Index('ix_GroupMember_member_id', 'member_id'),)
     group_id = db.Column(db.Integer, db.ForeignKey('UserGroup.id'), primary_key=True)
     member_id = db.Column(db.Integer, db.ForeignKey('User.id'), primary_key=True)
     is_trusted = db.Column(db.Boolean, nullable=False)
@@ -272,6 +299,7 @@ class MessageReport(db.Model):
 
 class Message(db.Model):
     __tablename__ = 'Message'
+    __table_args__ = (db.Index('ix_Message_group_id_id', 'group_id', 'id'),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     group_id = db.Column(db.Integer, db.ForeignKey('UserGroup.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('User.id'), nullable=False)
@@ -298,6 +326,7 @@ class Achievement(db.Model):
         return {
             "id": self.id,
             "image": self.image,
+            "image_url": asset_url(self.image) or self.image,
             "title": self.title,
             "isVisible": self.isVisible,
             "description": self.description
@@ -325,15 +354,38 @@ class Recipe(db.Model):
     youtube_url = db.Column(db.Text)
     category = db.Column(db.Text, nullable=False)
     def to_json(self):
+        urls = recipe_image_urls(self.id, self.image)
         return {
             "id": self.id,
             "recipe_name": self.recipe_name,
             "difficulty": self.difficulty,
             "xp_amount": self.xp_amount,
             "rating": self.rating,
-            "image": self.image,
+            # the cached medium copy when the image is mirrored, see app/image_mirror.py
+            "image": urls["medium"] if urls else self.image,
+            "image_variants": urls,
         }
 
+class UserRecipeScore(db.Model):
+    # materialized "featured recipes" score of a recipe for one user, see app/recommendations.py
+    __tablename__ = 'UserRecipeScore'
+    user_id = db.Column(db.Integer, db.ForeignKey('User.id', ondelete="CASCADE"), primary_key=True)
+    recipe_id = db.Column(db.Integer, db.ForeignKey('Recipe.id', ondelete="CASCADE"), primary_key=True)
+    score = db.Column(db.Integer, nullable=False)
+    __table_args__ = (db.Index('ix_UserRecipeScore_user_score', 'user_id', 'score'),)
+    def to_json(self):
+        return {
+            "user_id": self.user_id,
+            "recipe_id": self.recipe_id,
+            "score": self.score,
+        }
+
+class ScoredUser(db.Model):
+    # a user whose UserRecipeScore rows cover the whole catalogue; only these users are rescored incrementally
+    __tablename__ = 'ScoredUser'
+    user_id = db.Column(db.Integer, db.ForeignKey('User.id', ondelete="CASCADE"), primary_key=True)
+    materialized_at = db.Column(db.DateTime, nullable=False)
+
 class RecipeStep(db.Model):
     __tablename__ = 'RecipeStep'
     recipe_id = db.Column(db.Integer, db.ForeignKey('Recipe.id'), primary_key=True)
@@ -370,6 +422,7 @@ class RecipeCuisine(db.Model):
 
 class Review(db.Model):
     __tablename__ = 'Review'
+    __table_args__ = (db.Index('ix_Review_recipe_id', 'recipe_id'),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     recipe_id = db.Column(db.Integer, db.ForeignKey('Recipe.id', ondelete="CASCADE"), nullable=False)
     text = db.Column(db.Text, nullable=False)
@@ -390,6 +443,7 @@ class Review(db.Model):
             "recipe_id": self.recipe_id,
             "text": self.text,
             "image": self.image,
+            "image_variants": image_urls(self.image),
             "rating": self.rating,
             "difficulty": self.difficulty,
             "num_reports": self.num_reports,
@@ -416,6 +470,7 @@ class ReviewReport(db.Model):
 
 class Challenge(db.Model):
     __tablename__ = 'Challenge'
+    __table_args__ = (db.Index('ix_Challenge_end_time', 'end_time'),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.Text, nullable=False)
     creator = db.Column(db.Integer, db.ForeignKey('User.id', ondelete="CASCADE"), nullable=False)
@@ -446,6 +501,7 @@ class Challenge(db.Model):
             "name": self.name,
             "creator": self.creator,
             "image": self.image if self.image else None,
+            "image_variants": image_urls(self.image),
             "difficulty": self.difficulty,
             "theme": self.theme,
             "location": self.location,
@@ -503,6 +559,7 @@ class ChallengeVote(db.Model):
 
 class ChallengeParticipant(db.Model):
     __tablename__ = 'ChallengeParticipant'
+    __table_args__ = (db.Index('ix_ChallengeParticipant_user_id', 'user_id'),)
     challenge_id = db.Column(db.Integer, db.ForeignKey('Challenge.id', ondelete="CASCADE"), primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('User.id'), primary_key=True)
     challenge = relationship("Challenge", back_populates="participants")
@@ -524,6 +581,8 @@ class RecommendedChallengeRecipe(db.Model):
 
 class Ingredient(db.Model):
     __tablename__ = 'Ingredient'
+    # TEXT needs a prefix length to be indexed on MySQL
+    __table_args__ = (db.Index('uq_Ingredient_ingredient_name', 'ingredient_name', unique=True, mysql_length=255),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     ingredient_name = db.Column(db.Text, nullable=False)
     def to_json(self):
@@ -570,6 +629,7 @@ class ShoppingList(db.Model):
 
 class ShoppingListItem(db.Model):
     __tablename__ = 'ShoppingListItem'
+    __table_args__ = (db.Index('ix_ShoppingListItem_list_ingredient', 'shopping_list_id', 'ingredient_id'),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     shopping_list_id = db.Column(db.Integer, db.ForeignKey('ShoppingList.id'), primary_key=False)
     ingredient_id = db.Column(db.Integer, db.ForeignKey('Ingredient.id'), primary_key=False)
@@ -595,10 +655,12 @@ class RecipeList(db.Model):
             "name": self.name,
             "belongs_to": self.belongs_to,
             "image": self.image,
+            "image_variants": image_urls(self.image),
         }
     
 class RecipeRecipeList(db.Model):
     __tablename__ = 'RecipeRecipeList'
+    __table_args__ = (db.Index('ix_RecipeRecipeList_recipe_list_id', 'recipe_list_id'),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     recipe_id = db.Column(db.Integer, db.ForeignKey('Recipe.id'), primary_key=True)
     recipe_list_id = db.Column(db.Integer, db.ForeignKey('RecipeList.id'), primary_key=True)
@@ -610,6 +672,7 @@ class RecipeRecipeList(db.Model):
 
 class UserNotifications(db.Model):
     __tablename__ = 'UserNotifications'
+    __table_args__ = (db.Index('ix_UserNotifications_user_type_read', 'user_id', 'notification_type', 'isRead'),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('User.id'), nullable=False)
     notification_text = db.Column(db.Text, nullable=False)
@@ -650,4 +713,51 @@ class RecipeDietaryRestriction(db.Model):
         return {
             "recipe_id": self.recipe_id,
             "dietary_restrictions": self.dietary_restrictions
-        }
\ No newline at end of file
+        }
+
+class ProcessedEvent(db.Model):
+    # one row per (event, handler) that ran to completion, see app/events.py
+    __tablename__ = 'ProcessedEvent'
+    event_id = db.Column(db.String(32), primary_key=True)
+    handler = db.Column(db.String(100), primary_key=True)
+    processed_at = db.Column(db.DateTime, nullable=False)
+
+class RecipeSource(db.Model):
+    # the upstream meal a catalogue recipe was imported from, see app/catalogue.py
+    __tablename__ = 'RecipeSource'
+    recipe_id = db.Column(db.Integer, db.ForeignKey('Recipe.id'), primary_key=True)
+    source_key = db.Column(db.String(32), nullable=False, unique=True)
+    page = db.Column(db.String(20), nullable=False, index=True)
+    # sha256 of the normalized upstream meal, compared by the incremental sync
+    content_hash = db.Column(db.String(64), nullable=False)
+
+class CatalogueSyncRun(db.Model):
+    # a catalogue sync; one that never finished is resumed, see app/catalogue_sync.py
+    __tablename__ = 'CatalogueSyncRun'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    started_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime)
+
+class CatalogueSyncPage(db.Model):
+    # checkpoint: a page of the upstream feed fully applied by a sync run
+    __tablename__ = 'CatalogueSyncPage'
+    run_id = db.Column(db.Integer, db.ForeignKey('CatalogueSyncRun.id'), primary_key=True)
+    page = db.Column(db.String(20), primary_key=True)
+    synced_at = db.Column(db.DateTime, nullable=False)
+
+class SchemaMigration(db.Model):
+    # a migration from app/migrations that has been applied to this database
+    __tablename__ = 'SchemaMigration'
+    version = db.Column(db.String(20), primary_key=True)
+    description = db.Column(db.String(255), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False)
+
+class UploadBlob(db.Model):
+    # an uploaded file, stored once per distinct content under its SHA-256; see app/blobstore.py
+    __tablename__ = 'UploadBlob'
+    digest = db.Column(db.String(64), primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    # rows whose image column refers to the blob; the file is removed when it drops to 0
+    refcount = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,60 @@
+from __future__ import annotations
+from flask import json
+from sqlalchemy import event, func
+from sqlalchemy.orm import object_session
+from app.models import UserNotifications, db
+from app.pubsub import broker, publish_after_commit
+import time
+
+# Push delivery of UserNotifications. Every committed notification is announced
+# on its user's channel; the stream below re-reads the rows from the database,
+# so resuming from the last seen id works across reconnects and workers.
+
+# seconds between keep-alive comments on an idle stream
+HEARTBEAT_INTERVAL = 15
+# a stream is closed after this many seconds; the client reconnects with Last-Event-ID
+STREAM_LIFETIME = 300
+# milliseconds the client waits before reconnecting
+RETRY_DELAY = 3000
+
+def notification_channel(user_id: int) -> str:
+    return f'user:{user_id}:notifications'
+
+@event.listens_for(UserNotifications, 'after_insert')
+def _notification_created(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        publish_after_commit(session, notification_channel(target.user_id), target.id)
+
+
+def notifications_query(user_id: int, since_id: int | None = None, notification_type: str | None = None):
+    """A user's notifications in id order, only those newer than `since_id` if given"""
+    query = UserNotifications.query.filter(UserNotifications.user_id == user_id)
+    if notification_type is not None:
+        query = query.filter(UserNotifications.notification_type == notification_type)
+    if since_id is not None:
+        query = query.filter(UserNotifications.id > since_id)
+    return query.order_by(UserNotifications.id.asc())
+
+def latest_notification_id(user_id: int) -> int:
+    return db.session.query(func.max(UserNotifications.id)).filter(UserNotifications.user_id == user_id).scalar() or 0
+
+def sse_event(event_id: int, event_name: str, data) -> str:
+    return f"id: {event_id}\nevent: {event_name}\ndata: {json.dumps(data)}\n\n"
+
+def stream_notifications(user_id: int, last_id: int):
+    """Server-sent events for every notification of a user after `last_id`"""
+    yield f"retry: {RETRY_DELAY}\n\n"
+    closes_at = time.monotonic() + STREAM_LIFETIME
+    while True:
+        for notification in notifications_query(user_id, last_id):
+            last_id = notification.id
+            yield sse_event(notification.id, 'notification', notification.to_json())
+        remaining = closes_at - time.monotonic()
+        if remaining <= 0:
+            return
+
+        # don't hold a connection (or a stale snapshot) while idle
+        db.session.rollback()
+        if not broker.wait(notification_channel(user_id), last_id, min(HEARTBEAT_INTERVAL, remaining)):
+            yield ": keep-alive\n\n"
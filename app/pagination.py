@@ -0,0 +1,82 @@
+from __future__ import annotations
+from sqlalchemy import and_, or_
+import base64
+import json
+
+# Keyset ("cursor") pagination: instead of OFFSET, every page after the first
+# seeks past the sort key of the last row the client saw. The key is handed to
+# the client as an opaque cursor string.
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str, types: tuple[type, ...] | None = None) -> list:
+    """The values of a cursor, which must be JSON scalars, of `types` if given"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}")
+    if not isinstance(values, list):
+        raise InvalidCursor("Invalid cursor")
+    if types is None:
+        types = (object,) * len(values)
+    if len(values) != len(types) or not all(is_cursor_value(value, expected) for value, expected in zip(values, types)):
+        raise InvalidCursor("Invalid cursor")
+    return values
+
+def is_cursor_value(value, expected: type) -> bool:
+    if value is None or isinstance(value, (list, dict)):
+        return False
+    if expected is bool:
+        # booleans are sent as 0 and 1, see directory_key()
+        return isinstance(value, int) and value in (0, 1)
+    if isinstance(value, bool):
+        return expected is object
+    if expected is float:
+        return isinstance(value, (int, float))
+    return expected is object or isinstance(value, expected)
+
+def column_type(column) -> type:
+    try:
+        return column.type.python_type
+    except NotImplementedError:
+        return object
+
+def seek_after(keys, values):
+    """Filter for rows that sort after `values` under `keys`, a list of (column, descending) pairs"""
+    clauses = []
+    for i, (column, descending) in enumerate(keys):
+        equal_prefix = [keys[j][0] == values[j] for j in range(i)]
+        step = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*equal_prefix, step))
+    return or_(*clauses)
+
+def keyset_page(query, keys, cursor: str | None, per_page: int, key_of):
+    """Return (items, next_cursor) for the page after `cursor`.
+
+    `keys` lists the (column, descending) sort key, which must end in a unique
+    column; `key_of(item)` returns those values for a loaded item.
+    """
+    if cursor:
+        values = decode_cursor(cursor, tuple(column_type(column) for column, _ in keys))
+        query = query.filter(seek_after(keys, values))
+    query = query.order_by(*[column.desc() if descending else column.asc() for column, descending in keys])
+
+    # fetch one extra row to learn whether there is a next page without a COUNT(*)
+    items = query.limit(per_page + 1).all()
+    if len(items) <= per_page:
+        return items, None
+    items = items[:per_page]
+    return items, encode_cursor(key_of(items[-1]))
+
+def wants_cursor(args) -> bool:
+    # clients opt in to keyset pagination by sending a cursor, empty for the first page
+    return 'cursor' in args
+
+def wants_total(args) -> bool:
+    return args.get('include_total', '').lower() in ('1', 'true', 'yes')
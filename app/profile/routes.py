@@ -4,11 +4,10 @@ from flask_login import current_user, login_required
 from app.profile import bp
 from app.models import *
 from sqlalchemy import or_, and_
-from werkzeug.utils import secure_filename
-import uuid
-import os
 from app.friends.routes import remove_friend, revoke_request, delete_notification
-from app.recipes.routes import completionAchievements
+from app.achievements.engine import PROFILE_PICTURE_CHANGED, evaluate
+from app.blobstore import store_image
+from app.images import InvalidImage, image_urls
 
 @bp.route('/', methods=['GET'])
 def get_curr_user(id=1):
@@ -183,7 +182,7 @@ def get_profile_pic():
     return jsonify({"message": "No profile picture found"}), 200
 
 #File storage:
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS    
@@ -195,28 +194,14 @@ def change_profile_pic():
     if not user:
         return jsonify({"message": "User not found"}), 404
     if profile_picture and allowed_file(profile_picture.filename):
-        completionAchievements(current_user.id, 11)
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        os.makedirs(upload_folder, exist_ok=True)
-
-        if user.profile_picture:
-            old_file_path = os.path.join(current_app.root_path, user.profile_picture)
-            if os.path.exists(old_file_path):
-                try:
-                    os.remove(old_file_path)
-                except OSError as e:
-                    current_app.logger.error(f"Error deleting old profile picture: {e}")
-
-        insecureFilename = profile_picture.filename
-        if not insecureFilename:
-            return jsonify({"message": "Invalid file name"}), 400
-        filename = f"{uuid.uuid4().hex}_{secure_filename(insecureFilename)}"
-        file_path = os.path.join(upload_folder, filename)
-        profile_picture.save(file_path)
-
-        relative_path = os.path.join('static', 'uploads', filename)
+        try:
+            relative_path = store_image(profile_picture)
+        except InvalidImage as e:
+            return jsonify({"message": str(e)}), 400
+        # the old picture is removed once nothing else refers to it
         user.profile_picture = relative_path
         profile_picture_url = relative_path
+        evaluate(user.id, PROFILE_PICTURE_CHANGED)
         db.session.commit()
     else:
         profile_picture_url = None
@@ -224,7 +209,8 @@ def change_profile_pic():
     
     return jsonify({
         "message": "Change successful",
-        "profile_picture_url": profile_picture_url
+        "profile_picture_url": profile_picture_url,
+        "profile_picture_variants": image_urls(profile_picture_url)
     }), 200
 
 @bp.route('/remove_profile_pic/', methods=['POST'])
@@ -233,12 +219,6 @@ def remove_profile_pic():
     if not user:
         return jsonify({"message": "User not found"}), 404
     if user.profile_picture:
-            old_file_path = os.path.join(current_app.root_path, user.profile_picture)
-            if os.path.exists(old_file_path):
-                try:
-                    os.remove(old_file_path)
-                except OSError as e:
-                    current_app.logger.error(f"Error deleting old profile picture: {e}")
             user.profile_picture = None
             db.session.commit()
     return {"message": "Profile picture removed successfully"}, 200
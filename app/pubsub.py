@@ -0,0 +1,63 @@
+from __future__ import annotations
+from collections import deque
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import threading
+import time
+
+# In-process publish/subscribe used to wake up long-poll and streaming requests.
+# Events carry the database id of the row they announce, so a subscriber that
+# missed some (or runs in another worker process) can always catch up from the
+# database; the broker only saves it from polling.
+
+# events published by a session, held until it commits
+PENDING_KEY = 'pubsub_pending'
+
+class Broker:
+    """Channels of (event id, payload) pairs kept in a small ring buffer each"""
+    def __init__(self, buffer_size: int = 256):
+        self.lock = threading.Lock()
+        self.buffer_size = buffer_size
+        self.channels: dict[str, tuple[threading.Condition, deque]] = {}
+
+    def _channel(self, name: str) -> tuple[threading.Condition, deque]:
+        with self.lock:
+            channel = self.channels.get(name)
+            if channel is None:
+                channel = self.channels[name] = (threading.Condition(), deque(maxlen=self.buffer_size))
+            return channel
+
+    def publish(self, name: str, event_id: int, payload=None) -> None:
+        condition, events = self._channel(name)
+        with condition:
+            events.append((event_id, payload))
+            condition.notify_all()
+
+    def wait(self, name: str, after_id: int, timeout: float) -> list[tuple[int, object]]:
+        """Block until the channel has events newer than `after_id` or `timeout` seconds pass"""
+        condition, events = self._channel(name)
+        deadline = time.monotonic() + timeout
+        with condition:
+            while True:
+                newer = [(event_id, payload) for event_id, payload in events if event_id > after_id]
+                remaining = deadline - time.monotonic()
+                if newer or remaining <= 0:
+                    return newer
+                condition.wait(remaining)
+
+
+broker = Broker()
+
+
+def publish_after_commit(session: Session, name: str, event_id: int, payload=None) -> None:
+    """Publish once the session's transaction commits, so subscribers never see rolled back rows"""
+    session.info.setdefault(PENDING_KEY, []).append((name, event_id, payload))
+
+@event.listens_for(Session, 'after_commit')
+def _publish_pending(session):
+    for name, event_id, payload in session.info.pop(PENDING_KEY, []):
+        broker.publish(name, event_id, payload)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(PENDING_KEY, None)
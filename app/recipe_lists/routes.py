@@ -1,12 +1,12 @@
 from __future__ import annotations
-from flask import jsonify, request, current_app
+from flask import jsonify, request
 from flask_login import current_user, login_required
 from app.recipe_lists import bp
 from app.models import Recipe, RecipeList, RecipeRecipeList, db
-from werkzeug.utils import secure_filename
-import os
+from app.blobstore import store_image
+from app.images import InvalidImage
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -59,15 +59,9 @@ def create_list():
         # Handle image upload
         if image and allowed_file(image.filename):
             try:
-                upload_folder = current_app.config['UPLOAD_FOLDER']
-                os.makedirs(upload_folder, exist_ok=True)
-                insecureFilename = image.filename
-                if not insecureFilename:
-                    return jsonify({"message": "Invalid file name"}), 400
-                filename = secure_filename(insecureFilename)
-                file_path = os.path.join(upload_folder, filename)
-                image.save(file_path)
-                recipeList.image = os.path.join('static', 'uploads', filename)
+                recipeList.image = store_image(image)
+            except InvalidImage as e:
+                return jsonify({"message": str(e)}), 400
             except Exception as e:
                 return jsonify({"message": f"File upload failed: {str(e)}"}), 500
         else:
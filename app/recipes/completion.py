@@ -0,0 +1,62 @@
+from __future__ import annotations
+from datetime import datetime
+from app.achievements.engine import apply_level
+from app.events import RecipeCompleted, emit
+from app.models import CookedRecipe, Recipe, RecipeCuisine, User, UserCuisinePreference, db
+
+# What happens when a user cooks a recipe. The core write (XP and level, the
+# per-cuisine counters and the CookedRecipe history) is one transaction; the
+# featured-recipe scores and achievements follow from the RecipeCompleted
+# event once it is committed, and new achievements reach the user as notifications.
+
+def complete_recipe(user: User, recipe: Recipe) -> dict:
+    """Record that `user` cooked `recipe` and return what changed on their profile"""
+    level_before = user.user_level
+
+    # incremented in SQL, so XP granted meanwhile by an event handler isn't overwritten
+    user.num_recipes_completed = User.num_recipes_completed + 1
+    user.xp_points = User.xp_points + recipe.xp_amount
+    db.session.flush()
+    apply_level(user)
+
+    # CookedRecipe keeps the latest completion of each recipe per user
+    cooked = db.session.get(CookedRecipe, (recipe.id, user.id))
+    if cooked is None:
+        db.session.add(CookedRecipe(recipe_id=recipe.id, completed_by=user.id, date_completed=datetime.now()))  # type: ignore
+    else:
+        cooked.date_completed = datetime.now()
+
+    # one more completion for each of the recipe's cuisines
+    cuisine_ids = [cuisine_id for (cuisine_id,) in db.session.query(RecipeCuisine.cuisine_id).filter(RecipeCuisine.recipe_id == recipe.id)]
+    preferences = {
+        preference.cuisine_id: preference
+        for preference in UserCuisinePreference.query.filter(
+            UserCuisinePreference.user_id == user.id,
+            UserCuisinePreference.cuisine_id.in_(cuisine_ids)
+        )
+    } if cuisine_ids else {}
+    for cuisine_id in cuisine_ids:
+        preference = preferences.get(cuisine_id)
+        if preference is None:
+            preference = preferences[cuisine_id] = UserCuisinePreference(user_id=user.id, cuisine_id=cuisine_id, numComplete=0, userSelected=0)  # type: ignore
+            db.session.add(preference)
+        preference.numComplete = preference.numComplete + 1
+
+    emit(RecipeCompleted(
+        user_id=user.id,
+        recipe_id=recipe.id,
+        difficulty=recipe.difficulty,
+        num_recipes_completed=user.num_recipes_completed,
+        cuisine_ids=cuisine_ids
+    ))
+
+    profile_delta = {
+        "xp_gained": recipe.xp_amount,
+        "xp_points": user.xp_points,
+        "user_level": user.user_level,
+        "leveled_up": user.user_level != level_before,
+        "num_recipes_completed": user.num_recipes_completed,
+        "cuisines": [{"cuisine_id": cuisine_id, "numComplete": preferences[cuisine_id].numComplete} for cuisine_id in cuisine_ids],
+    }
+    db.session.commit()
+    return profile_delta
@@ -1,13 +1,17 @@
 from __future__ import annotations
-import math
 from sqlalchemy import case, func, or_, and_
 from flask import request, jsonify, render_template, redirect, url_for, abort, flash, current_app
 from flask_login import current_user, login_required
 from app.recipes import bp
-from app.models import Achievement, UserAchievement, Recipe, RecipeStep, RecipeCuisine, UserCuisinePreference, Review, ReviewReport, Cuisine, RecipeDietaryRestriction, RecipeIngredient, UserNotifications, db
-import os
-import uuid
-from werkzeug.utils import secure_filename
+from app.search import recipe_index
+from app.pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_page, wants_cursor, wants_total
+from app.recommendations import featured_recipes as featured_recipes_for
+from app.achievements.engine import RECIPES_SEARCHED, evaluate
+from app.events import ReviewPosted, emit
+from app.recipes.completion import complete_recipe
+from app.blobstore import store_image
+from app.images import InvalidImage
+from app.models import Recipe, RecipeStep, RecipeCuisine, UserCuisinePreference, Review, ReviewReport, Cuisine, RecipeDietaryRestriction, RecipeIngredient, UserNotifications, db
 from math import ceil
 from sqlalchemy.orm import aliased
 import re
@@ -38,124 +42,81 @@ def post_recipes():
     else:
         print("No dietary restrictions provided")
     
-    if search_query != "":
-        if(search_query == "easter egg"):
-            completionAchievements(current_user.id, 13)
-        name_filter_start = Recipe.recipe_name.ilike(f"{search_query}%")
-        name_filter_contains = Recipe.recipe_name.ilike(f"%{search_query}%")
-        category_filter = Recipe.category.ilike(f"%{search_query}%")
-        cuisine_filter = Cuisine.name.ilike(f"%{search_query}%")
-
-        recipes_query = recipes_query.join(
-            RecipeCuisine, RecipeCuisine.recipe_id == Recipe.id
-        ).join(
-            Cuisine, Cuisine.id == RecipeCuisine.cuisine_id
-        )
+    # cursor mode: seek past the last row of the previous page instead of using OFFSET
+    use_cursor = wants_cursor(request.args)
+    cursor = request.args.get('cursor', '')
+    next_cursor = None
 
-        recipes_query = recipes_query.filter(
-            or_(
-                name_filter_start,
-                name_filter_contains,
-                category_filter,
-                cuisine_filter
-            )
-        )
-
-        recipes_query = recipes_query.order_by(
-            name_filter_start.desc(),
-            name_filter_contains.desc(),
-            category_filter.desc(),
-            cuisine_filter.desc()
-        )
+    if search_query != "":
+        if evaluate(current_user.id, RECIPES_SEARCHED, query=search_query):
+            db.session.commit()
+        # the ranked matches live in memory, so a search cursor is just the position in that ranking
+        start = (page - 1) * per_page
+        if use_cursor:
+            try:
+                start = decode_cursor(cursor, (int,))[0] if cursor else 0
+                if start < 0:
+                    raise InvalidCursor("Invalid cursor")
+            except InvalidCursor:
+                return jsonify({"message": "Invalid cursor"}), 400
+        recipes, total = search_recipes(search_query, recipes_query if dietary_restrictions else None, start, per_page)
+        total_pages = ceil(total / per_page)
+        if use_cursor and start + per_page < total:
+            next_cursor = encode_cursor([start + per_page])
+        featured_recipes = []
     
     else:
         print("No search query provided")
 
-        review_alias = aliased(Review)
-        recipes_query = recipes_query.outerjoin(review_alias, review_alias.recipe_id == Recipe.id)
-
-        user_cuisine_alias = aliased(UserCuisinePreference)
-        recipes_query = recipes_query.join(
-            RecipeCuisine, RecipeCuisine.recipe_id == Recipe.id
-        ).join(
-            user_cuisine_alias, user_cuisine_alias.cuisine_id == RecipeCuisine.cuisine_id
-        )
-
-        user_rating_weight = case(
-        (review_alias.user_id == current_user.id, 
-        case(
-          (review_alias.rating >= 0, -20), 
-          else_=2)
-         ),
-        else_=0
-        )
-
-        recipe_rating_weight = case(
-            (Recipe.rating >= 2.5, 2),
-            else_=0
-        )
-
-        cuisine_preference_weight = case(
-            (user_cuisine_alias.user_id == current_user.id, 5),
-            else_=0
-        )
-
-        completion_weight = case(
-            (user_cuisine_alias.numComplete > 20, 10),  
-            (user_cuisine_alias.numComplete > 5, 5),  
-            (user_cuisine_alias.numComplete > 0, 1),
-        else_=0
-        )
-
-        total_weight = (user_rating_weight + recipe_rating_weight + cuisine_preference_weight + completion_weight)
-
-        featured_recipes_query = recipes_query.add_columns(
-            Recipe.id, 
-            Recipe.recipe_name, 
-            func.sum(func.coalesce(total_weight, 0)).label('total_weight')
-        )
-
-        recipes_query = recipes_query.group_by(Recipe.id)
-        recipes_query = recipes_query.order_by(
-            Recipe.recipe_name.asc()
-        )
-
-    # Now ensure featured_recipes_query is always defined
-    if 'featured_recipes_query' in locals():
-        # Query for featured recipes (top 4)
-        featured_recipes_query = featured_recipes_query.group_by(Recipe.id)
-        featured_recipes_query = featured_recipes_query.order_by(
-            func.sum(total_weight).desc()
-        )
-
-        featured_recipes_query = featured_recipes_query.limit(4)
-        for recipe in featured_recipes_query:
-            print(recipe)
-
-        # Execute the query to fetch featured recipes
-        featured_recipes = [recipe[0].to_json() for recipe in featured_recipes_query.all()]
-    else:
-        featured_recipes = []
-
-    # Paginate the main recipes
-    recipes_paginated = recipes_query.paginate(page=page, per_page=per_page, error_out=False)  # type: ignore
-    total_pages = ceil(recipes_paginated.total / per_page)  # type: ignore
-
-    # Convert the results to JSON using `to_json()`
-    if not search_query:
-        recipes = [recipe.to_json() for recipe in recipes_paginated.items]
-    else:
-        recipes = [recipe.to_json() for recipe in recipes_paginated.items]
+        # Featured recipes (top 4) come from the per-user scores kept up to date by
+        # completions, reviews and cuisine preference changes
+        featured_recipes = [recipe.to_json() for recipe in featured_recipes_for(current_user.id)]
+
+        if use_cursor:
+            try:
+                items, next_cursor = keyset_page(
+                    recipes_query,
+                    [(Recipe.recipe_name, False), (Recipe.id, False)],
+                    cursor, per_page,
+                    lambda recipe: [recipe.recipe_name, recipe.id]
+                )
+            except InvalidCursor:
+                return jsonify({"message": "Invalid cursor"}), 400
+            # counting the whole filtered catalogue is opt-in in cursor mode
+            total_pages = ceil(recipes_query.count() / per_page) if wants_total(request.args) else None
+        else:
+            recipes_paginated = recipes_query.order_by(
+                Recipe.recipe_name.asc(), Recipe.id.asc()
+            ).paginate(page=page, per_page=per_page, error_out=False)  # type: ignore
+            total_pages = ceil(recipes_paginated.total / per_page)  # type: ignore
+            items = recipes_paginated.items
+
+        # Convert the results to JSON using `to_json()`
+        recipes = [recipe.to_json() for recipe in items]
 
     # Return both featured and paginated recipes
     return jsonify({
         'featured_recipes': featured_recipes,
         'recipes': recipes,
         'total_pages': total_pages,
-        'current_page': page
+        'current_page': page,
+        'next_cursor': next_cursor
     }), 200
 
 
+def search_recipes(search_query, restricted_query, start, per_page):
+    # rank every match with the in-memory index, then only load the requested page
+    ranked_ids = recipe_index.search(search_query)
+    if restricted_query is not None and ranked_ids:
+        allowed_ids = {recipe_id for (recipe_id,) in restricted_query.with_entities(Recipe.id).filter(Recipe.id.in_(ranked_ids))}
+        ranked_ids = [recipe_id for recipe_id in ranked_ids if recipe_id in allowed_ids]
+
+    page_ids = ranked_ids[start:start + per_page]
+    recipes_by_id = {recipe.id: recipe for recipe in Recipe.query.filter(Recipe.id.in_(page_ids))} if page_ids else {}
+    recipes = [recipes_by_id[recipe_id].to_json() for recipe_id in page_ids if recipe_id in recipes_by_id]
+    return recipes, len(ranked_ids)
+
+
 @bp.post("/user")
 def getUserId():
     print (current_user.id)
@@ -194,26 +155,12 @@ def post_recipe_ingredients(id):
 def post_completed_recipe_page(id):
     print("searching for recipe" + str(id))
     recipe = Recipe.query.filter_by(id=id).first()
-    current_user.num_recipes_completed = current_user.num_recipes_completed + 1
-    current_user.xp_points = current_user.xp_points + Recipe.query.filter_by(id = id).first().xp_amount # type: ignore
-    db.session.add(current_user)
-    db.session.flush()
-    db.session.commit()
-    if(id == 229):
-        completionAchievements(current_user.id, 5)
-    if(str(Recipe.query.filter_by(id = id).first().difficulty) == "5"): #type:ignore
-        completionAchievements(current_user.id, 12)
-    if(current_user.num_recipes_completed == 1):
-        completionAchievements(current_user.id, 1)
-    elif(current_user.num_recipes_completed >= 50):
-        completionAchievements(current_user.id, 7)
-    elif(current_user.num_recipes_completed >= 10):
-        completionAchievements(current_user.id, 6)
-    checkLevel()
-    completeCuisine(recipe)
-    if recipe is not None:
-        return jsonify(recipe.to_json())
-    return "<h1>404: recipe not found</h1>", 404
+    if recipe is None:
+        return "<h1>404: recipe not found</h1>", 404
+    # serialized before the commit expires it
+    recipe_json = recipe.to_json()
+    recipe_json["profile_delta"] = complete_recipe(current_user._get_current_object(), recipe) # type: ignore
+    return jsonify(recipe_json)
 
 @bp.get("/addrecipe/")
 def addrecipe():
@@ -260,7 +207,7 @@ def delete_recipe():
     flash('recipe deleted successfully')
     return render_template('home.html', current_user=current_user, recipes=Recipe.query.all())
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -275,22 +222,13 @@ def upload_review(id):
 
     print(rating)
 
-    if(str(rating) == "0.5"):
-        completionAchievements(current_user.id, 9)
-    elif(str(rating) == "5"):
-        completionAchievements(current_user.id, 8)
-
     # Handle image upload
     image_path = None
     if image and allowed_file(image.filename):
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        os.makedirs(upload_folder, exist_ok=True)
-        filename = f"{uuid.uuid4().hex}_{secure_filename(image.filename)}" # type: ignore
-        file_path = os.path.join(upload_folder, filename)
-
-        image.save(file_path)
-
-        image_path = os.path.join('static', 'uploads', filename)
+        try:
+            image_path = store_image(image)
+        except InvalidImage as e:
+            return jsonify({"message": str(e)}), 400
 
     if rating or notes or image or difficulty:
         if rating == "":
@@ -303,6 +241,9 @@ def upload_review(id):
             image_path = "NULL"
         review = Review(recipe_id=id,text=notes,image=image_path,rating=rating,difficulty=difficulty, num_reports=0,user_id=current_user.id, username = current_user.username) # type: ignore
         db.session.add(review)
+        db.session.flush()
+        # scores and achievements are updated once the review is committed
+        emit(ReviewPosted(user_id=current_user.id, recipe_id=id, review_id=review.id, rating=request.form.get('rating')))
         db.session.commit()
 
         return jsonify({"message": "Review submitted successfully"}), 200
@@ -409,62 +350,6 @@ def get_reports(id: int):
     return jsonify([report.to_json() for report in reports]), 200
 
 
-def completionAchievements(uid, id):
-        specA = UserAchievement(achievement_id = id, user_id = uid) #type:ignore
-        print(specA)
-        allUserAs = UserAchievement.query.all()
-        run = True
-        for a in allUserAs:
-            if(a.user_id == specA.user_id and a.achievement_id == specA.achievement_id):
-                run =  False
-        if(run):
-            aTitle = Achievement.query.filter_by(id = id).first()
-            db.session.add(specA)
-            db.session.flush()
-            db.session.commit()
-            completedAchievement()
-            notification = UserNotifications(
-                user_id = current_user.id ,#type:ignore
-                notification_text=f"You have earned a new achievement: {aTitle.title}.", #type: ignore
-                notification_type='achievement', #type: ignore
-                achievement_id=specA.achievement_id #type: ignore
-            )
-            db.session.add(notification)
-            db.session.commit()
-
-def checkLevel():
-    startingLevel = current_user.user_level
-    current_user.user_level = math.floor(.1 * math.sqrt(.1 * current_user.xp_points)) + 1 # type: ignore
-    db.session.add(current_user)
-    db.session.commit()
-    if(startingLevel != current_user.user_level):
-        current_user.hasLeveled = 1
-        db.session.add(current_user)
-        db.session.commit()
-
-def completeCuisine(recipe):
-    cid = RecipeCuisine.query.filter_by(recipe_id = recipe.id).first().cuisine_id # type: ignore
-    if(UserCuisinePreference.query.filter_by(user_id = current_user.id, cuisine_id = cid).first() is None):
-        entry = UserCuisinePreference(user_id = current_user.id, cuisine_id = cid, numComplete = 1, userSelected = 0) #type: ignore
-    else:
-        entry = UserCuisinePreference.query.filter_by(user_id = current_user.id, cuisine_id = cid).first()
-        entry.numComplete = entry.numComplete + 1 #type: ignore
-    db.session.add(entry)
-    db.session.commit()
-    count = 0
-    for a in UserCuisinePreference.query.filter_by(user_id = current_user.id).all():
-        if(a.numComplete > 0):
-            count += 1
-    if(count >= 3):
-        completionAchievements(current_user.id, 2)
-    elif(count >= 29):
-        completionAchievements(current_user.id, 10)
-
-def completedAchievement():
-    current_user.xp_points = current_user.xp_points + 100
-    db.session.add(current_user)
-    db.session.commit()
-    checkLevel()
 
 
 
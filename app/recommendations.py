@@ -0,0 +1,178 @@
+from __future__ import annotations
+from collections import defaultdict
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from app.events import RecipeCompleted, ReviewPosted, subscribe
+from app.models import Recipe, RecipeCuisine, Review, ScoredUser, UserCuisinePreference, UserRecipeScore, db
+
+# number of recipes shown in the featured row of the recipe feed
+FEATURED_COUNT = 4
+
+# Score of a recipe for one user:
+#   every review the user wrote for it     -20 if it has a rating, +2 otherwise
+#   recipe rated 2.5 or higher              +2
+#   for each of the recipe's cuisines the user has a preference row for:
+#       +5, plus 10/5/1 once they completed more than 20/5/0 recipes of it
+def review_weight(rating) -> int:
+    if rating is not None and float(rating) >= 0:
+        return -20
+    return 2
+
+def rating_weight(recipe_rating) -> int:
+    return 2 if recipe_rating is not None and recipe_rating >= 2.5 else 0
+
+def completion_weight(num_complete: int) -> int:
+    if num_complete > 20:
+        return 10
+    if num_complete > 5:
+        return 5
+    if num_complete > 0:
+        return 1
+    return 0
+
+def cuisine_weight(num_complete: int) -> int:
+    return 5 + completion_weight(num_complete)
+
+
+def recipes_in_cuisines(cuisine_ids) -> list[int]:
+    if not cuisine_ids:
+        return []
+    rows = db.session.query(RecipeCuisine.recipe_id).filter(RecipeCuisine.cuisine_id.in_(cuisine_ids)).distinct()
+    return [recipe_id for (recipe_id,) in rows]
+
+def compute_user_scores(user_id: int, recipe_ids: list[int] | None = None) -> dict[int, int]:
+    """Score the given recipes (or every recipe) for a user in four small queries"""
+    recipes = db.session.query(Recipe.id, Recipe.rating)
+    recipe_cuisines = db.session.query(RecipeCuisine.recipe_id, RecipeCuisine.cuisine_id)
+    reviews = db.session.query(Review.recipe_id, Review.rating).filter(Review.user_id == user_id)
+    if recipe_ids is not None:
+        recipes = recipes.filter(Recipe.id.in_(recipe_ids))
+        recipe_cuisines = recipe_cuisines.filter(RecipeCuisine.recipe_id.in_(recipe_ids))
+        reviews = reviews.filter(Review.recipe_id.in_(recipe_ids))
+
+    preferences = dict(
+        db.session.query(UserCuisinePreference.cuisine_id, UserCuisinePreference.numComplete)
+        .filter(UserCuisinePreference.user_id == user_id)
+        .all()
+    )
+
+    scores = {recipe_id: rating_weight(rating) for recipe_id, rating in recipes}
+    for recipe_id, cuisine_id in recipe_cuisines:
+        if recipe_id in scores and cuisine_id in preferences:
+            scores[recipe_id] += cuisine_weight(preferences[cuisine_id])
+    for recipe_id, rating in reviews:
+        if recipe_id in scores:
+            scores[recipe_id] += review_weight(rating)
+    return scores
+
+def is_materialized(user_id: int) -> bool:
+    return db.session.get(ScoredUser, user_id) is not None
+
+def refresh_user_scores(user_id: int, recipe_ids: list[int] | None = None) -> None:
+    """Rewrite the materialized scores of a user; the caller commits"""
+    # rescoring some recipes waits until materialize_user_scores has scored them all
+    if recipe_ids is not None and (not recipe_ids or not is_materialized(user_id)):
+        return
+    scores = compute_user_scores(user_id, recipe_ids)
+
+    stale = UserRecipeScore.query.filter(UserRecipeScore.user_id == user_id)
+    if recipe_ids is not None:
+        stale = stale.filter(UserRecipeScore.recipe_id.in_(recipe_ids))
+    stale.delete(synchronize_session=False)
+
+    if scores:
+        db.session.execute(
+            insert(UserRecipeScore),
+            [{"user_id": user_id, "recipe_id": recipe_id, "score": score} for recipe_id, score in scores.items()]
+        )
+
+def refresh_recipe_scores(recipe_ids: list[int]) -> None:
+    """Rewrite the scores of some recipes for every materialized user; the caller commits"""
+    if not recipe_ids:
+        return
+    # rows of users who were never materialized are replaced when they are
+    UserRecipeScore.query.filter(UserRecipeScore.recipe_id.in_(recipe_ids)).delete(synchronize_session=False)
+    scored_users = db.session.query(ScoredUser.user_id)
+    user_ids = [user_id for (user_id,) in scored_users]
+    if not user_ids:
+        return
+
+    base_scores = {recipe_id: rating_weight(rating) for recipe_id, rating in db.session.query(Recipe.id, Recipe.rating).filter(Recipe.id.in_(recipe_ids))}
+    recipe_cuisines = defaultdict(list)
+    for recipe_id, cuisine_id in db.session.query(RecipeCuisine.recipe_id, RecipeCuisine.cuisine_id).filter(RecipeCuisine.recipe_id.in_(recipe_ids)):
+        recipe_cuisines[recipe_id].append(cuisine_id)
+    preferences = defaultdict(dict)
+    for user_id, cuisine_id, num_complete in (
+        db.session.query(UserCuisinePreference.user_id, UserCuisinePreference.cuisine_id, UserCuisinePreference.numComplete)
+        .filter(UserCuisinePreference.user_id.in_(scored_users))
+    ):
+        preferences[user_id][cuisine_id] = num_complete
+    reviews = defaultdict(list)
+    for user_id, recipe_id, rating in (
+        db.session.query(Review.user_id, Review.recipe_id, Review.rating)
+        .filter(Review.recipe_id.in_(recipe_ids), Review.user_id.in_(scored_users))
+    ):
+        reviews[user_id, recipe_id].append(rating)
+
+    rows = []
+    for user_id in user_ids:
+        user_preferences = preferences.get(user_id, {})
+        for recipe_id, score in base_scores.items():
+            score += sum(cuisine_weight(user_preferences[cuisine_id]) for cuisine_id in recipe_cuisines[recipe_id] if cuisine_id in user_preferences)
+            score += sum(review_weight(rating) for rating in reviews.get((user_id, recipe_id), ()))
+            rows.append({"user_id": user_id, "recipe_id": recipe_id, "score": score})
+    if rows:
+        db.session.execute(insert(UserRecipeScore), rows)
+
+# Completions and reviews change a user's scores; rewrite the affected rows once they are committed
+@subscribe(RecipeCompleted)
+def rescore_completed_cuisines(event: RecipeCompleted):
+    refresh_user_scores(event.user_id, recipes_in_cuisines(event.cuisine_ids))
+
+@subscribe(ReviewPosted)
+def rescore_reviewed_recipe(event: ReviewPosted):
+    refresh_user_scores(event.user_id, [event.recipe_id])
+
+def materialize_user_scores(user_id: int) -> None:
+    """Score every recipe for a user and mark them materialized, once, in one transaction"""
+    # the caller's pending changes are flushed outside the savepoint, so a conflict only undoes the marker
+    db.session.flush()
+    try:
+        # the marker goes first: a concurrent first visit conflicts on it (waiting for
+        # the other transaction to commit where the database locks) and reads those scores
+        with db.session.begin_nested():
+            db.session.add(ScoredUser(user_id=user_id, materialized_at=datetime.now()))  # type: ignore
+    except IntegrityError:
+        return
+    refresh_user_scores(user_id)
+    db.session.commit()
+
+def featured_recipes(user_id: int, count: int = FEATURED_COUNT) -> list[Recipe]:
+    """Top recipes for a user, scored by the backend chosen with RECOMMENDER_BACKEND"""
+    if current_app.config.get('RECOMMENDER_BACKEND') == 'numpy':
+        return featured_recipes_vectorized(user_id, count)
+    return featured_recipes_from_table(user_id, count)
+
+def featured_recipes_vectorized(user_id: int, count: int = FEATURED_COUNT) -> list[Recipe]:
+    # imported here so NumPy is only needed when the vectorized backend is enabled
+    from app.vector_scoring import vector_scorer
+    recipe_ids = vector_scorer.top_k(user_id, count)
+    recipes_by_id = {recipe.id: recipe for recipe in Recipe.query.filter(Recipe.id.in_(recipe_ids))} if recipe_ids else {}
+    return [recipes_by_id[recipe_id] for recipe_id in recipe_ids if recipe_id in recipes_by_id]
+
+def featured_recipes_from_table(user_id: int, count: int = FEATURED_COUNT) -> list[Recipe]:
+    """Top recipes for a user, read straight from the materialized scores"""
+    top = Recipe.query.join(
+        UserRecipeScore, UserRecipeScore.recipe_id == Recipe.id
+    ).filter(
+        UserRecipeScore.user_id == user_id
+    ).order_by(
+        UserRecipeScore.score.desc(), Recipe.id.asc()
+    ).limit(count)
+
+    if not is_materialized(user_id):
+        # first visit: materialize this user's scores once
+        materialize_user_scores(user_id)
+    return top.all()
@@ -0,0 +1,192 @@
+from __future__ import annotations
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from app.models import Recipe, RecipeCuisine, Cuisine, db
+import threading
+
+# Search matches what the SQL it replaced matched: the query as a
+# case-insensitive substring (LIKE '%query%') of the recipe's name, category or
+# one of its cuisines. Each field has a trigram index that narrows the recipes
+# down to those containing every trigram of the query; the candidates are then
+# checked for the actual substring.
+
+# Ranking tiers, in the order post_recipes has always sorted its matches:
+# name starts with the query, then name contains it, then category, then cuisine
+NAME_STARTS_WITH = 0
+NAME_CONTAINS = 1
+CATEGORY_MATCH = 2
+CUISINE_MATCH = 3
+
+NGRAM = 3
+# joins the names of a recipe's cuisines, so a match can't span two of them
+SEPARATOR = '\x00'
+
+# key used to collect changed recipe ids on a session until it commits
+PENDING_KEY = 'recipe_search_pending'
+
+def normalize(text: str | None) -> str:
+    return (text or '').lower()
+
+def ngrams(text: str) -> set[str]:
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+class FieldIndex:
+    """Trigram index over one field: trigram -> recipe ids, plus each recipe's text to confirm matches"""
+    def __init__(self):
+        self.texts: dict[int, str] = {}
+        self.postings: dict[str, set[int]] = {}
+
+    def add(self, recipe_id: int, text: str) -> None:
+        self.texts[recipe_id] = text
+        for gram in ngrams(text):
+            self.postings.setdefault(gram, set()).add(recipe_id)
+
+    def remove(self, recipe_id: int) -> None:
+        text = self.texts.pop(recipe_id, None)
+        if text is None:
+            return
+        for gram in ngrams(text):
+            ids = self.postings.get(gram)
+            if ids is None:
+                continue
+            ids.discard(recipe_id)
+            if not ids:
+                del self.postings[gram]
+
+    def containing(self, needle: str) -> set[int]:
+        """Ids of the recipes whose text contains `needle`"""
+        grams = ngrams(needle)
+        if grams:
+            postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+        else:
+            # shorter than a trigram: every text is a candidate
+            candidates = self.texts.keys()
+        return {recipe_id for recipe_id in candidates if needle in self.texts[recipe_id]}
+
+
+class RecipeSearchIndex:
+    """In-memory search index over recipe names, categories and cuisines.
+
+    The index is built from the database on first use. Recipes changed by a
+    committed session are marked stale and re-read lazily on the next search.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.stale: set[int] = set()
+        self.documents: dict[int, dict] = {}
+        self.names = FieldIndex()
+        self.categories = FieldIndex()
+        self.cuisines = FieldIndex()
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.loaded = False
+            self.stale.clear()
+
+    def mark_stale(self, recipe_ids) -> None:
+        with self.lock:
+            self.stale.update(recipe_ids)
+
+    def search(self, query: str) -> list[int]:
+        """Return the ids of every matching recipe, best match first"""
+        needle = normalize(query.strip())
+        if not needle:
+            return []
+        with self.lock:
+            self._ensure_fresh()
+            tiers: dict[int, int] = {}
+            for recipe_id in self.cuisines.containing(needle):
+                tiers[recipe_id] = CUISINE_MATCH
+            for recipe_id in self.categories.containing(needle):
+                tiers[recipe_id] = CATEGORY_MATCH
+            for recipe_id in self.names.containing(needle):
+                if self.documents[recipe_id]['name'].startswith(needle):
+                    tiers[recipe_id] = NAME_STARTS_WITH
+                else:
+                    tiers[recipe_id] = NAME_CONTAINS
+            return sorted(tiers, key=lambda rid: (tiers[rid], self.documents[rid]['name'], rid))
+
+    def _ensure_fresh(self) -> None:
+        if not self.loaded:
+            self.documents.clear()
+            self.names, self.categories, self.cuisines = FieldIndex(), FieldIndex(), FieldIndex()
+            self.stale.clear()
+            self._load(None)
+            self.loaded = True
+        elif self.stale:
+            recipe_ids = list(self.stale)
+            self.stale.clear()
+            for recipe_id in recipe_ids:
+                self._remove(recipe_id)
+            self._load(recipe_ids)
+
+    def _load(self, recipe_ids: list[int] | None) -> None:
+        rows = db.session.query(
+            Recipe.id, Recipe.recipe_name, Recipe.category, Cuisine.name
+        ).outerjoin(
+            RecipeCuisine, RecipeCuisine.recipe_id == Recipe.id
+        ).outerjoin(
+            Cuisine, Cuisine.id == RecipeCuisine.cuisine_id
+        )
+        if recipe_ids is not None:
+            rows = rows.filter(Recipe.id.in_(recipe_ids))
+
+        documents: dict[int, dict] = {}
+        for recipe_id, recipe_name, category, cuisine_name in rows.all():
+            document = documents.get(recipe_id)
+            if document is None:
+                document = documents[recipe_id] = {'name': normalize(recipe_name), 'category': normalize(category), 'cuisines': []}
+            if cuisine_name:
+                document['cuisines'].append(normalize(cuisine_name))
+
+        for recipe_id, document in documents.items():
+            self.documents[recipe_id] = document
+            self.names.add(recipe_id, document['name'])
+            self.categories.add(recipe_id, document['category'])
+            self.cuisines.add(recipe_id, SEPARATOR.join(document['cuisines']))
+
+    def _remove(self, recipe_id: int) -> None:
+        if self.documents.pop(recipe_id, None) is None:
+            return
+        self.names.remove(recipe_id)
+        self.categories.remove(recipe_id)
+        self.cuisines.remove(recipe_id)
+
+
+recipe_index = RecipeSearchIndex()
+
+
+# Keep the index in sync: remember which recipes a flush touched and hand them
+# to the index once the transaction actually commits
+def _mark_pending(target, recipe_id) -> None:
+    session = object_session(target)
+    if session is not None and recipe_id is not None:
+        session.info.setdefault(PENDING_KEY, set()).add(recipe_id)
+
+@event.listens_for(Recipe, 'after_insert')
+@event.listens_for(Recipe, 'after_update')
+@event.listens_for(Recipe, 'after_delete')
+def _recipe_changed(mapper, connection, target):
+    _mark_pending(target, target.id)
+
+@event.listens_for(RecipeCuisine, 'after_insert')
+@event.listens_for(RecipeCuisine, 'after_delete')
+def _recipe_cuisine_changed(mapper, connection, target):
+    _mark_pending(target, target.recipe_id)
+
+@event.listens_for(Cuisine, 'after_update')
+def _cuisine_renamed(mapper, connection, target):
+    recipe_index.invalidate()
+
+@event.listens_for(Session, 'after_commit')
+def _apply_pending(session):
+    recipe_ids = session.info.pop(PENDING_KEY, None)
+    if recipe_ids:
+        recipe_index.mark_stale(recipe_ids)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(PENDING_KEY, None)
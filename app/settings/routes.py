@@ -1,7 +1,9 @@
 from __future__ import annotations
-from flask import jsonify, request
+from flask import Response, jsonify, request, stream_with_context
 from app.settings import bp
 from app.models import *
+from app.notifications import latest_notification_id, notifications_query, stream_notifications
+from app.recommendations import refresh_user_scores, recipes_in_cuisines
 from flask_login import current_user, login_required
 
 
@@ -23,7 +25,7 @@ def post_update_username():
 
     print("Received data - Username: " + username) 
 
-    if username in [user.username for user in User.query.all()]:
+    if User.query.filter_by(username=username).first():
         return jsonify({"message": "Username already taken", "alreadyTaken": True, "username": username}), 200
     
     if username.strip() == "":
@@ -97,12 +99,15 @@ def update_user_cuisines():
     user_id = data['user_id']
     selected_cuisines = data['selected_cuisines']
 
+    # cuisines whose preference row appears or disappears change the featured recipe scores
+    changed_cuisines = []
     for cuisine in selected_cuisines:
         entry = UserCuisinePreference.query.filter_by(user_id=current_user.id, cuisine_id=cuisine).first()
 
         if entry is None:
             e = UserCuisinePreference(user_id=current_user.id, cuisine_id=cuisine, numComplete=0, userSelected=1) #type:ignore
             db.session.add(e)
+            changed_cuisines.append(cuisine)
         else:
             entry.userSelected = 1
             db.session.add(entry)
@@ -112,8 +117,11 @@ def update_user_cuisines():
             preference.userSelected = 0
             if preference.numComplete == 0:
                 db.session.delete(preference)
+                changed_cuisines.append(preference.cuisine_id)
             else:
                 db.session.add(preference)
+    db.session.flush()
+    refresh_user_scores(current_user.id, recipes_in_cuisines(changed_cuisines))
     db.session.commit()
 
     
@@ -160,11 +168,28 @@ def update_dietary_restrictions():
 @bp.route('/get_notifications/', methods=['POST'])
 def get_notifications():
     user = current_user
-    notifications = UserNotifications.query.filter_by(user_id=user.id).all()
+    # since_id: only the notifications created after the newest one the client already has
+    notifications = notifications_query(user.id, request.args.get('since_id', type=int)).all()
     return jsonify({
         "notifications": [notification.to_json() for notification in notifications]
     }), 200
 
+@bp.route('/notifications/stream/', methods=['GET'])
+@login_required
+def stream_user_notifications():
+    # EventSource sends Last-Event-ID when it reconnects; last_event_id lets a fresh page resume too
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('last_event_id', type=int)
+    if last_id is None:
+        # a first connect only gets what's new: the history is what get_notifications is for
+        last_id = latest_notification_id(current_user.id)
+
+    response = Response(stream_with_context(stream_notifications(current_user.id, last_id)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @bp.route('/read_notification/', methods=['POST'])
 def read_notification():
     data = request.get_json()
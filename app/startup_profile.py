@@ -0,0 +1,74 @@
+from __future__ import annotations
+import os
+import subprocess
+import sys
+
+# Where a worker's boot time goes, measured in a fresh interpreter:
+#
+#   python -m app.startup_profile [--top N]
+#
+# prints how long `import app` and `create_app()` take, the cost of every
+# module of this app, and the slowest third-party packages they pull in.
+# Nothing here connects to the database or the network, and neither should startup.
+
+# run in the child interpreter; imports are timed by -X importtime on stderr
+CHILD = """
+import time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app()
+created = time.perf_counter()
+print(f"{imported - started} {created - imported}")
+"""
+
+def parse_importtime(stderr: str) -> list[tuple[str, int, int]]:
+    """(module, self us, cumulative us) for each line of -X importtime output"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+def profile_startup() -> tuple[float, float, list[tuple[str, int, int]]]:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    # config needs some database URI; it is never connected to
+    env.setdefault('DATABASE_URL', 'sqlite://')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD],
+                            cwd=root, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Startup failed:\n{result.stderr[-2000:]}")
+    import_seconds, create_seconds = map(float, result.stdout.split()[-2:])
+    return import_seconds, create_seconds, parse_importtime(result.stderr)
+
+def report(top: int = 15) -> None:
+    import_seconds, create_seconds, imports = profile_startup()
+    print(f"import app    {import_seconds * 1000:8.1f} ms")
+    print(f"create_app()  {create_seconds * 1000:8.1f} ms")
+
+    # a module can be listed more than once when imports are circular; keep its first, full import
+    modules: dict[str, tuple[int, int]] = {}
+    for name, self_us, cumulative_us in imports:
+        if (name == 'app' or name.startswith('app.')) and cumulative_us > modules.get(name, (0, 0))[1]:
+            modules[name] = (self_us, cumulative_us)
+    print("\nApp modules (self / cumulative ms)")
+    for name, (self_us, cumulative_us) in sorted(modules.items(), key=lambda m: -m[1][1]):
+        print(f"  {self_us / 1000:7.1f} {cumulative_us / 1000:8.1f}  {name}")
+
+    # the outermost import of each third-party package, i.e. its full cost
+    packages: dict[str, int] = {}
+    for name, _, cumulative_us in imports:
+        package = name.split('.')[0]
+        if package != 'app' and package not in sys.stdlib_module_names:
+            packages[package] = max(packages.get(package, 0), cumulative_us)
+    print(f"\nSlowest third-party packages (cumulative ms, top {top})")
+    for package, cumulative_us in sorted(packages.items(), key=lambda p: -p[1])[:top]:
+        print(f"  {cumulative_us / 1000:8.1f}  {package}")
+
+
+if __name__ == '__main__':
+    top = int(sys.argv[sys.argv.index('--top') + 1]) if '--top' in sys.argv else 15
+    report(top)
@@ -0,0 +1,153 @@
+from __future__ import annotations
+from collections import OrderedDict
+from urllib.parse import quote
+from flask import Flask, current_app, redirect, request, url_for
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+
+# Long-cached delivery of uploads and logos. URLs carry a fingerprint of the
+# file's content,
+#
+#   assets/<fingerprint>/uploads/<filename>
+#   assets/<fingerprint>/logos/<filename>
+#
+# so responses are cached for a year as immutable and a changed file simply
+# gets a new URL; a request with an outdated fingerprint is redirected to the
+# current one. Fingerprints are SHA-256 prefixes of the content, remembered
+# per (path, mtime, size). Blob store uploads (and their variants) already
+# carry the SHA-256 of their content in their name, so theirs is taken from
+# the name, mtime and size without reading the file. A remembered fingerprint is handed out for
+# RECHECK_INTERVAL seconds before the file is stat()ed again, so rendering a
+# list of rows with images doesn't touch the disk for every row.
+# The old /static/ URLs keep working as before.
+#
+# STATIC_DELIVERY picks who sends the bytes:
+#   'app'         Flask, with a strong ETag, If-None-Match and Range support; the
+#                 body goes through the WSGI server's file_wrapper (sendfile in gunicorn)
+#   'x-accel'     nginx, via X-Accel-Redirect to STATIC_ACCEL_PREFIX/<folder>/<filename>;
+#                 needs `location /protected-static/ { internal; alias /path/to/app/static/; }`
+#   'x-sendfile'  Apache mod_xsendfile or lighttpd, via X-Sendfile with the absolute path
+
+ONE_YEAR = 365 * 24 * 3600
+FINGERPRINT_LENGTH = 16
+CACHE_SIZE = 4096
+RECHECK_INTERVAL = 5
+# <sha256>.<ext> and <sha256>.<variant>.<ext>, see app/blobstore.py
+CONTENT_ADDRESSED = re.compile(r'^[0-9a-f]{64}\.')
+
+
+def asset_folders(app: Flask) -> dict[str, str]:
+    return {
+        'uploads': app.config['UPLOAD_FOLDER'],
+        'logos': os.path.join(app.static_folder or '', 'logos'),
+    }
+
+
+class Fingerprints:
+    def __init__(self, max_size: int = CACHE_SIZE):
+        self.lock = threading.Lock()
+        self.max_size = max_size
+        # path -> (checked_at, mtime_ns, size, fingerprint), least recently used first;
+        # a file found missing is remembered with a None fingerprint
+        self.entries: OrderedDict[str, tuple[float, int, int, str | None]] = OrderedDict()
+
+    def get(self, path: str, recheck: bool = False) -> str | None:
+        """The fingerprint of the file at `path`, None if there is no such file;
+        with `recheck` the file is stat()ed even if it was a moment ago"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and not recheck and now - entry[0] < RECHECK_INTERVAL:
+                self.entries.move_to_end(path)
+                return entry[3]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            fingerprint, mtime_ns, size = None, 0, 0
+        else:
+            mtime_ns, size = stat.st_mtime_ns, stat.st_size
+            if entry is not None and entry[3] is not None and entry[1:3] == (mtime_ns, size):
+                fingerprint = entry[3]
+            elif CONTENT_ADDRESSED.match(os.path.basename(path)):
+                # mtime and size too, in case the file is rewritten in place (`flask backfill-images --originals`)
+                fingerprint = hashlib.sha256(f"{os.path.basename(path)}:{mtime_ns}:{size}".encode()).hexdigest()[:FINGERPRINT_LENGTH]
+            else:
+                with open(path, 'rb') as fin:
+                    fingerprint = hashlib.file_digest(fin, 'sha256').hexdigest()[:FINGERPRINT_LENGTH]
+        with self.lock:
+            self.entries[path] = (now, mtime_ns, size, fingerprint)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return fingerprint
+
+
+class StaticAssets:
+    def __init__(self):
+        self.fingerprints = Fingerprints()
+
+    def init_app(self, app: Flask) -> None:
+        app.add_url_rule('/assets/<fingerprint>/<folder>/<path:filename>', 'assets', self.serve)
+
+    def url(self, path: str | None) -> str | None:
+        """The fingerprinted URL of a 'static/uploads/...' or 'static/logos/...' path, None if the file doesn't exist"""
+        if not path:
+            return None
+        parts = path.replace(os.sep, '/').lstrip('/').split('/', 2)
+        if len(parts) != 3 or parts[0] != 'static':
+            return None
+        _, folder, filename = parts
+        directory = asset_folders(current_app).get(folder)
+        file_path = safe_join(directory, filename) if directory else None
+        fingerprint = self.fingerprints.get(file_path) if file_path else None
+        if fingerprint is None:
+            return None
+        return f"assets/{fingerprint}/{folder}/{filename}"
+
+    def serve(self, fingerprint: str, folder: str, filename: str):
+        directory = asset_folders(current_app).get(folder)
+        path = safe_join(directory, filename) if directory else None
+        # a file collected a moment ago is a 404, not a failed send
+        current = self.fingerprints.get(path, recheck=True) if path else None
+        if current is None:
+            return {"message": "Not found"}, 404
+        if fingerprint != current:
+            # the file changed since this URL was handed out
+            response = redirect(url_for('assets', fingerprint=current, folder=folder, filename=filename))
+            response.cache_control.no_cache = True
+            return response
+
+        return self.deliver(path, folder, filename, current)
+
+    def deliver(self, path: str, folder: str, filename: str, etag: str):
+        """An immutable, year-long cached response for the file at `path`, app/static/<folder>/<filename>"""
+        delivery = current_app.config.get('STATIC_DELIVERY', 'app')
+        if delivery == 'x-accel':
+            response = self.accel_redirect(folder, filename, etag)
+        else:
+            response = send_file(path, request.environ, etag=etag, max_age=ONE_YEAR, conditional=True,
+                                 use_x_sendfile=delivery == 'x-sendfile', response_class=current_app.response_class)
+        response.cache_control.public = True
+        response.cache_control.max_age = ONE_YEAR
+        response.cache_control.immutable = True
+        return response
+
+    def accel_redirect(self, folder: str, filename: str, fingerprint: str):
+        """An empty response telling nginx to send the file from its internal location"""
+        prefix = current_app.config.get('STATIC_ACCEL_PREFIX', '/protected-static').rstrip('/')
+        response = current_app.response_class(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.set_etag(fingerprint)
+        response = response.make_conditional(request)
+        if response.status_code != 304:
+            response.headers['X-Accel-Redirect'] = f"{prefix}/{folder}/{quote(filename)}"
+        return response
+
+
+assets = StaticAssets()
+asset_url = assets.url
@@ -0,0 +1,76 @@
+from __future__ import annotations
+from flask import Flask, Request, current_app, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+from app.images import SNIFF_BYTES, sniff
+import hashlib
+import os
+import tempfile
+
+# Multipart file parts are streamed straight to a temporary file in the
+# uploads folder instead of Werkzeug's spooled temporary file. While they arrive
+# they are hashed (the blob store's digest, so the file isn't read again) and
+# checked: a part whose first bytes aren't a JPEG, PNG or WebP is refused with
+# 415, and one growing past UPLOAD_MAX_FILE_SIZE with 413, without reading the
+# rest of the body. Every file field in this app is an image.
+#
+# The temporary file is deleted when the request closes; what is kept is
+# re-encoded by app/images.py and published with an atomic rename. Being on
+# the same filesystem as the uploads, nothing is copied across devices.
+
+class UploadStream:
+    """A file part written to disk as it arrives, hashed and type-checked on the way"""
+    def __init__(self, folder: str, max_size: int | None):
+        os.makedirs(folder, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=folder, prefix='.upload-', suffix='.part')
+        self.max_size = max_size
+        self.size = 0
+        self.head = b''
+        self.kind: str | None = None
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            raise RequestEntityTooLarge(f"Files may be at most {self.max_size / 2**20:g} MB")
+        if len(self.head) < SNIFF_BYTES:
+            self.head += data[:SNIFF_BYTES - len(self.head)]
+            if len(self.head) == SNIFF_BYTES:
+                self.kind = sniff(self.head)
+                if self.kind is None:
+                    raise UnsupportedMediaType("Upload a JPEG, PNG or WebP image")
+        self.sha256.update(data)
+        return self.file.write(data)
+
+    def hexdigest(self) -> str:
+        return self.sha256.hexdigest()
+
+    def __iter__(self):
+        return iter(self.file)
+
+    def __getattr__(self, name):
+        # read, seek, tell, close, ... of the temporary file
+        return getattr(self.file, name)
+
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        config = current_app.config
+        if content_length and config.get('UPLOAD_MAX_FILE_SIZE') and content_length > config['UPLOAD_MAX_FILE_SIZE']:
+            raise RequestEntityTooLarge()
+        return UploadStream(config['UPLOAD_FOLDER'], config.get('UPLOAD_MAX_FILE_SIZE'))  # type: ignore
+
+
+def init_app(app: Flask) -> None:
+    app.request_class = UploadRequest
+    # refused uploads answer in JSON like the rest of the API
+    for error in (RequestEntityTooLarge, UnsupportedMediaType):
+        app.register_error_handler(error, lambda e: (jsonify({"message": e.description}), e.code))
+
+def upload_digest(file) -> str:
+    """SHA-256 of an uploaded file, taken while it streamed in where possible"""
+    stream = file.stream
+    if isinstance(stream, UploadStream):
+        return stream.hexdigest()
+    digest = hashlib.file_digest(stream, 'sha256').hexdigest()
+    stream.seek(0)
+    return digest
@@ -0,0 +1,111 @@
+from __future__ import annotations
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from app.models import Recipe, RecipeCuisine, Review, UserCuisinePreference, db
+from app.recommendations import review_weight
+import numpy as np
+import threading
+
+# set on a session when a flush changed the recipe catalogue, cleared on commit/rollback
+CHANGED_KEY = 'vector_scoring_changed'
+
+class Catalogue:
+    """Recipe x cuisine incidence matrix plus the per-recipe rating weight, rows ordered by recipe id"""
+    def __init__(self, recipe_rows, recipe_cuisine_rows):
+        self.recipe_ids = np.array([recipe_id for recipe_id, _ in recipe_rows], dtype=np.int64)
+        self.row_of = {recipe_id: row for row, recipe_id in enumerate(self.recipe_ids.tolist())}
+        ratings = np.array([rating if rating is not None else 0 for _, rating in recipe_rows], dtype=np.float64)
+        self.rating_weights = np.where(ratings >= 2.5, 2, 0).astype(np.int64)
+
+        cuisine_ids = sorted({cuisine_id for _, cuisine_id in recipe_cuisine_rows})
+        self.column_of = {cuisine_id: column for column, cuisine_id in enumerate(cuisine_ids)}
+        self.matrix = np.zeros((len(self.recipe_ids), len(cuisine_ids)), dtype=np.int64)
+        for recipe_id, cuisine_id in recipe_cuisine_rows:
+            row = self.row_of.get(recipe_id)
+            if row is not None:
+                self.matrix[row, self.column_of[cuisine_id]] = 1
+
+
+class VectorScorer:
+    """Scores every recipe for a user in one batched NumPy operation.
+
+    Produces the same scores and ordering (score desc, recipe id asc) as the
+    UserRecipeScore table maintained by app.recommendations.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.catalogue: Catalogue | None = None
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.catalogue = None
+
+    def get_catalogue(self) -> Catalogue:
+        with self.lock:
+            if self.catalogue is None:
+                recipe_rows = db.session.query(Recipe.id, Recipe.rating).order_by(Recipe.id.asc()).all()
+                recipe_cuisine_rows = db.session.query(RecipeCuisine.recipe_id, RecipeCuisine.cuisine_id).all()
+                self.catalogue = Catalogue(recipe_rows, recipe_cuisine_rows)
+            return self.catalogue
+
+    def scores(self, user_id: int) -> tuple[Catalogue, np.ndarray]:
+        catalogue = self.get_catalogue()
+
+        # per-cuisine weight vector for this user: 5 plus the completion bonus where they have a preference row
+        weights = np.zeros(len(catalogue.column_of), dtype=np.int64)
+        preferences = db.session.query(UserCuisinePreference.cuisine_id, UserCuisinePreference.numComplete) \
+            .filter(UserCuisinePreference.user_id == user_id).all()
+        columns = [catalogue.column_of[cuisine_id] for cuisine_id, _ in preferences if cuisine_id in catalogue.column_of]
+        completed = np.array([num_complete for cuisine_id, num_complete in preferences if cuisine_id in catalogue.column_of], dtype=np.int64)
+        if columns:
+            weights[columns] = 5 + np.select([completed > 20, completed > 5, completed > 0], [10, 5, 1], 0)
+
+        scores = catalogue.rating_weights + catalogue.matrix @ weights
+
+        reviews = db.session.query(Review.recipe_id, Review.rating).filter(Review.user_id == user_id).all()
+        rows = [catalogue.row_of[recipe_id] for recipe_id, _ in reviews if recipe_id in catalogue.row_of]
+        if rows:
+            review_weights = [review_weight(rating) for recipe_id, rating in reviews if recipe_id in catalogue.row_of]
+            np.add.at(scores, rows, review_weights)
+        return catalogue, scores
+
+    def top_k(self, user_id: int, k: int) -> list[int]:
+        catalogue, scores = self.scores(user_id)
+        n = len(scores)
+        if n == 0 or k <= 0:
+            return []
+        # fold the recipe id tie-break into one key: higher score first, then lower row (= lower id)
+        keys = scores * n + (n - 1 - np.arange(n))
+        if k < n:
+            candidates = np.argpartition(-keys, k - 1)[:k]
+        else:
+            candidates = np.arange(n)
+        best = candidates[np.argsort(-keys[candidates])]
+        return catalogue.recipe_ids[best].tolist()
+
+
+vector_scorer = VectorScorer()
+
+
+# Drop the cached matrix once a transaction that changed the catalogue commits
+def _mark_changed(target) -> None:
+    session = object_session(target)
+    if session is not None:
+        session.info[CHANGED_KEY] = True
+
+@event.listens_for(Recipe, 'after_insert')
+@event.listens_for(Recipe, 'after_update')
+@event.listens_for(Recipe, 'after_delete')
+@event.listens_for(RecipeCuisine, 'after_insert')
+@event.listens_for(RecipeCuisine, 'after_delete')
+def _catalogue_changed(mapper, connection, target):
+    _mark_changed(target)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop(CHANGED_KEY, False):
+        vector_scorer.invalidate()
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop(CHANGED_KEY, None)
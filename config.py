@@ -22,5 +22,58 @@ class Config:
     SESSION_COOKIE_HTTPONLY = True
     #Configure uploading image
     BASE_DIR = os.path.abspath(os.path.dirname(__file__)) 
-    UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static', 'uploads')  
+    # defaults to app/static/uploads
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER')
+    # Featured recipes: 'table' reads the materialized UserRecipeScore rows,
+    # 'numpy' scores the whole catalogue in-process (requires numpy)
+    RECOMMENDER_BACKEND = os.environ.get('RECOMMENDER_BACKEND', 'table')
+    # Seconds a user's groups directory response may be served from memory; 0 disables the cache
+    GROUPS_CACHE_TTL = float(os.environ.get('GROUPS_CACHE_TTL', 0))
+    # Threads handling post-commit events (achievements, notifications, scores); 0 runs them inline after the commit
+    EVENT_WORKERS = int(os.environ.get('EVENT_WORKERS', 2))
+    # Attempts per event handler before the event is given up
+    EVENT_MAX_ATTEMPTS = int(os.environ.get('EVENT_MAX_ATTEMPTS', 3))
+    # Create missing tables before the first request (also available as `flask create-tables`)
+    CREATE_TABLES_ON_FIRST_REQUEST = os.environ.get('CREATE_TABLES_ON_FIRST_REQUEST', '1') != '0'
+    # Argon2 password hashing cost; existing hashes are upgraded on the next successful verify
+    ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST', 10))
+    ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST', 65536))
+    ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM', 4))
+    # Processes hashing and verifying passwords off the request threads; 0 hashes in the request thread
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    # Where populate_database reads the recipe catalogue: TheMealDB-style API base URL, or a directory of <letter>.json pages
+    CATALOGUE_SOURCE = os.environ.get('CATALOGUE_SOURCE', 'https://www.themealdb.com/api/json/v1/1')
+    # Pages of the catalogue fetched at the same time
+    CATALOGUE_WORKERS = int(os.environ.get('CATALOGUE_WORKERS', 8))
+    # Recipes changed per transaction by `flask sync-catalogue`
+    CATALOGUE_SYNC_BATCH_SIZE = int(os.environ.get('CATALOGUE_SYNC_BATCH_SIZE', 100))
+    # Per-endpoint query counts, SQL time and latency percentiles at /metrics/; off unless INSTRUMENTATION=1
+    INSTRUMENTATION = os.environ.get('INSTRUMENTATION', '0') != '0'
+    # Bearer token that may read /metrics/ (admins can read it while logged in); unset: admins only
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # Where the metrics are written as JSON when the process exits; unset to skip
+    METRICS_DUMP_PATH = os.environ.get('METRICS_DUMP_PATH')
+    # Log requests running one SQL statement at least this many times (likely N+1); 0 disables
+    QUERY_REPEAT_THRESHOLD = int(os.environ.get('QUERY_REPEAT_THRESHOLD', 0))
+    # Threads re-encoding uploaded images; 0 processes them in the request thread
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+    # Uploads are downscaled to fit this many pixels on their longest side; larger pixel counts are rejected
+    IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', 2048))
+    IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 40_000_000))
+    # Sizes of the square thumbnail and the bounded medium variant, written as 'webp' or 'jpeg'
+    IMAGE_THUMB_SIZE = int(os.environ.get('IMAGE_THUMB_SIZE', 200))
+    IMAGE_MEDIUM_SIZE = int(os.environ.get('IMAGE_MEDIUM_SIZE', 800))
+    IMAGE_VARIANT_FORMAT = os.environ.get('IMAGE_VARIANT_FORMAT', 'webp')
+    # Who sends fingerprinted /assets/ files: 'app', 'x-accel' (nginx) or 'x-sendfile' (Apache, lighttpd)
+    STATIC_DELIVERY = os.environ.get('STATIC_DELIVERY', 'app')
+    # nginx internal location mapped to app/static, for STATIC_DELIVERY=x-accel
+    STATIC_ACCEL_PREFIX = os.environ.get('STATIC_ACCEL_PREFIX', '/protected-static')
+    # Largest single uploaded file in bytes; the upload is refused as soon as it grows past this
+    UPLOAD_MAX_FILE_SIZE = int(os.environ.get('UPLOAD_MAX_FILE_SIZE', 10 * 1024 * 1024))
+    # Serve TheMealDB recipe images from a local cache of resized copies instead of linking to the remote host
+    IMAGE_MIRROR = os.environ.get('IMAGE_MIRROR', '1') != '0'
+    # Cache folder (default app/static/mirror), its size cap in bytes and the remote fetch timeout in seconds
+    IMAGE_MIRROR_FOLDER = os.environ.get('IMAGE_MIRROR_FOLDER')
+    IMAGE_MIRROR_MAX_BYTES = int(os.environ.get('IMAGE_MIRROR_MAX_BYTES', 500 * 1024 * 1024))
+    IMAGE_MIRROR_TIMEOUT = float(os.environ.get('IMAGE_MIRROR_TIMEOUT', 10))
     #Configure JWT
@@ -396,7 +396,7 @@ const RecipeLists: React.FC = () => {
                 lid={id}
                 name={recipe.recipe_name}
                 difficulty={recipe.difficulty}
-                image={recipe.image}
+                image={`${config.serverUrl}/${recipe.image}`}
               />
             </Box>
           </Grid2>
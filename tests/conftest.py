@@ -0,0 +1,54 @@
+from __future__ import annotations
+from app import create_app
+from flask.testing import FlaskClient
+from app.models import db
+from config import Config
+import pytest
+
+# SQLite can't autoincrement a column of a composite primary key (Friendship,
+# RecipeRecipeList, ...); MySQL can. The tests never rely on those ids.
+for table in db.metadata.tables.values():
+    if len(table.primary_key.columns) > 1:
+        for column in table.primary_key.columns:
+            column.autoincrement = False
+
+
+class RequestClient(FlaskClient):
+    """Runs every request in an app context of its own, as the server does.
+
+    Otherwise requests would share the test's app context: its `g` (where
+    Flask-Login keeps the current user) and its database session.
+    """
+    def open(self, *args, **kwargs):
+        with self.application.app_context():
+            return super().open(*args, **kwargs)
+
+def make_config(tmp_path, **overrides) -> type:
+    class TestConfig(Config):
+        TESTING = True
+        SECRET_KEY = 'test'
+        # a file, so threads in a test share the database
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+        CREATE_TABLES_ON_FIRST_REQUEST = True
+        SESSION_COOKIE_SECURE = False
+        # event handlers run inline, right after the commit that emitted them
+        EVENT_WORKERS = 0
+        INSTRUMENTATION = False
+        PASSWORD_HASH_WORKERS = 0
+        IMAGE_WORKERS = 0
+        IMAGE_MIRROR_FOLDER = str(tmp_path / 'mirror')
+        UPLOAD_FOLDER = str(tmp_path / 'uploads')
+    for name, value in overrides.items():
+        setattr(TestConfig, name, value)
+    return TestConfig
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(make_config(tmp_path))
+    app.test_client_class = RequestClient
+    with app.app_context():
+        # tests working below the routes need the tables before any request is made
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
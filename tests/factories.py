@@ -0,0 +1,61 @@
+from __future__ import annotations
+from datetime import datetime
+from flask_login.utils import _create_identifier
+from werkzeug.datastructures import FileStorage
+from app.models import GroupMember, Recipe, User, UserGroup, db
+import io
+
+# Rows with every required column filled in, for tests that only care about a few
+
+def make_user(**columns) -> User:
+    now = datetime.now()
+    user = User(**{  # type: ignore
+        "fname": "Test", "lname": "User", "xp_points": 0, "user_level": 1, "is_admin": False, "is_super_admin": False,
+        "num_recipes_completed": 0, "colonial_floor": '1', "colonial_side": 'Mens', "date_created": now,
+        "last_logged_in": now, "num_reports": 0, "is_banned": False, "hasLeveled": False, **columns,
+    })
+    if user.username is None:
+        user.username = f"user{User.query.count() + 1}"
+    if user.email_address is None:
+        user.email_address = f"{user.username}@example.com"
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+def make_recipe(**columns) -> Recipe:
+    recipe = Recipe(**{  # type: ignore
+        "recipe_name": "Recipe", "difficulty": '1', "xp_amount": 100, "rating": 0, "image": '', "category": 'Test', **columns,
+    })
+    db.session.add(recipe)
+    db.session.commit()
+    return recipe
+
+def make_group(creator: User, members: tuple[User, ...] = (), **columns) -> UserGroup:
+    group = UserGroup(**{  # type: ignore
+        "name": "Group", "creator": creator.id, "description": "", "is_public": True, "num_reports": 0, **columns,
+    })
+    db.session.add(group)
+    db.session.flush()
+    for member in (creator, *members):
+        db.session.add(GroupMember(group_id=group.id, member_id=member.id, is_trusted=member is creator))  # type: ignore
+    db.session.commit()
+    return group
+
+def image_bytes(color=(200, 40, 40), size=(64, 48), kind='PNG') -> bytes:
+    from PIL import Image
+    out = io.BytesIO()
+    Image.new('RGB', size, color).save(out, kind)
+    return out.getvalue()
+
+def upload(data: bytes, filename: str = 'image.png') -> FileStorage:
+    """An uploaded file as a route receives it"""
+    return FileStorage(io.BytesIO(data), filename=filename)
+
+def log_in(client, user: User) -> None:
+    """Put `user` in the test client's session, as login_user would"""
+    with client.application.test_request_context(environ_base=client.environ_base):
+        identifier = _create_identifier()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+        session['_id'] = identifier
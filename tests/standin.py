@@ -0,0 +1,46 @@
+from __future__ import annotations
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+# A local HTTP server standing in for a remote service (the SSO provider's
+# JWKS endpoint, TheMealDB's image host). Tests set what each path answers
+# and read how often it was requested.
+
+class StandIn:
+    def __init__(self):
+        # path -> (status, content type, body)
+        self.routes: dict[str, tuple[int, str, bytes]] = {}
+        self.requests: Counter[str] = Counter()
+        # seconds every answer is held back, so concurrent callers overlap
+        self.delay = 0.0
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                standin.requests[self.path] += 1
+                time.sleep(standin.delay)
+                status, content_type, body = standin.routes.get(self.path, (404, 'text/plain', b'not found'))
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}{path}"
+
+    def __enter__(self) -> StandIn:
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
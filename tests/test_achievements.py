@@ -0,0 +1,101 @@
+from __future__ import annotations
+from app.achievements.engine import (ACHIEVEMENT_XP, CUISINE_COMPLETED, FRIEND_ADDED, PROFILE_PICTURE_CHANGED, RECIPE_COMPLETED,
+                                     RECIPES_SEARCHED, REVIEW_POSTED, RULES, SPECIAL_RECIPE_ID, apply_level, awarded_index, evaluate,
+                                     grant, level_for_xp)
+from app.models import Achievement, User, UserAchievement, UserNotifications, db
+from tests.factories import make_user
+import pytest
+
+# The achievement rules, awarding exactly once, and levels
+
+COMPLETED = dict(num_recipes_completed=0, recipe_id=1, difficulty='1')
+
+@pytest.fixture
+def player(app):
+    awarded_index.awarded.clear()
+    db.session.add_all([
+        Achievement(id=rule.achievement_id, image='', title=f"Achievement {rule.achievement_id}", isVisible=True, description='')  # type: ignore
+        for rule in RULES
+    ])
+    db.session.commit()
+    yield make_user()
+    awarded_index.awarded.clear()
+
+def owned(user: User) -> set[int]:
+    return {row.achievement_id for row in UserAchievement.query.filter_by(user_id=user.id)}
+
+@pytest.mark.parametrize('event_name, below, at, achievement_id', [
+    (RECIPE_COMPLETED, {**COMPLETED, 'num_recipes_completed': 0}, {**COMPLETED, 'num_recipes_completed': 1}, 1),
+    (RECIPE_COMPLETED, {**COMPLETED, 'num_recipes_completed': 9}, {**COMPLETED, 'num_recipes_completed': 10}, 6),
+    (RECIPE_COMPLETED, {**COMPLETED, 'num_recipes_completed': 49}, {**COMPLETED, 'num_recipes_completed': 50}, 7),
+    (RECIPE_COMPLETED, {**COMPLETED, 'recipe_id': SPECIAL_RECIPE_ID - 1}, {**COMPLETED, 'recipe_id': SPECIAL_RECIPE_ID}, 5),
+    (RECIPE_COMPLETED, {**COMPLETED, 'difficulty': '4'}, {**COMPLETED, 'difficulty': 5}, 12),
+    (CUISINE_COMPLETED, {'cuisines_completed': 2}, {'cuisines_completed': 3}, 2),
+    (CUISINE_COMPLETED, {'cuisines_completed': 28}, {'cuisines_completed': 29}, 10),
+    (REVIEW_POSTED, {'rating': 1}, {'rating': 0.5}, 9),
+    (REVIEW_POSTED, {'rating': 4.5}, {'rating': 5}, 8),
+    (RECIPES_SEARCHED, {'query': "easter"}, {'query': "easter egg"}, 13),
+])
+def test_rule_thresholds(player, event_name, below, at, achievement_id):
+    assert achievement_id not in evaluate(player.id, event_name, **below)
+    assert achievement_id in evaluate(player.id, event_name, **at)
+    db.session.commit()
+    assert achievement_id in owned(player)
+
+@pytest.mark.parametrize('event_name, achievement_id', [(FRIEND_ADDED, 4), (PROFILE_PICTURE_CHANGED, 11)])
+def test_unconditional_rules(player, event_name, achievement_id):
+    assert evaluate(player.id, event_name) == [achievement_id]
+
+def test_events_without_rules_award_nothing(player):
+    assert evaluate(player.id, 'recipe_rated', rating=5) == []
+
+def test_awarded_once_with_xp_and_a_notification(player):
+    context = {**COMPLETED, 'num_recipes_completed': 10}
+    assert sorted(evaluate(player.id, RECIPE_COMPLETED, **context)) == [1, 6]
+    # again in the same transaction, then after the commit, then with nothing remembered
+    assert evaluate(player.id, RECIPE_COMPLETED, **context) == []
+    db.session.commit()
+    assert evaluate(player.id, RECIPE_COMPLETED, **context) == []
+    awarded_index.awarded.clear()
+    assert evaluate(player.id, RECIPE_COMPLETED, **context) == []
+    db.session.commit()
+
+    assert owned(player) == {1, 6}
+    assert db.session.get(User, player.id).xp_points == 2 * ACHIEVEMENT_XP
+    assert UserNotifications.query.filter_by(user_id=player.id, notification_type='achievement').count() == 2
+
+def test_unknown_achievements_and_users_are_skipped(player):
+    assert grant(player.id, [999]) == []
+    assert grant(player.id + 1, [1]) == []
+    assert owned(player) == set()
+
+def test_level_follows_xp():
+    assert [level_for_xp(xp) for xp in (0, 999, 1000, 3999, 4000, 9000)] == [1, 1, 2, 2, 3, 4]
+
+def test_apply_level(player):
+    player.xp_points = 4000
+    apply_level(player)
+    assert (player.user_level, player.hasLeveled) == (3, 1)
+    player.hasLeveled = 0
+    apply_level(player)
+    assert player.hasLeveled == 0
+
+def test_award_levels_up(player):
+    player.xp_points = 1000 - ACHIEVEMENT_XP
+    db.session.commit()
+    evaluate(player.id, FRIEND_ADDED)
+    db.session.commit()
+    user = db.session.get(User, player.id)
+    assert (user.xp_points, user.user_level, bool(user.hasLeveled)) == (1000, 2, True)
+
+def test_rolled_back_awards_are_not_remembered(player):
+    assert evaluate(player.id, FRIEND_ADDED) == [4]
+    # found in the database by a second check in the same transaction
+    assert evaluate(player.id, FRIEND_ADDED) == []
+    db.session.rollback()
+    assert awarded_index.unknown(player.id, [4]) == [4]
+
+    assert evaluate(player.id, FRIEND_ADDED) == [4]
+    db.session.commit()
+    assert awarded_index.unknown(player.id, [4]) == []
+    assert owned(player) == {4}
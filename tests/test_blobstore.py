@@ -0,0 +1,117 @@
+from __future__ import annotations
+from app.blobstore import blob_digest, collect_garbage, store_image
+from app.models import RecipeList, Review, UploadBlob, UserGroup, db
+from tests.factories import image_bytes, make_group, make_recipe, make_user, upload
+import os
+import pytest
+
+# Content-addressed uploads: one file per distinct image, reference counted by the rows using it
+
+@pytest.fixture
+def folder(app):
+    return app.config['UPLOAD_FOLDER']
+
+def stored(data: bytes) -> str:
+    return store_image(upload(data))
+
+def refcount(path: str) -> int | None:
+    db.session.expire_all()
+    blob = db.session.get(UploadBlob, blob_digest(path))
+    return None if blob is None else blob.refcount
+
+def on_disk(folder: str, path: str) -> bool:
+    return os.path.exists(os.path.join(folder, os.path.basename(path)))
+
+def make_review(recipe, user, image: str | None) -> Review:
+    review = Review(recipe_id=recipe.id, user_id=user.id, text="Tasty", image=image, num_reports=0)  # type: ignore
+    db.session.add(review)
+    db.session.commit()
+    return review
+
+
+def test_identical_uploads_share_a_blob(app, folder):
+    data = image_bytes()
+    first = make_user(profile_picture=stored(data))
+    second = make_user(profile_picture=stored(data))
+    assert first.profile_picture == second.profile_picture
+    assert refcount(first.profile_picture) == 2
+    assert len([name for name in os.listdir(folder) if blob_digest(os.path.join('static', 'uploads', name))]) == 1
+
+def test_replacing_the_last_reference_removes_the_blob(app, folder):
+    user = make_user(profile_picture=stored(image_bytes((1, 2, 3))))
+    old = user.profile_picture
+    user.profile_picture = stored(image_bytes((4, 5, 6)))
+    db.session.commit()
+    assert refcount(old) is None and not on_disk(folder, old)
+    assert refcount(user.profile_picture) == 1 and on_disk(folder, user.profile_picture)
+
+def test_a_shared_blob_outlives_one_of_its_references(app, folder):
+    path = stored(image_bytes())
+    owner = make_user(profile_picture=path)
+    group = make_group(owner, image=path)
+    assert refcount(path) == 2
+    db.session.delete(db.session.get(UserGroup, group.id))
+    db.session.commit()
+    assert refcount(path) == 1 and on_disk(folder, path)
+
+@pytest.mark.parametrize('kind', ['review', 'group', 'list'])
+def test_deleting_the_referring_row_removes_the_blob(app, folder, kind):
+    user = make_user()
+    path = stored(image_bytes())
+    if kind == 'review':
+        row = make_review(make_recipe(), user, path)
+    elif kind == 'group':
+        row = make_group(user, image=path)
+    else:
+        row = RecipeList(name="Favourites", belongs_to=user.id, image=path)  # type: ignore
+        db.session.add(row)
+        db.session.commit()
+    assert refcount(path) == 1
+    db.session.delete(row)
+    db.session.commit()
+    assert refcount(path) is None and not on_disk(folder, path)
+
+def test_deleting_a_recipe_releases_its_reviews_images(app, folder):
+    # the reviews go by ON DELETE CASCADE, which no mapper event sees
+    recipe, user = make_recipe(), make_user()
+    path = stored(image_bytes())
+    make_review(recipe, user, path)
+    make_review(recipe, user, None)
+    db.session.delete(recipe)
+    db.session.commit()
+    assert refcount(path) is None and not on_disk(folder, path)
+
+def test_rolled_back_references_are_not_counted(app, folder):
+    user = make_user(profile_picture=stored(image_bytes((1, 1, 1))))
+    kept = user.profile_picture
+    user.profile_picture = stored(image_bytes((9, 9, 9)))
+    db.session.flush()
+    db.session.rollback()
+    assert refcount(kept) == 1 and on_disk(folder, kept)
+
+def test_collect_garbage(app, folder):
+    user = make_user(profile_picture=stored(image_bytes((1, 1, 1))))
+    # a request that saved its upload and then failed
+    orphan = stored(image_bytes((2, 2, 2)))
+    db.session.rollback()
+    legacy = os.path.join(folder, 'f00_photo.jpg')
+    with open(legacy, 'wb') as fout:
+        fout.write(image_bytes(kind='JPEG'))
+
+    # too young: an upload that may still be in flight
+    assert collect_garbage(min_age=3600) == {"blobs": 0, "files": 0}
+    assert collect_garbage(min_age=0) == {"blobs": 0, "files": 1}
+    assert not on_disk(folder, orphan) and os.path.exists(legacy)
+    assert collect_garbage(min_age=0, legacy=True) == {"blobs": 0, "files": 1}
+    assert not os.path.exists(legacy) and on_disk(folder, user.profile_picture)
+
+def test_recount_repairs_leaked_references(app, folder):
+    path = stored(image_bytes())
+    user = make_user(profile_picture=path)
+    # a reference dropped behind the mapper events' back
+    db.session.execute(db.update(UploadBlob).values(refcount=5))
+    db.session.execute(db.update(type(user)).values(profile_picture=None))
+    db.session.commit()
+    assert collect_garbage(min_age=0)["blobs"] == 0 and on_disk(folder, path)
+    assert collect_garbage(min_age=0, recount_first=True)["blobs"] == 1
+    assert not on_disk(folder, path)
@@ -0,0 +1,51 @@
+from __future__ import annotations
+from app.catalogue import CatalogueSource, import_catalogue
+from app.catalogue_sync import sync_catalogue
+from app.models import Cuisine, RecipeSource, UserCuisinePreference, UserRecipeScore, db
+from app.recommendations import featured_recipes_from_table
+from tests.factories import make_user
+import random
+import time
+
+# Catalogue import and sync against an in-memory source
+
+def meal(id: int, area: str) -> dict:
+    return {"idMeal": str(id), "strMeal": f"Meal {id}", "strMealThumb": '', "strCategory": 'Test', "strYoutube": '',
+            "strInstructions": 'Mix. Cook', "strArea": area, "strIngredient1": 'Salt', "strMeasure1": '1 tsp'}
+
+class PagesSource(CatalogueSource):
+    """Pages that finish downloading in a random order"""
+    def __init__(self, pages: dict[str, list[dict]]):
+        self.meals = pages
+
+    def pages(self) -> list[str]:
+        return list(self.meals)
+
+    def fetch(self, page: str) -> list[dict]:
+        time.sleep(random.random() / 50)
+        return self.meals[page]
+
+AREAS = ['British', 'American', 'French', 'Italian', 'Mexican']
+
+def test_import_assigns_ids_in_page_order(app):
+    source = PagesSource({letter: [meal(i * 10 + j, AREAS[(i + j) % len(AREAS)]) for j in range(3)] for i, letter in enumerate('abcdefgh')})
+    import_catalogue(source, workers=8)
+
+    # the first page's first meal is recipe 1 and its cuisine is cuisine 1, whichever page finished first
+    assert [source_row.source_key for source_row in RecipeSource.query.order_by(RecipeSource.recipe_id)] == \
+        [str(i * 10 + j) for i in range(8) for j in range(3)]
+    assert [cuisine.name for cuisine in Cuisine.query.order_by(Cuisine.id)] == AREAS
+
+def test_sync_rescores_new_and_changed_recipes_for_materialized_users(app):
+    import_catalogue(PagesSource({'a': [meal(1, 'British'), meal(2, 'French')]}), workers=1)
+    user = make_user()
+    british = Cuisine.query.filter_by(name='British').one()
+    db.session.add(UserCuisinePreference(user_id=user.id, cuisine_id=british.id, numComplete=0, userSelected=1))  # type: ignore
+    db.session.commit()
+    assert [recipe.id for recipe in featured_recipes_from_table(user.id, 1)] == [1]
+
+    # meal 2 moves to British and a new British meal appears
+    sync_catalogue(PagesSource({'a': [meal(1, 'French'), meal(2, 'British'), meal(3, 'British')]}), workers=1)
+    scores = {score.recipe_id: score.score for score in UserRecipeScore.query.filter_by(user_id=user.id)}
+    assert scores == {1: 0, 2: 5, 3: 5}
+    assert [recipe.id for recipe in featured_recipes_from_table(user.id, 2)] == [2, 3]
@@ -0,0 +1,78 @@
+from __future__ import annotations
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert
+from app.models import Challenge, ChallengeReport, UserBlock, db
+from tests.factories import log_in, make_user
+import statistics
+import time
+
+# Benchmark: the challenge listing filters in SQL, so its queries and latency
+# stay flat however many expired challenges have piled up.
+
+ACTIVE = 30
+REPEATS = 15
+
+def add_challenges(creator_id: int, count: int, ends: datetime) -> None:
+    rows = [
+        {"name": f"Challenge {i}", "creator": creator_id, "difficulty": '1', "theme": 'Test', "location": 'Here',
+         "start_time": ends - timedelta(hours=1), "end_time": ends, "is_complete": False, "num_reports": 0}
+        for i in range(count)
+    ]
+    for start in range(0, count, 10_000):
+        db.session.execute(insert(Challenge), rows[start:start + 10_000])
+    db.session.commit()
+
+def measure(client, url: str) -> tuple[float, int, dict]:
+    """Median latency in seconds and SQL statements per request"""
+    # the first request also creates missing tables
+    client.get(url)
+    statements = []
+    def count(*args):
+        statements.append(1)
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        latencies = []
+        for _ in range(REPEATS):
+            started = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+    return statistics.median(latencies), len(statements) // REPEATS, response.json
+
+
+def test_listing_stays_flat_with_100k_expired_challenges(app):
+    user = make_user()
+    client = app.test_client()
+    log_in(client, user)
+    url = '/challenges/?cursor=&per_page=20'
+
+    add_challenges(user.id, 1_000, datetime.now() - timedelta(days=30))
+    add_challenges(user.id, ACTIVE, datetime.now() + timedelta(days=1))
+    small_latency, small_queries, small = measure(client, url)
+
+    add_challenges(user.id, 99_000, datetime.now() - timedelta(days=30))
+    large_latency, large_queries, large = measure(client, url)
+    print(f"challenge listing: {small_latency * 1000:.1f} ms at 1k expired, {large_latency * 1000:.1f} ms at 100k "
+          f"({small_queries} and {large_queries} queries per request)")
+
+    assert large == small
+    assert len(large['all_challenges']['challenges']) == 20
+    assert large_queries == small_queries
+    # flat, with generous room for a noisy machine; the old Python-side filter grew ~100x
+    assert large_latency < small_latency * 3 + 0.01
+
+def test_listing_hides_expired_reported_and_blocked_challenges(app):
+    user, blocked = make_user(), make_user()
+    add_challenges(user.id, 3, datetime.now() + timedelta(days=1))
+    add_challenges(blocked.id, 2, datetime.now() + timedelta(days=1))
+    add_challenges(user.id, 2, datetime.now() - timedelta(days=1))
+    db.session.add(ChallengeReport(challenge_id=1, user_id=user.id, reason='spam'))  # type: ignore
+    db.session.add(UserBlock(blocked_user=blocked.id, blocked_by=user.id))  # type: ignore
+    db.session.commit()
+
+    client = app.test_client()
+    log_in(client, user)
+    listed = client.get('/challenges/?cursor=').json['all_challenges']['challenges']
+    assert [challenge['id'] for challenge in listed] == [2, 3]
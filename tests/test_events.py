@@ -0,0 +1,46 @@
+from __future__ import annotations
+from typing import NamedTuple
+from app import events
+from app.events import Envelope, EventBus
+from app.models import Cuisine, ProcessedEvent, db
+import pytest
+
+# Handler failures are retried; only a second delivery of the same event is skipped
+
+class Ping(NamedTuple):
+    cuisine_id: int
+
+@pytest.fixture
+def bus(monkeypatch):
+    monkeypatch.setattr(events, 'RETRY_DELAY', 0)
+    return EventBus()
+
+def test_integrity_errors_of_handlers_are_retried(app, bus):
+    db.session.add(Cuisine(id=1, name='Thai'))
+    db.session.commit()
+    calls = []
+
+    @bus.subscribe(Ping)
+    def add_cuisine(event):
+        # the first attempt collides with the existing cuisine
+        calls.append(event)
+        db.session.add(Cuisine(id=1 if len(calls) == 1 else event.cuisine_id, name=f'Cuisine {len(calls)}'))
+
+    envelope = Envelope('e1', Ping(cuisine_id=2))
+    bus.run(app, envelope, add_cuisine)
+    db.session.expire_all()
+    assert len(calls) == 2
+    assert db.session.get(Cuisine, 2).name == 'Cuisine 2'
+    assert db.session.query(ProcessedEvent).filter_by(event_id='e1').count() == 1
+
+def test_redelivered_events_run_once(app, bus):
+    calls = []
+
+    @bus.subscribe(Ping)
+    def count(event):
+        calls.append(event)
+
+    envelope = Envelope('e2', Ping(cuisine_id=1))
+    bus.run(app, envelope, count)
+    bus.run(app, envelope, count)
+    assert len(calls) == 1
@@ -0,0 +1,87 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.datastructures import MultiDict
+from app.groups.live import message_channel
+from app.groups.routes import DEFAULT_MESSAGE_LIMIT, MAX_MESSAGE_LIMIT, message_limit
+from app.models import Message, db
+from app.pubsub import broker
+from tests.factories import log_in, make_group, make_user
+import pytest
+import time
+
+@pytest.mark.parametrize('args, limit', [
+    ({}, DEFAULT_MESSAGE_LIMIT),
+    ({'limit': 'abc'}, DEFAULT_MESSAGE_LIMIT),
+    ({'limit': '10'}, 10),
+    ({'limit': '0'}, 1),
+    ({'limit': '-5'}, 1),
+    ({'limit': '100000'}, MAX_MESSAGE_LIMIT),
+])
+def test_message_limit(args, limit):
+    assert message_limit(MultiDict(args)) == limit
+
+
+@pytest.fixture
+def chat(app):
+    """A group with ten messages, and a logged-in member"""
+    # the broker is process-wide, and every test's database starts its ids over
+    broker.channels.clear()
+    user = make_user()
+    group = make_group(user)
+    messages = [Message(group_id=group.id, user_id=user.id, text=f"Message {i}", num_reports=0) for i in range(10)]  # type: ignore
+    db.session.add_all(messages)
+    db.session.commit()
+    client = app.test_client()
+    log_in(client, user)
+    return client, user, group, [message.id for message in messages]
+
+def texts(response) -> list[str]:
+    return [message["text"] for message in response.json]
+
+def test_message_windows(chat):
+    client, _, group, ids = chat
+    url = f'/groups/{group.id}/messages/'
+    assert len(client.get(url).json) == 10
+    assert texts(client.get(f'{url}?limit=3')) == ["Message 7", "Message 8", "Message 9"]
+    assert texts(client.get(f'{url}?limit=3&before_id={ids[7]}')) == ["Message 4", "Message 5", "Message 6"]
+    assert texts(client.get(f'{url}?limit=3&after_id={ids[2]}')) == ["Message 3", "Message 4", "Message 5"]
+    assert texts(client.get(f'{url}?after_id={ids[2]}&before_id={ids[5]}')) == ["Message 3", "Message 4"]
+    assert client.get(f'{url}?after_id={ids[-1]}').json == []
+
+def test_poll_answers_at_once_when_there_are_newer_messages(chat):
+    client, _, group, ids = chat
+    started = time.monotonic()
+    response = client.get(f'/groups/{group.id}/messages/poll/?after_id={ids[7]}&timeout=5')
+    assert texts(response) == ["Message 8", "Message 9"]
+    assert time.monotonic() - started < 1
+
+def test_poll_times_out_with_an_empty_list(chat):
+    client, _, group, ids = chat
+    started = time.monotonic()
+    response = client.get(f'/groups/{group.id}/messages/poll/?after_id={ids[-1]}&timeout=0.3')
+    assert response.status_code == 200 and response.json == []
+    assert time.monotonic() - started >= 0.3
+
+def test_poll_wakes_up_for_a_new_message(app, chat):
+    client, user, group, ids = chat
+    sender = app.test_client()
+    log_in(sender, user)
+
+    def send_soon():
+        time.sleep(0.3)
+        assert sender.post(f'/groups/{group.id}/messages/', json={"text": "Hello"}).status_code == 200
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        started = time.monotonic()
+        sent = executor.submit(send_soon)
+        response = client.get(f'/groups/{group.id}/messages/poll/?after_id={ids[-1]}&timeout=10')
+        sent.result()
+    assert texts(response) == ["Hello"]
+    assert time.monotonic() - started < 5
+
+def test_broker_only_publishes_committed_messages(app, chat):
+    _, user, group, ids = chat
+    db.session.add(Message(group_id=group.id, user_id=user.id, text="Never sent", num_reports=0))  # type: ignore
+    db.session.flush()
+    db.session.rollback()
+    assert broker.wait(message_channel(group.id), ids[-1], 0.1) == []
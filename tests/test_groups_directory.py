@@ -0,0 +1,100 @@
+from __future__ import annotations
+from sqlalchemy import event
+from app.groups.directory import directory_cache
+from app.models import UserNotifications, db
+from tests.factories import log_in, make_group, make_user
+import pytest
+
+# The groups directory: its three sections, both pagination modes and the response cache
+
+@pytest.fixture
+def directory(app):
+    """A user, some groups they can and can't see, and a logged-in client"""
+    directory_cache.clear()
+    user, other = make_user(), make_user()
+    groups = {
+        "public": [make_group(other, name=f"Public {i}") for i in range(7)],
+        "mine": make_group(user, name="Private mine", is_public=False),
+        "hidden": make_group(other, name="Private hidden", is_public=False),
+        "invited": make_group(other, name="Private invited", is_public=False),
+    }
+    db.session.add(UserNotifications(user_id=user.id, notification_text="Join us", notification_type='group_message', group_id=groups["invited"].id))  # type: ignore
+    db.session.add(UserNotifications(user_id=user.id, notification_text="Join us", notification_type='group_message', group_id=groups["public"][2].id))  # type: ignore
+    db.session.commit()
+    client = app.test_client()
+    log_in(client, user)
+    yield client, user, groups
+    directory_cache.clear()
+
+def ids(groups) -> list[int]:
+    return [group["id"] for group in groups]
+
+def visible_ids(groups) -> list[int]:
+    # public first, then by id
+    return [group.id for group in groups["public"]] + [groups["mine"].id]
+
+def test_sections(directory):
+    client, _, groups = directory
+    response = client.get('/groups/?per_page=3&page=3').json
+    assert ids(response["my_groups"]) == [groups["mine"].id]
+    # invited to a private group the user can't see: not listed
+    assert ids(response["invited_groups"]) == [groups["public"][2].id]
+    assert ids(response["all_groups"]) == visible_ids(groups)[6:]
+    assert response["total_pages"] == 3
+
+def test_cursor_pages_cover_every_visible_group_once(directory):
+    client, _, groups = directory
+    seen, cursor, pages = [], '', 0
+    while cursor is not None:
+        response = client.get(f'/groups/?per_page=3&cursor={cursor}').json
+        assert response["total_pages"] is None
+        seen += ids(response["all_groups"])
+        cursor = response["next_cursor"]
+        pages += 1
+    assert seen == visible_ids(groups)
+    assert pages == 3
+
+def test_cursor_pages_only_count_when_asked(app, directory):
+    client, _, _ = directory
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        client.get('/groups/?per_page=3&cursor=')
+        assert not any('count(' in statement.lower() for statement in statements)
+        assert client.get('/groups/?per_page=3&cursor=&include_total=1').json["total_pages"] == 3
+        assert any('count(' in statement.lower() for statement in statements)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+def test_bad_cursor(directory):
+    client, _, _ = directory
+    assert client.get('/groups/?cursor=not-a-cursor').status_code == 400
+
+def test_search(directory):
+    client, _, groups = directory
+    response = client.get('/groups/?search=PRIVATE').json
+    assert ids(response["all_groups"]) == [groups["mine"].id]
+    assert ids(response["my_groups"]) == [groups["mine"].id]
+    assert response["invited_groups"] == []
+    response = client.get('/groups/?search=public 3&cursor=').json
+    assert ids(response["all_groups"]) == [groups["public"][3].id]
+
+def test_cached_listing_is_invalidated_by_joining(app, directory):
+    client, _, groups = directory
+    app.config['GROUPS_CACHE_TTL'] = 60
+    assert ids(client.get('/groups/').json["my_groups"]) == [groups["mine"].id]
+    public = groups["public"][0]
+    # joining drops the user's cached listings
+    assert client.post(f'/groups/{public.id}/join/').status_code == 200
+    assert ids(client.get('/groups/').json["my_groups"]) == [public.id, groups["mine"].id]
+
+def test_cached_listing_is_served_until_invalidated(app, directory):
+    client, user, groups = directory
+    app.config['GROUPS_CACHE_TTL'] = 60
+    first = client.get('/groups/').json
+    make_group(user, name="Public new")
+    # created behind the routes' back: the cached copy is still served
+    assert client.get('/groups/').json == first
+    directory_cache.invalidate(user.id)
+    assert "Public new" in [group["name"] for group in client.get('/groups/').json["my_groups"]]
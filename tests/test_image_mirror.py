@@ -0,0 +1,150 @@
+from __future__ import annotations
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from app.image_mirror import mirror, mirror_recipe_images, url_key
+from tests.factories import make_recipe
+from tests.standin import StandIn
+import io
+import os
+import pytest
+import time
+
+# The recipe image mirror against a local stand-in for TheMealDB's image host
+
+def jpeg(color=(200, 80, 40)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+def forget_mirror_state() -> None:
+    # the mirror is a process-wide singleton; each test starts with an empty cache folder
+    mirror.failed.clear()
+    mirror.total_bytes = None
+    mirror.evicted = 0
+
+@pytest.fixture
+def host(app):
+    forget_mirror_state()
+    with StandIn() as standin:
+        yield standin
+    forget_mirror_state()
+
+def remote_recipe(host: StandIn, path: str, body: bytes | None = None):
+    host.routes[path] = (200, 'image/jpeg', jpeg() if body is None else body)
+    return make_recipe(image=host.url(path))
+
+def cached_files(app) -> set[str]:
+    folder = app.config['IMAGE_MIRROR_FOLDER']
+    return set(os.listdir(folder)) if os.path.isdir(folder) else set()
+
+
+def test_recipe_json_points_at_local_copies(app, host):
+    recipe = remote_recipe(host, '/meal.jpg')
+    data = recipe.to_json()
+    key = url_key(recipe.image)
+    assert data["image"] == f"recipe-images/{recipe.id}/{key}/medium.webp"
+    assert data["image_variants"]["thumb"] == f"recipe-images/{recipe.id}/{key}/thumb.webp"
+    assert make_recipe(image='').to_json()["image"] == ''
+
+def test_concurrent_first_requests_fetch_the_remote_image_once(app, host):
+    recipe = remote_recipe(host, '/meal.jpg')
+    url = '/' + recipe.to_json()["image"]
+    host.delay = 0.3
+
+    def get(_):
+        response = app.test_client().get(url)
+        return response.status_code, response.data
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        responses = list(executor.map(get, range(6)))
+
+    assert host.requests['/meal.jpg'] == 1
+    assert {status for status, _ in responses} == {200}
+    assert len({body for _, body in responses}) == 1
+    assert Image.open(io.BytesIO(responses[0][1])).format == 'WEBP'
+
+def test_cached_image_is_immutable_and_revalidates(app, host):
+    recipe = remote_recipe(host, '/meal.jpg')
+    url = '/' + recipe.to_json()["image"]
+    client = app.test_client()
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.cache_control.immutable and response.cache_control.max_age == 31536000
+
+    assert client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert host.requests['/meal.jpg'] == 1
+
+def test_outdated_key_redirects_to_the_current_one(app, host):
+    recipe = remote_recipe(host, '/meal.jpg')
+    current = recipe.to_json()["image"]
+    response = app.test_client().get(f"/recipe-images/{recipe.id}/{'0' * 16}/medium.webp")
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/' + current)
+
+def test_recipes_without_a_remote_image_are_not_found(app, host):
+    recipe = make_recipe(image='uploads/local.jpg')
+    assert app.test_client().get(f"/recipe-images/{recipe.id}/{url_key('x')}/medium.webp").status_code == 404
+
+def test_undecodable_image_falls_back_to_the_remote_url(app, host):
+    recipe = remote_recipe(host, '/broken.jpg', b'not an image at all')
+    client = app.test_client()
+    url = '/' + recipe.to_json()["image"]
+    response = client.get(url)
+    assert response.status_code == 302
+    assert response.headers['Location'] == recipe.image
+
+    # the failure is remembered instead of refetched
+    assert client.get(url).status_code == 302
+    assert host.requests['/broken.jpg'] == 1
+
+def test_unreachable_host_falls_back_to_the_remote_url(app, host):
+    recipe = make_recipe(image='http://127.0.0.1:1/meal.jpg')
+    response = app.test_client().get('/' + recipe.to_json()["image"])
+    assert response.status_code == 302
+    assert response.headers['Location'] == recipe.image
+
+def test_eviction_removes_the_least_recently_served_images(app, host):
+    body = jpeg()
+    first, second, third = (remote_recipe(host, f'/meal{i}.jpg', body) for i in range(3))
+    client = app.test_client()
+    for recipe in (first, second):
+        assert client.get('/' + recipe.to_json()["image"]).status_code == 200
+        assert client.get('/' + recipe.to_json()["image_variants"]["thumb"]).status_code == 200
+
+    folder = app.config['IMAGE_MIRROR_FOLDER']
+    pair = sum(os.path.getsize(os.path.join(folder, name)) for name in cached_files(app) if name.startswith(url_key(first.image)))
+    # both cached images were last used days ago, the second one longest ago
+    for recipe, days in ((first, 2), (second, 3)):
+        used = time.time() - days * 86400
+        for name in cached_files(app):
+            if name.startswith(url_key(recipe.image)):
+                os.utime(os.path.join(folder, name), (used, used))
+    # serving the first one marks it used again
+    assert client.get('/' + first.to_json()["image"]).status_code == 200
+    assert client.get('/' + first.to_json()["image_variants"]["thumb"]).status_code == 200
+
+    # room for two and a half images: the third one pushes the second out
+    app.config['IMAGE_MIRROR_MAX_BYTES'] = int(pair * 2.5)
+    assert client.get('/' + third.to_json()["image"]).status_code == 200
+
+    # eviction stops once the cache is back under 90% of the cap, which may leave one of the second's variants
+    cached = Counter(name.split('.')[0] for name in cached_files(app))
+    assert cached[url_key(first.image)] == cached[url_key(third.image)] == 2
+    assert cached[url_key(second.image)] == 2 - mirror.evicted
+    assert mirror.evicted >= 1
+
+def test_mirror_job_stops_once_the_cache_is_full(app, host):
+    body = jpeg()
+    for i in range(5):
+        remote_recipe(host, f'/meal{i}.jpg', body)
+    counts = mirror_recipe_images(workers=1)
+    assert counts == {"recipes": 5, "fetched": 5, "failed": 0, "skipped": 0}
+    pair = sum(os.path.getsize(os.path.join(app.config['IMAGE_MIRROR_FOLDER'], name)) for name in cached_files(app)) // 5
+
+    for i in range(5, 10):
+        remote_recipe(host, f'/meal{i}.jpg', body)
+    app.config['IMAGE_MIRROR_MAX_BYTES'] = int(pair * 6.5)
+    counts = mirror_recipe_images(workers=1)
+    assert counts["skipped"] == 5
+    assert counts["fetched"] == 2
+    assert sum(host.requests.values()) <= 5 + 3
@@ -0,0 +1,97 @@
+from __future__ import annotations
+from PIL import Image
+from app import static_assets
+from app.blobstore import store_image
+from app.images import InvalidImage, VARIANTS, image_urls, save_image, variant_path
+from app.models import RecipeList, db
+from app.static_assets import assets
+from tests.factories import image_bytes, make_user, upload
+import builtins
+import io
+import os
+import pytest
+
+# Uploads are sniffed, cleaned, downscaled and given variants (app/images.py)
+
+@pytest.fixture(autouse=True)
+def forget_fingerprints():
+    assets.fingerprints.entries.clear()
+    yield
+    assets.fingerprints.entries.clear()
+
+def stored_image(app, image: str) -> Image.Image:
+    return Image.open(os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(image)))
+
+def exif_jpeg(size=(60, 30), orientation=6) -> bytes:
+    image = Image.new('RGB', size, (10, 200, 10))
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    # GPS IFD with a latitude reference, the kind of thing that mustn't leak
+    exif[0x8825] = {1: 'N'}
+    out = io.BytesIO()
+    image.save(out, 'JPEG', exif=exif)
+    return out.getvalue()
+
+
+def test_type_comes_from_the_content(app):
+    with pytest.raises(InvalidImage):
+        save_image(upload(b'<svg xmlns="http://www.w3.org/2000/svg"/>' * 4, 'image.png'))
+    # a PNG named .jpg is stored as the PNG it is
+    assert save_image(upload(image_bytes(), 'image.jpg')).endswith('.png')
+
+def test_exif_is_applied_and_dropped(app):
+    path = save_image(upload(exif_jpeg(), 'photo.jpg'))
+    with stored_image(app, path) as image:
+        # orientation 6 is a quarter turn: 60x30 comes out upright as 30x60
+        assert image.size == (30, 60)
+        assert not image.getexif()
+        assert 'exif' not in image.info
+
+def test_originals_are_downscaled(app):
+    app.config['IMAGE_MAX_DIMENSION'] = 100
+    path = save_image(upload(image_bytes(size=(400, 200))))
+    with stored_image(app, path) as image:
+        assert image.size == (100, 50)
+
+def test_too_many_pixels_are_refused(app):
+    app.config['IMAGE_MAX_PIXELS'] = 100 * 100
+    with pytest.raises(InvalidImage):
+        save_image(upload(image_bytes(size=(101, 100))))
+    assert [name for name in os.listdir(app.config['UPLOAD_FOLDER']) if not name.startswith('.')] == []
+
+def test_variants_fall_back_to_the_original(app, monkeypatch):
+    monkeypatch.setattr(static_assets, 'RECHECK_INTERVAL', 0)
+    path = save_image(upload(image_bytes(size=(1000, 500))))
+    urls = image_urls(path)
+    assert len({urls['original'], *(urls[name] for name in VARIANTS)}) == 3
+    with stored_image(app, variant_path(path, 'thumb', 'webp')) as thumb:
+        assert thumb.size == (200, 200)
+
+    os.remove(os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(variant_path(path, 'medium', 'webp'))))
+    urls = image_urls(path)
+    assert urls['medium'] == urls['original'] != urls['thumb']
+
+def test_list_rendering_reuses_fingerprints(app, monkeypatch):
+    # a page of rows with images: files are stat()ed once, then not within RECHECK_INTERVAL, and never read
+    user = make_user()
+    paths = [store_image(upload(image_bytes(color=(i, i, i)))) for i in range(20)]
+    lists = [RecipeList(name=f"List {i}", belongs_to=user.id, image=path) for i, path in enumerate(paths)]  # type: ignore
+    db.session.add_all(lists)
+    db.session.commit()
+
+    calls = {"stat": 0, "open": 0}
+    real_stat, real_open = os.stat, builtins.open
+    def counting_stat(*args, **kwargs):
+        calls["stat"] += 1
+        return real_stat(*args, **kwargs)
+    def counting_open(*args, **kwargs):
+        calls["open"] += 1
+        return real_open(*args, **kwargs)
+    monkeypatch.setattr(static_assets.os, 'stat', counting_stat)
+    monkeypatch.setattr(builtins, 'open', counting_open)
+
+    first = [recipe_list.to_json() for recipe_list in lists]
+    assert calls == {"stat": 20 * 3, "open": 0}
+    calls.update(stat=0, open=0)
+    assert [recipe_list.to_json() for recipe_list in lists] == first
+    assert calls == {"stat": 0, "open": 0}
@@ -0,0 +1,118 @@
+from __future__ import annotations
+from sqlalchemy import text
+from app import create_app
+from app.instrumentation import BUCKETS_MS, EndpointStats, metrics
+from app.models import db
+from tests.conftest import RequestClient, make_config
+from tests.factories import log_in, make_user
+import pytest
+
+# /metrics/ exposes SQL text, so it needs the configured token or an admin
+
+@pytest.fixture
+def instrumented(tmp_path):
+    # tables up front, so creating them isn't counted against the first request
+    app = create_app(make_config(tmp_path, INSTRUMENTATION=True, METRICS_TOKEN='s3cret', QUERY_REPEAT_THRESHOLD=3,
+                                 CREATE_TABLES_ON_FIRST_REQUEST=False))
+    app.test_client_class = RequestClient
+
+    @app.route('/test/queries/<int:times>')
+    def run_queries(times):
+        for _ in range(times):
+            db.session.execute(text('SELECT 1'))
+        return {}
+
+    @app.route('/test/commit')
+    def commit():
+        db.session.execute(text('SELECT 2'))
+        db.session.commit()
+        return {}
+
+    @app.route('/test/fail')
+    def fail():
+        db.session.execute(text('SELECT 3'))
+        raise RuntimeError('broken')
+
+    @app.route('/test/unavailable')
+    def unavailable():
+        return {}, 503
+
+    metrics.endpoints.clear()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+def test_instrumentation_is_off_by_default(app):
+    from config import Config
+    assert not Config.INSTRUMENTATION
+    assert app.test_client().get('/metrics/').status_code == 404
+
+def test_metrics_need_the_token(instrumented):
+    client = instrumented.test_client()
+    # the test client's peer address is 127.0.0.1, which no longer grants access
+    assert client.get('/metrics/').status_code == 404
+    assert client.get('/metrics/', headers={'Authorization': 'Bearer wrong'}).status_code == 404
+    response = client.get('/metrics/', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert response.json['endpoints']['metrics']['requests'] == 2
+    assert set(response.json['caches']['verified_tokens']) >= {'hits', 'misses', 'size'}
+
+def test_admins_can_read_metrics(instrumented):
+    admin, user = instrumented.test_client(), instrumented.test_client()
+    log_in(admin, make_user(is_admin=True))
+    log_in(user, make_user())
+    assert admin.get('/metrics/').status_code == 200
+    assert user.get('/metrics/').status_code == 404
+
+def endpoint_stats(app, endpoint: str) -> dict:
+    response = app.test_client().get('/metrics/', headers={'Authorization': 'Bearer s3cret'})
+    return response.json['endpoints'][endpoint]
+
+def test_queries_and_commits_per_endpoint(instrumented):
+    client = instrumented.test_client()
+    client.get('/test/queries/1')
+    client.get('/test/queries/4')
+    client.get('/test/commit')
+
+    queries = endpoint_stats(instrumented, 'run_queries')
+    assert queries['requests'] == 2
+    assert queries['queries'] == {"total": 5, "mean": 2.5, "max": 4}
+    assert queries['commits'] == 0
+    assert queries['sql_ms']['total'] > 0
+    assert sum(bucket['count'] for bucket in queries['latency_histogram_ms']) == 2
+    assert endpoint_stats(instrumented, 'commit')['commits'] == 1
+
+def test_repeated_statements_from_the_threshold(instrumented):
+    client = instrumented.test_client()
+    client.get('/test/queries/2')
+    assert endpoint_stats(instrumented, 'run_queries')['repeated_statements'] == {"requests": 0, "last": None}
+    client.get('/test/queries/3')
+    client.get('/test/queries/1')
+    assert endpoint_stats(instrumented, 'run_queries')['repeated_statements'] == {
+        "requests": 1, "last": {"times": 3, "statement": "SELECT 1"},
+    }
+
+def test_failed_requests_are_recorded(instrumented):
+    client = instrumented.test_client()
+    with pytest.raises(RuntimeError):
+        client.get('/test/fail')
+    client.get('/test/unavailable')
+    client.get('/test/queries/1')
+
+    failed = endpoint_stats(instrumented, 'fail')
+    assert (failed['requests'], failed['errors'], failed['queries']['total']) == (1, 1, 1)
+    assert endpoint_stats(instrumented, 'unavailable')['errors'] == 1
+    assert endpoint_stats(instrumented, 'run_queries')['errors'] == 0
+
+def test_latency_percentiles_and_histogram():
+    stats = EndpointStats()
+    for ms in range(1, 101):
+        stats.record(ms / 1000, 0, 0.0, 0, None)
+    summary = stats.to_json()
+    assert summary['latency_ms'] == {"p50": 51.0, "p95": 96.0, "p99": 100.0}
+    counts = {bucket['le']: bucket['count'] for bucket in summary['latency_histogram_ms']}
+    assert [counts[bound] for bound in BUCKETS_MS[:5]] == [5, 5, 15, 25, 50]
+    assert sum(counts.values()) == 100
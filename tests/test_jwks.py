@@ -0,0 +1,89 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+from app.login.jwks import JWKSKeyStore
+from tests.standin import StandIn
+import json
+import jwt
+import pytest
+import time
+
+# The JWKS key store against a local stand-in for the provider's keys endpoint
+
+PATH = '/discovery/v2.0/keys'
+
+def new_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+def publish(standin: StandIn, keys: dict) -> None:
+    jwks = {"keys": [{**json.loads(RSAAlgorithm.to_jwk(key.public_key())), "kid": kid, "use": "sig"} for kid, key in keys.items()]}
+    standin.routes[PATH] = (200, 'application/json', json.dumps(jwks).encode())
+
+@pytest.fixture
+def provider():
+    with StandIn() as standin:
+        publish(standin, {"key-1": new_key()})
+        yield standin
+
+
+def test_keys_are_fetched_once_and_verify_tokens(provider):
+    private_key = new_key()
+    publish(provider, {"key-1": private_key})
+    store = JWKSKeyStore(provider.url(PATH))
+    assert provider.requests[PATH] == 0
+
+    token = jwt.encode({"sub": "someone"}, private_key, algorithm='RS256', headers={"kid": "key-1"})
+    for _ in range(5):
+        assert jwt.decode(token, key=store.get_key("key-1"), algorithms=['RS256'])["sub"] == "someone"
+    assert provider.requests[PATH] == 1
+
+def test_concurrent_cold_start_fetches_once(provider):
+    provider.delay = 0.2
+    store = JWKSKeyStore(provider.url(PATH))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        keys = list(executor.map(lambda _: store.get_key("key-1"), range(8)))
+    assert all(key is not None for key in keys)
+    assert provider.requests[PATH] == 1
+
+def test_unknown_kid_refreshes_once_for_concurrent_requests(provider):
+    store = JWKSKeyStore(provider.url(PATH), min_refresh_interval=0)
+    store.get_key("key-1")
+    publish(provider, {"key-1": new_key(), "key-2": new_key()})
+    provider.delay = 0.2
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        keys = list(executor.map(lambda _: store.get_key("key-2"), range(8)))
+    assert all(key is not None for key in keys)
+    assert provider.requests[PATH] == 2
+
+def test_unknown_kids_are_rate_limited(provider):
+    store = JWKSKeyStore(provider.url(PATH), min_refresh_interval=60)
+    store.get_key("key-1")
+    for kid in ("made-up-1", "made-up-2", "made-up-3"):
+        assert store.get_key(kid) is None
+    # the first fetch counts as the last attempt, so no refresh is allowed yet
+    assert provider.requests[PATH] == 1
+
+def test_stale_keys_are_served_while_refreshing_in_background(provider):
+    store = JWKSKeyStore(provider.url(PATH), ttl=0.1, stale_ttl=60)
+    first = store.get_key("key-1")
+    time.sleep(0.2)
+    provider.delay = 0.3
+    started = time.perf_counter()
+    assert store.get_key("key-1") is first
+    assert time.perf_counter() - started < 0.2
+    deadline = time.time() + 5
+    while provider.requests[PATH] < 2 or store.refreshing:
+        assert time.time() < deadline
+        time.sleep(0.05)
+    assert store.get_key("key-1") is not first
+
+def test_provider_outage_keeps_cached_keys(provider):
+    store = JWKSKeyStore(provider.url(PATH), ttl=0, stale_ttl=0, min_refresh_interval=0)
+    key = store.get_key("key-1")
+    provider.routes[PATH] = (503, 'text/plain', b'unavailable')
+    assert store.get_key("key-1") is key
+
+def test_creating_the_app_fetches_nothing(app):
+    from app.login.routes import signing_keys
+    assert signing_keys.fetched_at is None and signing_keys.last_attempt is None
@@ -0,0 +1,69 @@
+from __future__ import annotations
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+from app.login import routes
+from app.login.jwks import JWKSKeyStore
+from app.login.token_cache import VerifiedTokenCache
+from tests.factories import log_in, make_user
+import json
+import jwt
+import pytest
+import time
+
+# Logging out ends the session whatever state the SSO token is in, and revokes a verified token
+
+@pytest.fixture
+def sso(monkeypatch):
+    """Tokens signed by a local key that validate_jwt accepts"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwks = {"keys": [{**json.loads(RSAAlgorithm.to_jwk(key.public_key())), "kid": "key-1"}]}
+    monkeypatch.setattr(routes, 'TENANT_ID', 'tenant')
+    monkeypatch.setattr(routes, 'CLIENT_ID', 'client')
+    monkeypatch.setattr(routes, 'signing_keys', JWKSKeyStore('unused', fetch=lambda url: jwks))
+    monkeypatch.setattr(routes, 'verified_tokens', VerifiedTokenCache())
+
+    def sign(**claims) -> str:
+        claims = {"aud": 'client', "iss": "https://login.microsoftonline.com/tenant/v2.0", "exp": int(time.time()) + 600, **claims}
+        return jwt.encode(claims, key, algorithm='RS256', headers={"kid": "key-1"})
+    return sign
+
+def logged_in_client(app):
+    client = app.test_client()
+    log_in(client, make_user())
+    assert client.get('/login/current_user/').status_code == 200
+    return client
+
+def assert_logged_out(client):
+    with client.session_transaction() as session:
+        assert '_user_id' not in session
+
+@pytest.mark.parametrize('headers', [{}, {'Authorization': 'Bearer not-a-jwt'}, {'Authorization': 'Bearer a.b.c'}])
+def test_logout_ends_the_session_without_a_valid_token(app, headers):
+    client = logged_in_client(app)
+    assert client.post('/login/logout', headers=headers).status_code == 200
+    assert_logged_out(client)
+
+def test_logout_revokes_an_id_token(app, sso):
+    token = sso(sub='someone', preferred_username='someone@example.com')
+    with app.test_request_context():
+        assert routes.validate_jwt(token) is not None
+    client = logged_in_client(app)
+
+    response = client.post('/login/logout', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    assert response.json == {"message": "Successfully logged out"}
+    assert_logged_out(client)
+    with app.test_request_context():
+        assert routes.validate_jwt(token) is None
+
+def test_logout_revokes_an_access_token_by_jti(app, sso):
+    token = sso(sub='someone', jti='grant-1')
+    client = logged_in_client(app)
+
+    assert client.post('/login/logout', headers={'Authorization': f'Bearer {token}'}).status_code == 200
+    assert_logged_out(client)
+    with app.test_request_context():
+        assert routes.validate_jwt(token) is None
+        # a token reissued for the same grant is refused too, another grant isn't
+        assert routes.validate_jwt(sso(sub='someone', jti='grant-1', nonce='x')) is None
+        assert routes.validate_jwt(sso(sub='someone', jti='grant-2')) is not None
@@ -0,0 +1,78 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from app import notifications
+from app.models import UserNotifications, db
+from app.pubsub import broker
+from tests.factories import log_in, make_user
+import json
+import pytest
+import time
+
+# The server-sent notification stream (app/notifications.py)
+
+URL = '/settings/notifications/stream/'
+
+@pytest.fixture
+def stream(app, monkeypatch):
+    """A user with two notifications already, and a client logged in as them"""
+    broker.channels.clear()
+    monkeypatch.setattr(notifications, 'STREAM_LIFETIME', 1)
+    monkeypatch.setattr(notifications, 'HEARTBEAT_INTERVAL', 0.2)
+    user = make_user()
+    old = [notify(user.id, f"Old {i}") for i in range(2)]
+    client = app.test_client()
+    log_in(client, user)
+    return client, user, old
+
+def notify(user_id: int, text: str) -> int:
+    notification = UserNotifications(user_id=user_id, notification_text=text, notification_type='achievement')  # type: ignore
+    db.session.add(notification)
+    db.session.commit()
+    return notification.id
+
+def events(response) -> list[dict]:
+    """The notification events of a stream that has ended"""
+    found = []
+    for block in b''.join(response.response).decode().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n') if ': ' in line and not line.startswith(':'))
+        if fields.get('event') == 'notification':
+            found.append({"id": int(fields['id']), **json.loads(fields['data'])})
+    return found
+
+def texts(response) -> list[str]:
+    return [event["notification_text"] for event in events(response)]
+
+def test_first_connect_does_not_replay_the_history(stream):
+    client, _, _ = stream
+    response = client.get(URL)
+    assert response.mimetype == 'text/event-stream'
+    assert texts(response) == []
+
+def test_resume_from_last_event_id(stream):
+    client, user, old = stream
+    newer = notify(user.id, "Newer")
+    assert texts(client.get(URL, headers={'Last-Event-ID': str(old[0])})) == ["Old 1", "Newer"]
+    assert [event["id"] for event in events(client.get(f'{URL}?last_event_id={old[1]}'))] == [newer]
+
+def test_new_notification_wakes_the_stream(app, stream, monkeypatch):
+    client, user, _ = stream
+    # no heartbeat or end of stream would come round before the test gives up
+    monkeypatch.setattr(notifications, 'STREAM_LIFETIME', 30)
+    monkeypatch.setattr(notifications, 'HEARTBEAT_INTERVAL', 10)
+
+    def notify_soon():
+        time.sleep(0.3)
+        with app.app_context():
+            notify(user.id, "Fresh")
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        sent = executor.submit(notify_soon)
+        response = client.get(URL, buffered=False)
+        chunks = iter(response.response)
+        received = ''
+        while 'Fresh' not in received:
+            received += next(chunks).decode()
+        sent.result()
+    assert time.monotonic() - started < 3
+    response.close()
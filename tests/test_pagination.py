@@ -0,0 +1,58 @@
+from __future__ import annotations
+from app.pagination import InvalidCursor, decode_cursor, encode_cursor
+from tests.factories import log_in, make_recipe, make_user
+import base64
+import pytest
+
+# Cursors come from clients, so anything but the shape a page handed out is a 400
+
+def raw_cursor(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip('=')
+
+def test_round_trip():
+    assert decode_cursor(encode_cursor(["Apple Pie", 12]), (str, int)) == ["Apple Pie", 12]
+    assert decode_cursor(encode_cursor([1, 7]), (bool, int)) == [1, 7]
+    assert decode_cursor(encode_cursor([2.5, 3]), (float, int)) == [2.5, 3]
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!', raw_cursor('{'), raw_cursor('{"id": 1}'), raw_cursor('7'),
+    encode_cursor(["Apple Pie"]), encode_cursor(["Apple Pie", 12, 13]),
+    encode_cursor([12, "Apple Pie"]), encode_cursor(["Apple Pie", None]), encode_cursor(["Apple Pie", [12]]),
+    encode_cursor(["Apple Pie", {"id": 12}]), encode_cursor(["Apple Pie", 12.5]), encode_cursor(["Apple Pie", True]),
+])
+def test_malformed_cursors_are_refused(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, (str, int))
+
+def test_untyped_cursors_still_need_scalars():
+    assert decode_cursor(encode_cursor(["a", 1, 2.5, True])) == ["a", 1, 2.5, True]
+    with pytest.raises(InvalidCursor):
+        decode_cursor(encode_cursor([[1], 2]))
+
+def test_booleans_are_zero_or_one():
+    with pytest.raises(InvalidCursor):
+        decode_cursor(encode_cursor([2, 7]), (bool, int))
+
+
+BAD_CURSORS = [encode_cursor(["Apple Pie"]), encode_cursor([{"id": 1}, 2]), encode_cursor(["x", "y"]), raw_cursor('[')]
+
+@pytest.fixture
+def client(app):
+    make_recipe(recipe_name="Apple Pie")
+    client = app.test_client()
+    log_in(client, make_user())
+    return client
+
+@pytest.mark.parametrize('cursor', BAD_CURSORS)
+def test_listings_answer_bad_cursors_with_400(client, cursor):
+    assert client.post(f'/recipes/?cursor={cursor}').status_code == 400
+    assert client.get(f'/challenges/?cursor={cursor}').status_code == 400
+    assert client.get(f'/groups/?cursor={cursor}').status_code == 400
+
+@pytest.mark.parametrize('cursor', BAD_CURSORS + [encode_cursor([-5]), encode_cursor(["5"])])
+def test_search_answers_bad_cursors_with_400(client, cursor):
+    assert client.post(f'/recipes/?search_query=apple&cursor={cursor}').status_code == 400
+
+def test_good_cursors_still_work(client):
+    assert client.post(f'/recipes/?cursor={encode_cursor(["A", 0])}').json['recipes'][0]['recipe_name'] == "Apple Pie"
+    assert client.post(f'/recipes/?search_query=apple&cursor={encode_cursor([0])}').status_code == 200
@@ -0,0 +1,18 @@
+from __future__ import annotations
+from app.migrations import downgrade, upgrade
+from app.migrations.plans import check_plans
+
+# Query-plan regression: every hot lookup has to be answered through an index
+
+def test_hot_queries_use_an_index(app):
+    misses = [f"{name}: {plan}" for name, indexed, plan in check_plans() if not indexed]
+    assert misses == []
+
+def test_hot_path_migration_adds_the_indexes(app):
+    assert upgrade('0001') == ['0001']
+    assert downgrade('0000') == ['0001']
+    unindexed = {name for name, indexed, _ in check_plans() if not indexed}
+    assert {"user by username", "reviews of a recipe", "challenges still running"} <= unindexed
+
+    assert upgrade('0001') == ['0001']
+    assert all(indexed for _, indexed, _ in check_plans())
@@ -0,0 +1,84 @@
+from __future__ import annotations
+from sqlalchemy import event
+from app.events import RecipeCompleted, bus
+from app.models import CookedRecipe, Cuisine, RecipeCuisine, User, UserCuisinePreference, db
+from tests.factories import log_in, make_recipe, make_user
+import pytest
+
+# Benchmark: commits and SQL statements behind one "I cooked this" click
+
+class Counter:
+    def __init__(self):
+        self.commits = 0
+        self.statements = 0
+
+    def __enter__(self):
+        event.listen(db.engine, 'commit', self.commit)
+        event.listen(db.engine, 'before_cursor_execute', self.statement)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, 'commit', self.commit)
+        event.remove(db.engine, 'before_cursor_execute', self.statement)
+
+    def commit(self, *args):
+        self.commits += 1
+
+    def statement(self, *args):
+        self.statements += 1
+
+@pytest.fixture
+def cooking(app):
+    user = make_user()
+    recipe = make_recipe(xp_amount=300)
+    cuisines = [Cuisine(name="Italian"), Cuisine(name="French")]  # type: ignore
+    db.session.add_all(cuisines)
+    db.session.flush()
+    db.session.add_all([RecipeCuisine(recipe_id=recipe.id, cuisine_id=cuisine.id) for cuisine in cuisines])  # type: ignore
+    db.session.add(UserCuisinePreference(user_id=user.id, cuisine_id=cuisines[0].id, numComplete=2, userSelected=1))  # type: ignore
+    db.session.commit()
+
+    client = app.test_client()
+    log_in(client, user)
+    # the first request also creates missing tables
+    client.get('/login/current_user/')
+    return client, user.id, recipe.id, [cuisine.id for cuisine in cuisines]
+
+
+def test_completion_is_one_transaction(cooking, monkeypatch):
+    client, user_id, recipe_id, cuisine_ids = cooking
+    # the request alone; achievements and scores follow from the event after its commit
+    monkeypatch.setattr(bus, 'handlers', {})
+    with Counter() as counter:
+        response = client.post(f'/recipes/completed/{recipe_id}/')
+    print(f"completion request: {counter.commits} commit, {counter.statements} statements")
+
+    assert response.status_code == 200
+    assert counter.commits == 1
+    assert counter.statements <= 12
+    delta = response.json['profile_delta']
+    assert delta['xp_gained'] == 300
+    assert delta['num_recipes_completed'] == 1
+    assert delta['cuisines'] == [{"cuisine_id": cuisine_ids[0], "numComplete": 3}, {"cuisine_id": cuisine_ids[1], "numComplete": 1}]
+
+    user = db.session.get(User, user_id)
+    assert (user.xp_points, user.num_recipes_completed) == (300, 1)
+    assert db.session.get(CookedRecipe, (recipe_id, user_id)) is not None
+
+def test_completion_with_event_handlers(cooking):
+    client, _, recipe_id, _ = cooking
+    with Counter() as counter:
+        response = client.post(f'/recipes/completed/{recipe_id}/')
+    print(f"completion with handlers: {counter.commits} commits, {counter.statements} statements")
+
+    assert response.status_code == 200
+    # the request's commit plus one per event handler
+    assert counter.commits == 1 + len(bus.handlers[RecipeCompleted])
+
+def test_completing_again_counts_again(cooking):
+    client, user_id, recipe_id, _ = cooking
+    client.post(f'/recipes/completed/{recipe_id}/')
+    delta = client.post(f'/recipes/completed/{recipe_id}/').json['profile_delta']
+    assert delta['num_recipes_completed'] == 2
+    assert delta['xp_points'] == 600
+    assert CookedRecipe.query.filter_by(completed_by=user_id).count() == 1
@@ -0,0 +1,117 @@
+from __future__ import annotations
+from datetime import datetime
+from sqlalchemy import insert
+from app.models import Cuisine, Recipe, RecipeCuisine, Review, ScoredUser, UserCuisinePreference, UserRecipeScore, db
+from app.recommendations import (compute_user_scores, featured_recipes_from_table, featured_recipes_vectorized, materialize_user_scores,
+                                 refresh_user_scores)
+from app.vector_scoring import vector_scorer
+from tests.factories import make_user
+import pytest
+import random
+
+# The table (SQL) and vectorized (NumPy) recommenders must rank recipes identically
+
+RATINGS = [None, '0', '0.5', '2', '3.5', '5']
+
+@pytest.fixture
+def catalogue(app):
+    """A random catalogue with users holding cuisine preferences and reviews"""
+    rng = random.Random(1234)
+    cuisines = [Cuisine(name=f"Cuisine {i}") for i in range(8)]  # type: ignore
+    db.session.add_all(cuisines)
+    db.session.flush()
+    db.session.execute(insert(Recipe), [
+        {"id": id, "recipe_name": f"Recipe {id}", "difficulty": '1', "xp_amount": 100, "image": '', "category": 'Test',
+         # repeated ratings produce the score ties the recipe id has to break
+         "rating": rng.choice([0, 1.5, 2.5, 4])}
+        for id in range(1, 301)
+    ])
+    db.session.execute(insert(RecipeCuisine), [
+        {"recipe_id": id, "cuisine_id": cuisine.id}
+        for id in range(1, 301) for cuisine in rng.sample(cuisines, rng.randint(0, 2))
+    ])
+    db.session.commit()
+
+    users = [make_user() for _ in range(6)]
+    for user in users[1:]:
+        for cuisine in rng.sample(cuisines, rng.randint(1, 4)):
+            db.session.add(UserCuisinePreference(user_id=user.id, cuisine_id=cuisine.id, numComplete=rng.choice([0, 1, 6, 21]), userSelected=1))  # type: ignore
+        for recipe_id in rng.sample(range(1, 301), 15):
+            db.session.add(Review(recipe_id=recipe_id, user_id=user.id, text='', rating=rng.choice(RATINGS), num_reports=0))  # type: ignore
+    db.session.commit()
+    vector_scorer.invalidate()
+    yield users
+    vector_scorer.invalidate()
+
+
+@pytest.mark.parametrize('count', [1, 4, 25, 300, 500])
+def test_backends_return_the_same_top_k(catalogue, count):
+    for user in catalogue:
+        assert [recipe.id for recipe in featured_recipes_vectorized(user.id, count)] == \
+            [recipe.id for recipe in featured_recipes_from_table(user.id, count)]
+
+def test_vectorized_scores_match_sql_scores(catalogue):
+    for user in catalogue:
+        scored, scores = vector_scorer.scores(user.id)
+        assert dict(zip(scored.recipe_ids.tolist(), scores.tolist())) == compute_user_scores(user.id)
+
+def test_backends_agree_after_a_review(catalogue):
+    user = catalogue[1]
+    featured_recipes_from_table(user.id)
+    top = featured_recipes_from_table(user.id, 1)[0]
+    db.session.add(Review(recipe_id=top.id, user_id=user.id, text='', rating='4', num_reports=0))  # type: ignore
+    refresh_user_scores(user.id, [top.id])
+    db.session.commit()
+
+    ranking = [recipe.id for recipe in featured_recipes_from_table(user.id, 10)]
+    assert top.id not in ranking
+    assert [recipe.id for recipe in featured_recipes_vectorized(user.id, 10)] == ranking
+
+def test_empty_catalogue(app):
+    user = make_user()
+    assert featured_recipes_vectorized(user.id) == featured_recipes_from_table(user.id) == []
+
+
+def test_partial_rescoring_waits_for_materialization(app):
+    user = make_user()
+    recipes = [Recipe(id=id, recipe_name=f"Recipe {id}", difficulty='1', xp_amount=100, image='', category='Test', rating=4) for id in range(1, 6)]  # type: ignore
+    db.session.add_all(recipes)
+    db.session.commit()
+    # a review before the user ever loaded the feed
+    refresh_user_scores(user.id, [3])
+    db.session.commit()
+    assert UserRecipeScore.query.count() == 0
+
+    assert [recipe.id for recipe in featured_recipes_from_table(user.id)] == [1, 2, 3, 4]
+    assert UserRecipeScore.query.filter_by(user_id=user.id).count() == 5
+
+def test_concurrent_first_loads_materialize_once(app):
+    user = make_user()
+    db.session.add(Recipe(id=1, recipe_name="Recipe", difficulty='1', xp_amount=100, image='', category='Test', rating=0))  # type: ignore
+    db.session.commit()
+    # another request materializes the scores and commits first
+    with db.engine.begin() as connection:
+        connection.execute(insert(ScoredUser), [{"user_id": user.id, "materialized_at": datetime.now()}])
+        connection.execute(insert(UserRecipeScore), [{"user_id": user.id, "recipe_id": 1, "score": 7}])
+
+    materialize_user_scores(user.id)
+    assert ScoredUser.query.count() == 1
+    assert [(score.recipe_id, score.score) for score in UserRecipeScore.query] == [(1, 7)]
+
+def test_losing_the_race_keeps_the_callers_changes(app):
+    user = make_user()
+    with db.engine.begin() as connection:
+        connection.execute(insert(ScoredUser), [{"user_id": user.id, "materialized_at": datetime.now()}])
+
+    # the request was in the middle of something else
+    cuisine = Cuisine(name="Pending")  # type: ignore
+    db.session.add(cuisine)
+    user.xp_points = 50
+    materialize_user_scores(user.id)
+
+    assert cuisine in db.session and cuisine.id is not None
+    db.session.commit()
+    db.session.expire_all()
+    assert Cuisine.query.filter_by(name="Pending").count() == 1
+    assert user.xp_points == 50
+    assert ScoredUser.query.count() == 1
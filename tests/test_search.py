@@ -0,0 +1,86 @@
+from __future__ import annotations
+from sqlalchemy import or_
+from app.models import Cuisine, Recipe, RecipeCuisine, db
+from app.search import recipe_index
+from tests.factories import make_recipe
+import pytest
+
+# The in-memory recipe search against the SQL it replaced
+
+RECIPES = [
+    ("Spicychicken Wings", "Chicken", "American"),
+    ("Chicken Curry", "Chicken", "Indian"),
+    ("Butter Chicken", "Chicken", "Indian"),
+    ("Beef Wellington", "Beef", "British"),
+    ("Chick Pea Salad", "Vegetarian", "Moroccan"),
+    ("Pad Thai", "Noodles", "Thai"),
+    ("Thai Green Curry", "Chicken", "Thai"),
+    ("Apple Pie", "Dessert", "American"),
+    ("Pineapple Upside-Down Cake", "Dessert", "American"),
+    ("Eton Mess", "Dessert", "British"),
+]
+
+@pytest.fixture
+def catalogue(app):
+    recipe_index.invalidate()
+    cuisines: dict[str, Cuisine] = {}
+    for name, category, cuisine in RECIPES:
+        recipe = make_recipe(recipe_name=name, category=category)
+        if cuisine not in cuisines:
+            cuisines[cuisine] = Cuisine(name=cuisine)  # type: ignore
+            db.session.add(cuisines[cuisine])
+            db.session.flush()
+        db.session.add(RecipeCuisine(recipe_id=recipe.id, cuisine_id=cuisines[cuisine].id))  # type: ignore
+    db.session.commit()
+    yield cuisines
+    recipe_index.invalidate()
+
+def sql_search(query: str) -> list[tuple[int, int]]:
+    """(id, tier) of every match, as post_recipes used to find and order them"""
+    name_start = Recipe.recipe_name.ilike(f"{query}%")
+    name_contains = Recipe.recipe_name.ilike(f"%{query}%")
+    category = Recipe.category.ilike(f"%{query}%")
+    cuisine = Cuisine.name.ilike(f"%{query}%")
+    rows = db.session.query(Recipe.id, name_start, name_contains, category, cuisine).join(
+        RecipeCuisine, RecipeCuisine.recipe_id == Recipe.id
+    ).join(
+        Cuisine, Cuisine.id == RecipeCuisine.cuisine_id
+    ).filter(or_(name_start, name_contains, category, cuisine))
+    return [(recipe_id, flags.index(True)) for recipe_id, *flags in rows]
+
+@pytest.mark.parametrize('query', ['chick', 'CHICKEN', 'curry', 'chicken curry', 'thai', 'ai', 'a', 'pie', 'apple', 'brit', 'upside-down', 'es', 'xyz'])
+def test_matches_the_old_query(catalogue, query):
+    expected = dict(sql_search(query))
+    found = recipe_index.search(query)
+    assert set(found) == set(expected)
+    # tiers in the old order: name prefix, name, category, cuisine
+    assert [expected[recipe_id] for recipe_id in found] == sorted(expected[recipe_id] for recipe_id in found)
+
+def test_substrings_inside_words_match(catalogue):
+    names = {recipe.id: recipe.recipe_name for recipe in Recipe.query}
+    assert "Spicychicken Wings" in [names[recipe_id] for recipe_id in recipe_index.search('chick')]
+
+def test_index_follows_inserts_updates_and_deletes(catalogue):
+    assert recipe_index.search('lasagne') == []
+    recipe = make_recipe(recipe_name="Lasagne", category="Pasta")
+    assert recipe_index.search('lasagne') == [recipe.id]
+
+    recipe.recipe_name = "Vegetable Bake"
+    db.session.commit()
+    assert recipe_index.search('lasagne') == []
+    assert recipe_index.search('table bake') == [recipe.id]
+
+    db.session.add(RecipeCuisine(recipe_id=recipe.id, cuisine_id=catalogue["British"].id))  # type: ignore
+    db.session.commit()
+    assert recipe.id in recipe_index.search('british')
+
+    db.session.delete(recipe)
+    db.session.commit()
+    assert recipe_index.search('table bake') == []
+
+def test_rolled_back_changes_are_not_indexed(catalogue):
+    recipe = Recipe.query.filter_by(recipe_name="Eton Mess").one()
+    recipe.recipe_name = "Renamed"
+    db.session.flush()
+    db.session.rollback()
+    assert recipe_index.search('eton') == [recipe.id]
@@ -0,0 +1,86 @@
+from __future__ import annotations
+from app.blobstore import store_image
+from app.static_assets import asset_url, assets
+from tests.factories import image_bytes, upload
+import os
+import pytest
+
+# Fingerprinted, year-long cached delivery of uploads (app/static_assets.py)
+
+@pytest.fixture
+def asset(app):
+    """URL of a stored upload, and the file's absolute path"""
+    assets.fingerprints.entries.clear()
+    path = store_image(upload(image_bytes()))
+    yield '/' + asset_url(path), os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(path))
+    assets.fingerprints.entries.clear()
+
+def test_served_immutable_with_an_etag(app, asset):
+    url, path = asset
+    response = app.test_client().get(url)
+    assert response.status_code == 200
+    with open(path, 'rb') as fin:
+        assert response.data == fin.read()
+    assert response.headers['ETag']
+    assert response.cache_control.immutable and response.cache_control.max_age == 365 * 24 * 3600
+
+def test_if_none_match_is_304(app, asset):
+    url, _ = asset
+    client = app.test_client()
+    etag = client.get(url).headers['ETag']
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.data == b''
+
+def test_ranges_are_206(app, asset):
+    url, path = asset
+    response = app.test_client().get(url, headers={'Range': 'bytes=0-9'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f"bytes 0-9/{os.path.getsize(path)}"
+    assert len(response.data) == 10
+
+def test_outdated_fingerprint_redirects(app, asset):
+    url, _ = asset
+    _, _, fingerprint, folder, filename = url.split('/')
+    response = app.test_client().get(f'/assets/{"0" * len(fingerprint)}/{folder}/{filename}')
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith(url)
+    assert response.cache_control.no_cache
+
+def test_changed_legacy_file_gets_a_new_url(app):
+    folder = app.config['UPLOAD_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, 'legacy.png')
+    with open(path, 'wb') as fout:
+        fout.write(image_bytes((1, 1, 1)))
+    before = assets.fingerprints.get(path, recheck=True)
+    with open(path, 'wb') as fout:
+        fout.write(image_bytes((2, 2, 2)) + b'\0')
+    assert assets.fingerprints.get(path, recheck=True) != before
+
+@pytest.mark.parametrize('url', [
+    '/assets/0123456789abcdef/uploads/../../../config.py',
+    '/assets/0123456789abcdef/uploads/..%2F..%2Fmodels.py',
+    '/assets/0123456789abcdef/secrets/config.py',
+    '/assets/0123456789abcdef/uploads/missing.png',
+])
+def test_outside_files_are_404(app, url):
+    assert app.test_client().get(url).status_code == 404
+
+def test_x_accel_delivery(app, asset):
+    url, _ = asset
+    app.config['STATIC_DELIVERY'] = 'x-accel'
+    client = app.test_client()
+    response = client.get(url)
+    assert response.status_code == 200 and response.data == b''
+    assert response.headers['X-Accel-Redirect'] == '/protected-static/uploads/' + url.rsplit('/', 1)[1]
+    assert response.headers['Content-Type'] == 'image/png'
+    assert response.cache_control.immutable
+    response = client.get(url, headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304 and 'X-Accel-Redirect' not in response.headers
+
+def test_x_sendfile_delivery(app, asset):
+    url, path = asset
+    app.config['STATIC_DELIVERY'] = 'x-sendfile'
+    response = app.test_client().get(url)
+    assert response.status_code == 200 and response.data == b''
+    assert response.headers['X-Sendfile'] == path
@@ -0,0 +1,58 @@
+from __future__ import annotations
+from app.login import token_cache
+from app.login.token_cache import VerifiedTokenCache
+import pytest
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(token_cache.time, 'time', lambda: now[0])
+    return now
+
+def test_least_recently_used_tokens_are_dropped(clock):
+    cache = VerifiedTokenCache(max_size=2)
+    cache.put('a', {"exp": 2000})
+    cache.put('b', {"exp": 2000})
+    assert cache.get('a') is not None
+    cache.put('c', {"exp": 2000})
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.stats()["size"] == 2
+
+def test_entries_expire_at_exp(clock):
+    cache = VerifiedTokenCache()
+    cache.put('a', {"exp": 1010, "sub": "someone"})
+    cache.put('no-exp', {"sub": "someone"})
+    cache.put('expired', {"exp": 1000})
+    assert cache.get('a') == {"exp": 1010, "sub": "someone"}
+    assert cache.get('no-exp') is None and cache.get('expired') is None
+    clock[0] = 1010
+    assert cache.get('a') is None
+
+def test_discard(clock):
+    cache = VerifiedTokenCache()
+    cache.put('a', {"exp": 2000})
+    cache.discard('a')
+    assert cache.get('a') is None
+
+def test_hits_and_misses_are_counted(clock):
+    cache = VerifiedTokenCache()
+    assert cache.get('a') is None
+    cache.put('a', {"exp": 2000})
+    cache.get('a')
+    cache.get('a')
+    assert cache.stats() == {"hits": 2, "misses": 1, "size": 1, "max_size": cache.max_size, "revoked": 0}
+
+def test_revoked_tokens_stay_out_until_they_expire(clock):
+    cache = VerifiedTokenCache()
+    claims = {"exp": 1010, "jti": "j1"}
+    cache.put('a', claims)
+    cache.revoke('a', claims)
+    assert cache.get('a') is None
+    cache.put('a', claims)
+    assert cache.get('a') is None
+    # another token with the same jti is the same grant
+    assert cache.is_revoked('b', {"exp": 1010, "jti": "j1"})
+    assert not cache.is_revoked('c', {"exp": 1010, "jti": "j2"})
+    clock[0] = 1011
+    assert not cache.is_revoked('a', claims)
@@ -0,0 +1,74 @@
+from __future__ import annotations
+from app.images import SNIFF_BYTES
+from app.models import User, db
+from tests.factories import image_bytes, log_in, make_user
+import io
+import os
+import pytest
+
+# Uploads are streamed to disk, hashed and type-checked as they arrive (app/uploads.py)
+
+URL = '/profile/change_profile_pic/'
+
+@pytest.fixture
+def user(app):
+    return make_user()
+
+@pytest.fixture
+def client(app, user):
+    client = app.test_client()
+    log_in(client, user)
+    return client
+
+def post(client, data: bytes, filename: str = 'me.png'):
+    return client.post(URL, data={'profile_picture': (io.BytesIO(data), filename)}, content_type='multipart/form-data')
+
+def leftovers(app) -> list[str]:
+    folder = app.config['UPLOAD_FOLDER']
+    return [name for name in os.listdir(folder) if name.endswith('.part')] if os.path.isdir(folder) else []
+
+
+def test_image_is_stored_under_its_digest(app, client):
+    response = post(client, image_bytes())
+    assert response.status_code == 200
+    path = response.json['profile_picture_url']
+    assert os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(path)))
+    assert leftovers(app) == []
+
+    other = app.test_client()
+    log_in(other, make_user())
+    assert post(other, image_bytes()).json['profile_picture_url'] == path
+
+def test_non_images_are_refused_with_415(app, client):
+    response = post(client, b'%PDF-1.7 ' + b'x' * 1000, 'me.png')
+    assert response.status_code == 415
+    assert response.is_json and 'JPEG' in response.json['message']
+    assert leftovers(app) == []
+
+def test_oversized_parts_are_refused_with_413(app, client, user):
+    app.config['UPLOAD_MAX_FILE_SIZE'] = 10_000
+    response = post(client, image_bytes() + b'\0' * 20_000)
+    assert response.status_code == 413
+    assert response.is_json
+    assert leftovers(app) == []
+    db.session.expire_all()
+    assert db.session.get(User, user.id).profile_picture is None
+
+def test_parts_shorter_than_the_sniffed_prefix_are_refused(app, client):
+    response = post(client, b'\x89PNG'[:SNIFF_BYTES - 8])
+    assert response.status_code == 400
+    assert leftovers(app) == []
+
+def test_declared_length_is_refused_before_reading(app, client):
+    # the image itself is small enough: only the part's Content-Length gives it away
+    app.config['UPLOAD_MAX_FILE_SIZE'] = 10_000
+    boundary = 'b0undary'
+    body = (
+        f'--{boundary}\r\n'
+        'Content-Disposition: form-data; name="profile_picture"; filename="me.png"\r\n'
+        'Content-Type: image/png\r\n'
+        'Content-Length: 50000\r\n\r\n'
+    ).encode() + image_bytes() + f'\r\n--{boundary}--\r\n'.encode()
+    response = client.post(URL, data=body, content_type=f'multipart/form-data; boundary={boundary}')
+    assert response.status_code == 413
+    assert leftovers(app) == []